@@ -0,0 +1,100 @@
+"""Benchmark the BM25 index and the hybrid (vector + BM25) retrieval overhead.
+
+Indexes synthetic FAQ like chunks (words and product/error codes) into the local
+vector store and a BM25 index, then measures the ingestion time, index load time
+and the query latency of the vector, BM25 and hybrid (RRF) retrieval.
+
+    python hack/bench_hybrid.py --chunks 100000
+"""
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from langchain.schema import Document
+
+from llmapps.app.sparse import BM25Index, HybridRetriever
+from llmapps.app.vectorstore import LocalVectorStore
+
+
+class RandomEmbeddings:
+    def __init__(self, dim):
+        self.dim = dim
+        self.rng = np.random.default_rng(0)
+
+    def embed_documents(self, texts):
+        return self.rng.normal(size=(len(texts), self.dim)).tolist()
+
+    def embed_query(self, text):
+        return self.rng.normal(size=self.dim).tolist()
+
+
+def make_chunks(num_chunks, rnd):
+    words = [f"word{i}" for i in range(20000)]
+    chunks = []
+    for i in range(num_chunks):
+        text = " ".join(rnd.choices(words, k=120))
+        chunks.append(
+            Document(
+                page_content=f"{text} error ERR-{i} product X{i % 5000}-PRO",
+                metadata={"doc_uid": str(i), "chunk": 0},
+            )
+        )
+    return chunks
+
+
+def latency(func, queries):
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        func(query)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    root = tempfile.mkdtemp()
+    embeddings = RandomEmbeddings(args.dim)
+    vector_store = LocalVectorStore(embeddings, "bench", root)
+    index = BM25Index(f"{root}/bm25")
+    chunks = make_chunks(args.chunks, rnd)
+
+    start = time.perf_counter()
+    for i in range(0, len(chunks), args.batch_size):
+        index.add_documents(chunks[i : i + args.batch_size])
+    print(f"BM25 indexing: {time.perf_counter() - start:.2f} sec")
+    for i in range(0, len(chunks), args.batch_size):
+        vector_store.add_documents(chunks[i : i + args.batch_size])
+    start = time.perf_counter()
+    index = BM25Index(f"{root}/bm25")
+    print(f"BM25 index load: {time.perf_counter() - start:.2f} sec")
+
+    queries = [
+        f"what does error ERR-{rnd.randrange(args.chunks)} mean "
+        f"for word{rnd.randrange(20000)}"
+        for _ in range(args.queries)
+    ]
+    retriever = HybridRetriever(vector_store=vector_store, sparse_index=index)
+    index.search(queries[0])  # build the postings arrays of the common terms
+    print(f"{'retrieval':10} {'p50 ms':>8}")
+    for name, func in {
+        "vector": lambda q: vector_store.similarity_search(q, k=20),
+        "bm25": lambda q: index.search(q, k=20),
+        "hybrid": retriever.get_relevant_documents,
+    }.items():
+        print(f"{name:10} {latency(func, queries):8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Benchmark the local vector store quantization modes, recall vs. memory.
+
+Stores the same embeddings with each quantization mode (none, int8, binary, pq),
+then measures the codes memory per vector, the query latency and the recall@k vs.
+the exact float32 search, with the candidates re-scoring and without it (the first
+pass alone). Uses random (clustered) embeddings, or the vectors of an ingested
+local store collection (--collection-path).
+
+    python hack/bench_quantization.py --rows 100000
+    python hack/bench_quantization.py --collection-path data/vectors/default
+"""
+
+import argparse
+import json
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from llmapps.app.vectorstore import LocalVectorStore
+
+
+def make_vectors(args, rng):
+    # clustered vectors (topics), real embeddings are far from uniform
+    centers = rng.normal(size=(args.rows // 100 + 1, args.dim))
+    topics = rng.integers(0, len(centers), args.rows)
+    vectors = centers[topics] + rng.normal(scale=0.5, size=(args.rows, args.dim))
+    return vectors.astype(np.float32)
+
+
+def load_vectors(path):
+    """The vectors of a local vector store collection directory."""
+    path = Path(path)
+    with open(path / "meta.json") as fp:
+        meta = json.load(fp)
+    vectors = np.memmap(
+        path / "vectors.f32",
+        dtype=np.float32,
+        mode="r",
+        shape=(meta["capacity"], meta["dim"]),
+    )
+    return np.asarray(vectors[: meta["rows"]])
+
+
+def bench(name, vectors, queries, root, args, **kwargs):
+    store = LocalVectorStore(None, name, root, quantization_min_rows=0, **kwargs)
+    for i in range(0, len(vectors), args.batch_size):
+        batch = vectors[i : i + args.batch_size]
+        store.add_embeddings([(str(i + j), v) for j, v in enumerate(batch.tolist())])
+    search = store.similarity_search_by_vector
+    search(queries[0].tolist(), args.k)  # warm up (and train the quantizer)
+    times, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        docs = search(query.tolist(), args.k)
+        times.append((time.perf_counter() - start) * 1000)
+        results.append({doc.page_content for doc in docs})
+    codes = store._codes.array if store._codes else store._vectors.array
+    bytes_per_vector = codes.shape[1] * codes.dtype.itemsize
+    return bytes_per_vector, statistics.median(times), results
+
+
+def recall(expected, found):
+    hits = sum(len(e & f) for e, f in zip(expected, found))
+    return hits / sum(len(e) for e in expected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--collection-path", type=str, help="local store collection")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--pq-subvectors", type=int, default=None)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.collection_path:
+        vectors = load_vectors(args.collection_path)
+    else:
+        vectors = make_vectors(args, rng)
+    # queries near existing rows, as real queries are near some chunks
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + rng.normal(scale=0.02, size=queries.shape) * np.linalg.norm(
+        queries, axis=1, keepdims=True
+    )
+    root = tempfile.mkdtemp()
+
+    _, latency, exact = bench("none", vectors, queries, root, args)
+    print(f"{len(vectors)} rows, dim {vectors.shape[1]}, k {args.k}")
+    print(
+        f"{'mode':8} {'bytes/vec':>9} {'memory MB':>10} {'query ms':>9} "
+        f"{'recall':>7} {'no rescore':>11}"
+    )
+    float_bytes = vectors.shape[1] * 4
+    print(
+        f"{'none':8} {float_bytes:9} {float_bytes * len(vectors) / 1e6:10.1f} "
+        f"{latency:9.2f} {1.0:7.3f} {1.0:11.3f}"
+    )
+    for mode in ("int8", "binary", "pq"):
+        kwargs = {"quantization": mode, "pq_subvectors": args.pq_subvectors}
+        code_bytes, latency, found = bench(mode, vectors, queries, root, args, **kwargs)
+        _, _, first_pass = bench(
+            f"{mode}-first", vectors, queries, root, args, rescore_factor=1, **kwargs
+        )
+        print(
+            f"{mode:8} {code_bytes:9} {code_bytes * len(vectors) / 1e6:10.1f} "
+            f"{latency:9.2f} {recall(exact, found):7.3f} "
+            f"{recall(exact, first_pass):11.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Benchmark concurrent requests with the sync vs the async SQL client.
+
+Simulates async API routes which read a chat session (and for some of the requests
+append a message), with the sync SqlClient (blocking calls inside the event loop) and
+with the AsyncSqlClient. Reports the requests/sec and the max event loop lag (how long
+other requests, e.g. streaming responses, wait for the loop).
+
+Note: SQLite serializes the writers, use a server database (--db-url) for write heavy
+loads with high concurrency.
+
+    python hack/bench_sql_client.py --requests 500 --concurrency 50 --write-ratio 0.1
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from llmapps.app.schema import Message
+from llmapps.controller.asyncsqlclient import AsyncSqlClient
+from llmapps.controller.model import ChatSession, User
+from llmapps.controller.sqlclient import SqlClient
+
+
+class LoopLag:
+    """Measure the event loop lag (delay of a periodic timer)."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.max_lag = 0.0
+        self._start = 0.0
+        self._task = None
+
+    def _update(self):
+        lag = time.perf_counter() - self._start - self.interval
+        self.max_lag = max(self.max_lag, lag)
+
+    async def _run(self):
+        while True:
+            self._start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self._update()
+
+    async def __aenter__(self):
+        self._task = asyncio.create_task(self._run())
+        await asyncio.sleep(0)  # start the timer
+        return self
+
+    async def __aexit__(self, *args):
+        self._task.cancel()
+        self._update()  # the timer may not have fired if the loop was blocked
+
+
+def sync_request(client: SqlClient, session_id: str, write: bool):
+    session = client.get_db_session()
+    try:
+        client.get_session(session_id, session=session)
+        if write:
+            client.append_messages(
+                session_id, [Message(role="Human", content="q")], session=session
+            )
+    finally:
+        session.close()
+
+
+async def async_request(client: AsyncSqlClient, session_id: str, write: bool):
+    async with client.get_db_session() as session:
+        await client.get_session(session_id, session=session)
+        if write:
+            await client.append_messages(
+                session_id, [Message(role="Human", content="q")], session=session
+            )
+
+
+async def run_requests(request, args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    requests = args.requests
+    writes = int(1 / args.write_ratio) if args.write_ratio else 0
+
+    async def one(i):
+        async with semaphore:
+            await request(str(i % args.sessions), bool(writes) and i % writes == 0)
+
+    async with LoopLag() as lag:
+        start = time.perf_counter()
+        await asyncio.gather(*[one(i) for i in range(requests)])
+        elapsed = time.perf_counter() - start
+    return requests / elapsed, lag.max_lag
+
+
+def prepare(db_url: str, sessions: int):
+    client = SqlClient(db_url, sqlite_wal=True)
+    client.create_tables(True)
+    session = client.get_db_session()
+    client.create_user(User(name="yh", full_name="Yaron", email="x@y.z"), session)
+    for i in range(sessions):
+        client.create_session(ChatSession(name=str(i), username="yh"), session)
+    session.close()
+
+
+async def bench_sync(db_url, args):
+    client = SqlClient(db_url, pool_size=args.concurrency, sqlite_wal=True)
+
+    async def request(session_id, write):
+        # a sync client called from an async route blocks the event loop
+        sync_request(client, session_id, write)
+
+    return await run_requests(request, args)
+
+
+async def bench_async(db_url, args):
+    client = AsyncSqlClient(db_url, pool_size=args.concurrency, sqlite_wal=True)
+
+    async def request(session_id, write):
+        await async_request(client, session_id, write)
+
+    try:
+        return await run_requests(request, args)
+    finally:
+        await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-url", help="database url (default: a temp sqlite db)")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--write-ratio", type=float, default=0.1)
+    args = parser.parse_args()
+
+    db_url = args.db_url
+    if not db_url:
+        db_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    prepare(db_url, args.sessions)
+
+    for name, bench in [("sync", bench_sync), ("async", bench_async)]:
+        rate, max_lag = asyncio.run(bench(db_url, args))
+        print(f"{name:6} {rate:8.1f} req/sec, max loop lag {max_lag * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
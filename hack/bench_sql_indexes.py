@@ -0,0 +1,137 @@
+"""Benchmark the hot controller queries before and after the index migration.
+
+Seeds a database with users, chat sessions and documents, drops the indexes added
+by the migrations (an "old" database), times the queries, applies the migrations
+and times them again.
+
+    python hack/bench_sql_indexes.py --sessions 200000 --documents 200000
+"""
+
+import argparse
+import datetime
+import os
+import random
+import tempfile
+import time
+
+import sqlalchemy
+
+from llmapps.controller import migrations
+from llmapps.controller.sqlclient import SqlClient
+from llmapps.controller.sqldb import ChatSessionContext, Document, User
+
+new_indexes = {
+    "users": ["idx_users_updated_name"],
+    "document_collections": ["idx_document_collections_updated_name"],
+    "session_context": [
+        "idx_session_context_username_updated",
+        "idx_session_context_updated_name",
+    ],
+    "documents": ["idx_documents_collection_source"],
+}
+
+
+def seed(client: SqlClient, args):
+    rnd = random.Random(1)
+    start = datetime.datetime(2024, 1, 1)
+    users = [f"user{i}" for i in range(args.users)]
+    with client.engine.begin() as conn:
+        conn.execute(
+            sqlalchemy.insert(User),
+            [
+                {"name": name, "email": f"{name}@x.y", "full_name": name}
+                for name in users
+            ],
+        )
+        for offset in range(0, args.sessions, 10000):
+            count = min(10000, args.sessions - offset)
+            conn.execute(
+                sqlalchemy.insert(ChatSessionContext),
+                [
+                    {
+                        "name": f"s{offset + i}",
+                        "username": rnd.choice(users),
+                        "updated": start + datetime.timedelta(seconds=offset + i),
+                        "spec": {"state": {}},
+                    }
+                    for i in range(count)
+                ],
+            )
+        for offset in range(0, args.documents, 10000):
+            count = min(10000, args.documents - offset)
+            conn.execute(
+                sqlalchemy.insert(Document),
+                [
+                    {
+                        "name": f"d{offset + i}",
+                        "collection": f"col{(offset + i) % 20}",
+                        "source": f"https://docs/{(offset + i) % 5000}",
+                    }
+                    for i in range(count)
+                ],
+            )
+
+
+def drop_indexes(client: SqlClient):
+    with client.engine.begin() as conn:
+        for names in new_indexes.values():
+            for name in names:
+                conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+        conn.exec_driver_sql("DELETE FROM schema_migrations WHERE revision = '0003'")
+
+
+def timeit(func, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        func(i)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def run_queries(client: SqlClient, args):
+    session = client.get_db_session()
+    queries = {
+        "list user sessions (last 10)": lambda i: client.list_sessions(
+            f"user{i % args.users}", last=10, output_mode="short", session=session
+        ),
+        "get user last session": lambda i: client.get_session(
+            None, f"user{i % args.users}", session=session, with_history=False
+        ),
+        "list sessions page (50)": lambda i: client.list_sessions(
+            output_mode="names", limit=50, session=session
+        ),
+        "list documents by source": lambda i: client.list_documents(
+            f"col{i % 20}", f"https://docs/{i % 5000}", session=session
+        ),
+    }
+    results = {name: timeit(query, args.repeat) for name, query in queries.items()}
+    session.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--sessions", type=int, default=200000)
+    parser.add_argument("--documents", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    db_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    client = SqlClient(db_url)
+    client.create_tables(True)
+    seed(client, args)
+    drop_indexes(client)
+
+    before = run_queries(client, args)
+    start = time.perf_counter()
+    applied = migrations.upgrade(client.engine)
+    print(f"applied {applied} in {time.perf_counter() - start:.2f} sec")
+    after = run_queries(client, args)
+
+    print(f"{'query':30} {'before ms':>10} {'after ms':>10}")
+    for name in before:
+        print(f"{name:30} {before[name]:10.2f} {after[name]:10.2f}")
+
+
+if __name__ == "__main__":
+    main()
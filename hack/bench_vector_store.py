@@ -0,0 +1,174 @@
+"""Benchmark the local vector store (flat and IVF) against Chroma.
+
+Inserts random (clustered) embeddings with small metadata, then measures the
+insert throughput, cold open time, query latency (with and without a metadata
+filter) and the IVF recall@k (vs. the exact flat search). Chroma is skipped if the
+chromadb package is not installed.
+
+    python hack/bench_vector_store.py --rows 100000
+    python hack/bench_vector_store.py --rows 1000000 --no-chroma
+"""
+
+import argparse
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from llmapps.app.vectorstore import LocalVectorStore
+
+
+class RandomEmbeddings:
+    """Stand in embeddings model (the benchmark passes pre-computed vectors)."""
+
+    def __init__(self, dim):
+        self.dim = dim
+
+    def embed_documents(self, texts):
+        return np.random.normal(size=(len(texts), self.dim)).tolist()
+
+    def embed_query(self, text):
+        return np.random.normal(size=self.dim).tolist()
+
+
+def make_rows(args, rng):
+    # clustered vectors (topics), real embeddings are far from uniform
+    centers = rng.normal(size=(args.rows // 100 + 1, args.dim))
+    topics = rng.integers(0, len(centers), args.rows)
+    vectors = centers[topics] + rng.normal(scale=0.5, size=(args.rows, args.dim))
+    vectors = vectors.astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    texts = [f"chunk {i}" for i in range(args.rows)]
+    metadatas = [
+        {"source": f"doc{i % 1000}", "chunk": i % 50} for i in range(args.rows)
+    ]
+    ids = [str(i) for i in range(args.rows)]
+    return vectors, texts, metadatas, ids
+
+
+def insert(store, vectors, texts, metadatas, ids, batch_size):
+    start = time.perf_counter()
+    for i in range(0, len(ids), batch_size):
+        end = i + batch_size
+        store.add_embeddings(
+            list(zip(texts[i:end], vectors[i:end].tolist())),
+            metadatas[i:end],
+            ids[i:end],
+        )
+    return time.perf_counter() - start
+
+
+def query_latency(search, queries, k, filter=None):
+    """Return the p50 latency in ms and the results (top k texts per query)."""
+    times, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        docs = search(query.tolist(), k, filter)
+        times.append((time.perf_counter() - start) * 1000)
+        results.append({doc.page_content for doc in docs})
+    return statistics.median(times), results
+
+
+def recall(expected, found):
+    hits = sum(len(e & f) for e, f in zip(expected, found))
+    return hits / sum(len(e) for e in expected)
+
+
+def bench_local(name, args, rows, queries, root, **kwargs):
+    embeddings = RandomEmbeddings(args.dim)
+    store = LocalVectorStore(embeddings, name, root, **kwargs)
+    insert_time = insert(store, *rows, args.batch_size)
+    start = time.perf_counter()
+    store = LocalVectorStore(embeddings, name, root, **kwargs)
+    open_time = time.perf_counter() - start
+    search = store.similarity_search_by_vector
+    search(queries[0].tolist(), args.k)  # warm up (and build the IVF index)
+    latency, results = query_latency(search, queries, args.k)
+    filtered, _ = query_latency(search, queries, args.k, {"source": "doc7"})
+    return insert_time, open_time, latency, filtered, results
+
+
+def bench_chroma(args, rows, queries, root):
+    from langchain.vectorstores.chroma import Chroma
+
+    vectors, texts, metadatas, ids = rows
+    embeddings = RandomEmbeddings(args.dim)
+    store = Chroma("bench", embeddings, persist_directory=f"{root}/chroma")
+    start = time.perf_counter()
+    for i in range(0, len(ids), args.batch_size):
+        end = i + args.batch_size
+        store._collection.upsert(
+            embeddings=vectors[i:end].tolist(),
+            documents=texts[i:end],
+            metadatas=metadatas[i:end],
+            ids=ids[i:end],
+        )
+    insert_time = time.perf_counter() - start
+    start = time.perf_counter()
+    store = Chroma("bench", embeddings, persist_directory=f"{root}/chroma")
+    open_time = time.perf_counter() - start
+
+    def search(query, k, filter=None):
+        return store.similarity_search_by_vector(query, k, filter=filter)
+
+    search(queries[0].tolist(), args.k)
+    latency, results = query_latency(search, queries, args.k)
+    filtered, _ = query_latency(search, queries, args.k, {"source": "doc7"})
+    return insert_time, open_time, latency, filtered, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--ivf-probes", type=int, default=16)
+    parser.add_argument("--no-chroma", action="store_true")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    rows = make_rows(args, rng)
+    # queries near existing rows, as real queries are near some chunks
+    queries = rows[0][rng.choice(args.rows, args.queries, replace=False)]
+    queries = queries + rng.normal(scale=0.02, size=queries.shape)
+    root = tempfile.mkdtemp()
+
+    results = {
+        "local flat": bench_local("flat", args, rows, queries, root),
+        "local ivf": bench_local(
+            "ivf",
+            args,
+            rows,
+            queries,
+            root,
+            index_type="ivf",
+            ivf_min_rows=0,
+            ivf_probes=args.ivf_probes,
+        ),
+    }
+    if not args.no_chroma:
+        try:
+            import chromadb  # noqa: F401
+
+            results["chroma"] = bench_chroma(args, rows, queries, root)
+        except ImportError:
+            print("chromadb is not installed, skipping chroma")
+
+    exact = results["local flat"][4]
+    print(f"{args.rows} rows, dim {args.dim}, k {args.k}")
+    print(
+        f"{'store':12} {'insert s':>9} {'open s':>8} {'query ms':>9} "
+        f"{'filtered ms':>12} {'recall':>7}"
+    )
+    for name, (insert_time, open_time, latency, filtered, found) in results.items():
+        print(
+            f"{name:12} {insert_time:9.2f} {open_time:8.3f} {latency:9.2f} "
+            f"{filtered:12.2f} {recall(exact, found):7.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -25,9 +25,13 @@ def ingest(session: sqlalchemy.orm.Session, collection_name, item: IngestItem):
     data_loader = get_data_loader(
         config, collection_name=collection_name, session=session
     )
-    loader_obj = get_loader_obj(item.path, loader_type=item.loader)
-    data_loader.load(loader_obj, metadata=item.metadata, version=item.version)
-    return ApiResponse(success=True)
+    loader_obj = get_loader_obj(
+        item.path,
+        loader_type=item.loader,
+        validators_path=config.web_validators_path,
+    )
+    stats = data_loader.load(loader_obj, metadata=item.metadata, version=item.version)
+    return ApiResponse(success=True, data=stats.dict())
 
 
 def transcribe_file(file_handler):
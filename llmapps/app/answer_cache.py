@@ -0,0 +1,258 @@
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+from .config import logger
+
+
+class AnswerCache:
+    """An in memory semantic cache of answers.
+
+    Entries are keyed by the collection, the search filter and the (normalized)
+    embedding of the query. A lookup returns the answer of the most similar cached
+    query of the same collection and filter, if its cosine similarity is above the
+    threshold. Entries expire after ttl seconds, and when the cache is full the
+    least recently used entry is evicted.
+
+    The cache is per process. Collections ingested by another process (e.g. the CLI)
+    are signaled with a version file per collection (see invalidate_answers), which
+    is checked on each lookup. Without a versions path such collections are refreshed
+    only when their entries expire.
+
+    Args:
+        max_size: Max number of cached answers.
+        ttl: Time to live of an entry in seconds (0 for no expiration).
+        threshold: Min cosine similarity of a cache hit.
+        versions_path: Directory of the collection version files (None to disable).
+    """
+
+    def __init__(
+        self,
+        max_size: int = 1000,
+        ttl: float = 3600,
+        threshold=0.95,
+        versions_path: str = None,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.versions_path = versions_path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        self._vectors = None  # (max_size, dim) normalized query embeddings
+        self._entries: List[Optional[dict]] = [None] * max_size
+        self._live = np.zeros(max_size, dtype=bool)
+        self._keys = np.full(max_size, None, dtype=object)
+        self._collections = np.full(max_size, None, dtype=object)
+        self._expires = np.zeros(max_size)
+        self._last_used = np.zeros(max_size)
+        self._versions = {}  # collection -> version file (inode, mtime) seen
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _filter_key(collection: str, filter) -> str:
+        return json.dumps([collection, filter], sort_keys=True, default=str)
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _valid_mask(self, now: float) -> np.ndarray:
+        mask = self._live.copy()
+        if self.ttl:
+            mask &= self._expires > now
+        return mask
+
+    def _valid_slots(self, now: float, key: str = None) -> np.ndarray:
+        mask = self._valid_mask(now)
+        if key is not None:
+            mask &= self._keys == key
+        return np.flatnonzero(mask)
+
+    def get(self, collection: str, vector, filter=None):
+        """Return the cached (answer, sources) of the most similar query, or None."""
+        key = self._filter_key(collection, filter)
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(collection)
+            if self._vectors is None:
+                self.misses += 1
+                return None
+            slots = self._valid_slots(now, key)
+            if not len(slots):
+                self.misses += 1
+                return None
+            similarity = self._vectors[slots] @ self._normalize(vector)
+            best = int(np.argmax(similarity))
+            if similarity[best] < self.threshold:
+                self.misses += 1
+                return None
+            slot = slots[best]
+            self._last_used[slot] = now
+            self.hits += 1
+            entry = self._entries[slot]
+            logger.debug(
+                f"Answer cache hit (similarity={similarity[best]:.3f}): {entry['query']}"
+            )
+            return entry["answer"], entry["sources"]
+
+    def put(self, collection: str, vector, query: str, answer, sources, filter=None):
+        """Add an answer to the cache."""
+        vector = self._normalize(vector)
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(collection)
+            if self._vectors is not None and self._vectors.shape[1] != len(vector):
+                # a different embedding model, the cached vectors can't be compared
+                logger.debug("Embedding dimension changed, clearing the answer cache")
+                self._clear()
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_size, len(vector)), np.float32)
+            slot = self._free_slot(now)
+            key = self._filter_key(collection, filter)
+            self._vectors[slot] = vector
+            self._live[slot] = True
+            self._keys[slot] = key
+            self._collections[slot] = collection
+            self._entries[slot] = {
+                "key": key,
+                "collection": collection,
+                "query": query,
+                "answer": answer,
+                "sources": sources,
+            }
+            self._expires[slot] = now + self.ttl
+            self._last_used[slot] = now
+
+    def _free_slot(self, now: float) -> int:
+        free = np.flatnonzero(~self._valid_mask(now))
+        if len(free):
+            return int(free[0])
+        slot = int(np.argmin(self._last_used))
+        self.evictions += 1
+        return slot
+
+    def _drop(self, mask: np.ndarray):
+        for slot in np.flatnonzero(mask):
+            self._entries[slot] = None
+        self._live[mask] = False
+        self._keys[mask] = None
+        self._collections[mask] = None
+
+    def _clear(self):
+        self._drop(self._live.copy())
+        self._vectors = None
+
+    def _check_version(self, collection: str):
+        # drop the answers of a collection re-ingested by another process
+        if not self.versions_path:
+            return
+        for name in (collection, None):
+            version = _version(self.versions_path, name)
+            if self._versions.setdefault(name, version) != version:
+                logger.debug(f"Collection {name} was updated, invalidating answers")
+                self._invalidate(name)
+                self._versions[name] = version
+
+    def _invalidate(self, collection: str = None):
+        mask = self._live.copy()
+        if collection is not None:
+            mask &= self._collections == collection
+        self._drop(mask)
+        self.invalidations += int(mask.sum())
+
+    def invalidate(self, collection: str = None):
+        """Drop the cached answers of a collection (or all answers)."""
+        with self._lock:
+            self._invalidate(collection)
+
+    def clear(self):
+        """Drop all the cached answers and vectors (e.g. when the embeddings change)."""
+        with self._lock:
+            self._clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._valid_slots(time.monotonic())),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def __len__(self):
+        return len(self._valid_slots(time.monotonic()))
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def _version_path(versions_path: str, collection: str = None) -> Path:
+    return Path(versions_path) / f"{collection or '_all'}.version"
+
+
+def _version(versions_path: str, collection: str = None):
+    try:
+        stat = _version_path(versions_path, collection).stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def _bump_version(versions_path: str, collection: str = None):
+    path = _version_path(versions_path, collection)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+    tmp_path.write_text(uuid.uuid4().hex)
+    os.replace(tmp_path, path)  # a new inode per version
+
+
+def get_answer_cache(config) -> AnswerCache:
+    """Return the process wide answer cache (created from the config on first use)."""
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache(
+                max_size=config.answer_cache_size,
+                ttl=config.answer_cache_ttl,
+                threshold=config.answer_cache_threshold,
+                versions_path=config.answer_cache_versions_path,
+            )
+        return _answer_cache
+
+
+def invalidate_answers(collection_name: str = None, versions_path: str = None):
+    """Drop the cached answers of a (re-ingested) collection, or all answers.
+
+    With a versions path, the collection version file is updated so the answer
+    caches of other processes (e.g. the API server) drop the answers too.
+    """
+    if versions_path:
+        _bump_version(versions_path, collection_name)
+    if _answer_cache is not None:
+        logger.debug(f"Invalidating cached answers of collection: {collection_name}")
+        _answer_cache.invalidate(collection_name)
+
+
+def clear_answer_cache():
+    """Clear the answer cache (e.g. when the config changes), the next use creates
+    it from the new config."""
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is not None:
+            _answer_cache.clear()
+        _answer_cache = None
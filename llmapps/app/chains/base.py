@@ -2,10 +2,34 @@ import asyncio
 
 import storey
 
+from ..config import get_llm
+from ..memory import ConversationSummarizer
 from ..schema import PipelineEvent
 
 
+def update_event(event: PipelineEvent, resp: dict):
+    """Merge a step response into the event results."""
+    if resp:
+        for key, val in resp.items():
+            event.results[key] = val
+        if "answer" in resp:
+            event.query = resp["answer"]
+
+
+async def run_blocking(context, func, *args):
+    """Run a blocking function in the (bounded) pipelines executor."""
+    loop = asyncio.get_running_loop()
+    executor = getattr(context, "executor", None)
+    return await loop.run_in_executor(executor, func, *args)
+
+
 class ChainRunner(storey.Flow):
+    """Base class for pipeline steps.
+
+    Steps implement a sync _run(event) and can override the async _arun(event) with a
+    native async implementation (e.g. async LLM calls), by default _arun runs _run
+    in the pipelines executor so it will not block the event loop.
+    """
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -14,9 +38,17 @@ class ChainRunner(storey.Flow):
     def _run(self, event: PipelineEvent):
         raise NotImplementedError()
 
+    async def _arun(self, event: PipelineEvent):
+        return await run_blocking(self.context, self._run, event)
+
     def __call__(self, event: PipelineEvent):
         return self._run(event)
 
+    async def arun(self, event: PipelineEvent):
+        if self._is_async:
+            return await self._run(event)
+        return await self._arun(event)
+
     def post_init(self, mode="sync"):
         pass
 
@@ -26,17 +58,10 @@ class ChainRunner(storey.Flow):
         else:
             print("step name: ", self.name)
             element = self._get_event_or_body(event)
-            if self._is_async:
-                resp = await self._run(element)
-            else:
-                resp = self._run(element)
-            if resp:
-                for key, val in resp.items():
-                    element.results[key] = val
-                if "answer" in resp:
-                    element.query = resp["answer"]
-                mapped_event = self._user_fn_output_to_event(event, element)
-                await self._do_downstream(mapped_event)
+            resp = await self.arun(element)
+            update_event(element, resp)
+            mapped_event = self._user_fn_output_to_event(event, element)
+            await self._do_downstream(mapped_event)
 
 
 class SessionLoader(storey.Flow):
@@ -52,10 +77,14 @@ class SessionLoader(storey.Flow):
             if isinstance(element, dict):
                 element = PipelineEvent(**element)
 
-            self.context.session_store.read_state(element)
+            await self.arun(element)
             mapped_event = self._user_fn_output_to_event(event, element)
             await self._do_downstream(mapped_event)
 
+    async def arun(self, event: PipelineEvent):
+        executor = getattr(self.context, "executor", None)
+        await self.context.session_store.aread_state(event, executor)
+
 
 class HistorySaver(ChainRunner):
 
@@ -70,6 +99,17 @@ class HistorySaver(ChainRunner):
         self.answer_key = answer_key
         self.question_key = question_key
         self.save_sources = save_sources
+        self.summarizer = None
+
+    def post_init(self, mode="sync"):
+        config = self.context._config
+        if config.history_summarize and self.summarizer is None:
+            self.summarizer = ConversationSummarizer(
+                get_llm(config),
+                window=config.history_window,
+                batch=config.history_summary_batch,
+                verbose=self.verbose,
+            )
 
     async def _run(self, event: PipelineEvent):
         question = (
@@ -86,5 +126,8 @@ class HistorySaver(ChainRunner):
             "AI", event.results[self.answer_key or "answer"], sources
         )
 
-        self.context.session_store.save(event)
+        if self.summarizer and event.session_id:
+            await self.summarizer.aupdate(event.conversation)
+        executor = getattr(self.context, "executor", None)
+        await self.context.session_store.asave(event, executor)
         return event.results
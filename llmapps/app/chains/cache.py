@@ -0,0 +1,81 @@
+from ..answer_cache import get_answer_cache
+from ..config import get_embedding_function, logger
+from ..schema import PipelineEvent
+from .base import ChainRunner
+
+
+def _copy_sources(sources):
+    return [doc.copy(deep=True) for doc in sources or []]
+
+
+class AnswerCacheLookup(ChainRunner):
+    """Return a cached answer for queries similar to a previous query.
+
+    Place it after the query refinement step (the cache is keyed by the refined
+    query embedding) and before the retriever, and add an AnswerCacheSaver step
+    after the retriever. On a cache hit the retriever is skipped.
+
+    Example:
+        pipe_graph = [
+            SessionLoader(),
+            RefineQuery(),
+            AnswerCacheLookup(),
+            MultiRetriever(),
+            AnswerCacheSaver(),
+            HistorySaver(),
+        ]
+    """
+
+    def __init__(self, embeddings=None, **kwargs):
+        super().__init__(**kwargs)
+        self.embeddings = embeddings
+        self._cache = None
+
+    def post_init(self, mode="sync"):
+        config = self.context._config
+        self.embeddings = self.embeddings or get_embedding_function(config)
+        self._cache = get_answer_cache(config)
+
+    def _run(self, event: PipelineEvent):
+        collection_name = (
+            event.kwargs.get("collection_name")
+            or self.context._config.default_collection()
+        )
+        vector = self.embeddings.embed_query(event.query)
+        event.kwargs["query_embedding"] = vector
+        cached = self._cache.get(collection_name, vector, event.kwargs.get("filter"))
+        if cached is None:
+            return None
+        answer, sources = cached
+        event.kwargs["answer_cached"] = True
+        return {"answer": answer, "sources": _copy_sources(sources)}
+
+
+class AnswerCacheSaver(ChainRunner):
+    """Save the retriever answer in the answer cache (see AnswerCacheLookup)."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._cache = None
+
+    def post_init(self, mode="sync"):
+        self._cache = get_answer_cache(self.context._config)
+
+    def _run(self, event: PipelineEvent):
+        vector = event.kwargs.get("query_embedding")
+        if event.kwargs.get("answer_cached") or vector is None:
+            return None
+        collection_name = (
+            event.kwargs.get("collection_name")
+            or self.context._config.default_collection()
+        )
+        logger.debug(f"Saving answer in cache: {event.original_query}")
+        self._cache.put(
+            collection_name,
+            vector,
+            event.original_query,
+            event.results["answer"],
+            _copy_sources(event.results.get("sources")),
+            event.kwargs.get("filter"),
+        )
+        return None
@@ -1,3 +1,7 @@
+import re
+import threading
+from collections import Counter
+
 from langchain.chains import LLMChain
 from langchain.prompts import PromptTemplate
 
@@ -20,29 +24,144 @@ Standalone request:
 """
 
 
+# words which usually refer to the previous conversation
+_context_words_re = re.compile(
+    r"\b(it|its|this|that|these|those|they|them|their|he|she|him|her|there|"
+    r"above|previous|same|also|else|again|more|former|latter|other|another)\b",
+    re.IGNORECASE,
+)
+
+
+# question and filler words, not counted as shared (content) words
+_question_words = set(
+    "what when where which who whom whose why how does did have has can could should "
+    "would will with from about into your you the and for are was were this that "
+    "there here some any one two get use using".split()
+)
+
+
+def _content_words(text: str) -> set:
+    words = set(re.findall(r"[a-z0-9]+", text.lower()))
+    return {word for word in words if len(word) > 2} - _question_words
+
+
+def is_standalone_question(
+    question: str, chat_history: str = None, min_words: int = 4
+) -> bool:
+    """Heuristic check if a question can be understood without the chat history.
+
+    Short questions (e.g. "why?", "and in python?"), questions with references
+    to the conversation (e.g. "how do I install it?") and questions which share
+    content words with the recent chat history (e.g. "how do I configure the second
+    one?" after a list of options) are not standalone.
+    """
+    words = question.split()
+    if len(words) < min_words:
+        return False
+    if question.strip().lower().startswith(("and ", "or ", "but ", "what about")):
+        return False
+    if _context_words_re.search(question):
+        return False
+    return not (
+        chat_history and _content_words(question) & _content_words(chat_history)
+    )
+
+
 class RefineQuery(ChainRunner):
+    """Rephrase a follow-up question into a standalone question using the chat history.
+
+    The LLM call is skipped when there is no chat history, or (opt-in) when the
+    question is already standalone according to standalone_check (a function of the
+    question and the recent chat history which returns True if it is standalone).
+
+    Args:
+        llm: The LLM used for refinement (default to the config LLM).
+        prompt_template: The refinement prompt template.
+        standalone_check: A function of (question, recent chat history), or False to
+            always refine (default to is_standalone_question when
+            config.refine_skip_standalone is set).
+    """
 
-    def __init__(self, llm=None, prompt_template=None, **kwargs):
+    def __init__(self, llm=None, prompt_template=None, standalone_check=None, **kwargs):
         super().__init__(**kwargs)
         self.llm = llm
         self.prompt_template = prompt_template
+        self.standalone_check = standalone_check
         self._chain = None
+        self._counts = Counter()
+        self._counts_lock = threading.Lock()
 
     def post_init(self, mode="sync"):
-        self.llm = self.llm or get_llm(self.context._config)
+        config = self.context._config
+        if self.standalone_check is None and config.refine_skip_standalone:
+            self.standalone_check = is_standalone_question
+        self.llm = self.llm or get_llm(config)
         refine_prompt = PromptTemplate.from_template(
             self.prompt_template or _refine_prompt_template
         )
         self._chain = LLMChain(llm=self.llm, prompt=refine_prompt, verbose=self.verbose)
 
+    def _count(self, path: str):
+        with self._counts_lock:
+            self._counts[path] += 1
+
+    def stats(self) -> dict:
+        """Return the number of queries which took each path (no_history,
+        standalone, refined)."""
+        with self._counts_lock:
+            return dict(self._counts)
+
+    def _chat_history(self, event: PipelineEvent) -> str:
+        config = self.context._config
+        return event.conversation.to_prompt(
+            config.history_window, config.history_max_tokens
+        )
+
+    def _skip_refine(self, event: PipelineEvent) -> bool:
+        if not event.conversation.messages:
+            self._count("no_history")
+            return True
+        if self.standalone_check and self.standalone_check(
+            event.query, _recent_history(event)
+        ):
+            logger.debug(f"Skipping refinement of standalone question: {event.query}")
+            self._count("standalone")
+            return True
+        self._count("refined")
+        return False
+
     def _run(self, event: PipelineEvent):
-        chat_history = str(event.conversation)
+        if self._skip_refine(event):
+            return None
+        chat_history = self._chat_history(event)
         logger.debug(f"Question: {event.query}\nChat history: {chat_history}")
         resp = self._chain.run({"question": event.query, "chat_history": chat_history})
         return {"answer": resp}
 
+    async def _arun(self, event: PipelineEvent):
+        if self._skip_refine(event):
+            return None
+        chat_history = self._chat_history(event)
+        logger.debug(f"Question: {event.query}\nChat history: {chat_history}")
+        resp = await self._chain.arun(
+            {"question": event.query, "chat_history": chat_history}
+        )
+        return {"answer": resp}
+
+
+def _recent_history(event: PipelineEvent, num_messages: int = 2) -> str:
+    # the last turn, a follow-up usually refers to it
+    messages = event.conversation.messages[-num_messages:]
+    return "\n".join(message.content for message in messages)
+
 
 def get_refine_chain(config, verbose=False, prompt_template=None):
     llm = get_llm(config)
     verbose = verbose or config.verbose
-    return RefineQuery(llm=llm, verbose=verbose, prompt_template=prompt_template)
+    standalone_check = None if config.refine_skip_standalone else False
+    return RefineQuery(
+        llm=llm,
+        verbose=verbose,
+        prompt_template=prompt_template,
+        standalone_check=standalone_check,
+    )
@@ -2,9 +2,12 @@ from langchain.chains import RetrievalQAWithSourcesChain
 from langchain.prompts import PromptTemplate
 from langchain.schema.callbacks.base import BaseCallbackHandler
 
-from ..config import get_llm, get_vector_db, logger
+from ..config import get_llm, get_reranker, get_sparse_index, get_vector_db, logger
+from ..filters import BoolExpr, parse_filter, vector_search_kwargs
+from ..rerank import RerankRetriever, RerankStatsHandler
 from ..schema import PipelineEvent
-from .base import ChainRunner
+from ..sparse import HybridRetriever
+from .base import ChainRunner, run_blocking
 
 
 class DocumentCallbackHandler(BaseCallbackHandler):
@@ -38,21 +41,63 @@ class DocumentRetriever:
         llm: A language model.
         vector_store: A vector store.
         verbose: Whether to print debug information.
+        sparse_index: A BM25 index of the collection, enables hybrid retrieval.
+        rrf_k: The hybrid results reciprocal rank fusion constant.
+        weights: The hybrid (vector, bm25) results weights.
+        fetch_k: Number of hybrid candidates taken from each search.
+        reranker: A reranker (see rerank.Reranker), enables reranking of the
+            retrieved candidates, the results include the rerank stats.
+        rerank_fetch_k: Number of candidates retrieved for the reranker.
+        rerank_max_tokens: The token budget of the reranked documents.
+        rerank_dedupe_threshold: Min similarity of dropped near duplicate chunks.
+        search_kwargs: Extra search args, e.g. k, and a filter (applied to all the
+            queries, see filters.parse_filter).
 
     """
 
     def __init__(
-        self, llm, vector_store, verbose=False, chain_type: str = None, **search_kwargs
+        self,
+        llm,
+        vector_store,
+        verbose=False,
+        chain_type: str = None,
+        sparse_index=None,
+        rrf_k: int = 60,
+        weights: list = None,
+        fetch_k: int = 20,
+        reranker=None,
+        rerank_fetch_k: int = 20,
+        rerank_max_tokens: int = None,
+        rerank_dedupe_threshold: float = 0.9,
+        **search_kwargs,
     ):
         document_prompt = PromptTemplate(
             template="Content: {page_content}\nSource: {index}",
             input_variables=["page_content", "index"],
         )
 
+        self._filter = parse_filter(search_kwargs.pop("filter", None))
+        rerank_args = None
+        if reranker is not None:
+            rerank_args = {
+                "reranker": reranker,
+                "fetch_k": rerank_fetch_k,
+                "max_tokens": rerank_max_tokens,
+                "dedupe_threshold": rerank_dedupe_threshold,
+            }
+        self._retriever_args = (
+            vector_store,
+            sparse_index,
+            rrf_k,
+            weights,
+            fetch_k,
+            search_kwargs,
+            rerank_args,
+        )
         self.chain = RetrievalQAWithSourcesChain.from_chain_type(
             chain_type=chain_type or "stuff",  # "map_reduce",
             llm=llm,
-            retriever=vector_store.as_retriever(search_kwargs=search_kwargs),
+            retriever=_get_retriever(*self._retriever_args, filter=self._filter),
             return_source_documents=True,
             chain_type_kwargs={"document_prompt": document_prompt},
             verbose=verbose,
@@ -68,10 +113,36 @@ class DocumentRetriever:
         """Creates a document retriever from a config object."""
         vector_db = get_vector_db(config, collection_name=collection_name)
         llm = get_llm(config)
+        search_kwargs = {**_retriever_args(config, collection_name), **search_kwargs}
         return cls(llm, vector_db, verbose=config.verbose, **search_kwargs)
 
-    def _get_answer(self, query):
-        result = self.chain({"question": query}, callbacks=[self.cb])
+    def _get_chain(self, filter=None):
+        """The chain, with a retriever of the (per query) filter if specified."""
+        expr = parse_filter(filter)
+        if expr is None:
+            return self.chain
+        if self._filter is not None:
+            expr = BoolExpr("$and", [self._filter, expr])
+        return RetrievalQAWithSourcesChain(
+            combine_documents_chain=self.chain.combine_documents_chain,
+            retriever=_get_retriever(*self._retriever_args, filter=expr),
+            return_source_documents=True,
+            verbose=self.verbose,
+        )
+
+    def _get_answer(self, query, callbacks: list = None, filter=None):
+        callbacks = [self.cb] + (callbacks or [])
+        chain = self._get_chain(filter)
+        result = chain({"question": query}, callbacks=callbacks)
+        return self._process_result(result)
+
+    async def _aget_answer(self, query, callbacks: list = None, filter=None):
+        callbacks = [self.cb] + (callbacks or [])
+        chain = self._get_chain(filter)
+        result = await chain.acall({"question": query}, callbacks=callbacks)
+        return self._process_result(result)
+
+    def _process_result(self, result):
         sources = [s.strip() for s in result["sources"].split(",")]
         source_docs = [
             doc
@@ -86,9 +157,25 @@ class DocumentRetriever:
     def run(self, event: PipelineEvent):
         # TODO: use text when is_cli
         logger.debug(f"Retriever Question: {event.query}\n")
-        answer, sources = self._get_answer(event.query)
+        rerank_handler = RerankStatsHandler()
+        answer, sources = self._get_answer(
+            event.query,
+            _event_callbacks(event) + [rerank_handler],
+            event.kwargs.get("filter"),
+        )
         logger.debug(f"answer: {answer} \nSources: {sources}")
-        return {"answer": answer, "sources": sources}
+        return _results(answer, sources, rerank_handler)
+
+    async def arun(self, event: PipelineEvent):
+        logger.debug(f"Retriever Question: {event.query}\n")
+        rerank_handler = RerankStatsHandler()
+        answer, sources = await self._aget_answer(
+            event.query,
+            _event_callbacks(event) + [rerank_handler],
+            event.kwargs.get("filter"),
+        )
+        logger.debug(f"answer: {answer} \nSources: {sources}")
+        return _results(answer, sources, rerank_handler)
 
 
 class MultiRetriever(ChainRunner):
@@ -115,26 +202,116 @@ class MultiRetriever(ChainRunner):
                 self.llm,
                 vector_db,
                 verbose=self.verbose,
-                # collection_name=collection_name,
+                **_retriever_args(self.context._config, collection_name),
             )
             self._retrievers[collection_name] = retriever
 
         return self._retrievers[collection_name]
 
     def _run(self, event: PipelineEvent):
+        if event.kwargs.get("answer_cached"):
+            return None
         retriever = self._get_retriever(event.kwargs.get("collection_name"))
         return retriever.run(event)
 
+    async def _arun(self, event: PipelineEvent):
+        if event.kwargs.get("answer_cached"):
+            return None
+        collection_name = event.kwargs.get("collection_name")
+        # creating a retriever may load models, don't block the event loop
+        retriever = await run_blocking(
+            self.context, self._get_retriever, collection_name
+        )
+        return await retriever.arun(event)
+
+
+def _event_callbacks(event: PipelineEvent) -> list:
+    """Get the extra (per request) callbacks, e.g. the answer token stream handler."""
+    stream_handler = event.kwargs.get("stream_handler")
+    return [stream_handler] if stream_handler else []
+
+
+def _results(answer, sources, rerank_handler: RerankStatsHandler) -> dict:
+    results = {"answer": answer, "sources": sources}
+    if rerank_handler.stats:
+        results["rerank"] = rerank_handler.stats
+    return results
+
+
+def _get_retriever(
+    vector_store,
+    sparse_index,
+    rrf_k,
+    weights,
+    fetch_k,
+    search_kwargs,
+    rerank_args=None,
+    filter=None,
+):
+    if rerank_args:
+        # over-fetch the candidates, the reranker returns the top k
+        rerank_args = rerank_args.copy()
+        k = search_kwargs.get("k", 4)
+        search_kwargs = {**search_kwargs, "k": rerank_args.pop("fetch_k")}
+        retriever = _get_retriever(
+            vector_store,
+            sparse_index,
+            rrf_k,
+            weights,
+            fetch_k,
+            search_kwargs,
+            None,
+            filter,
+        )
+        return RerankRetriever(base_retriever=retriever, k=k, **rerank_args)
+
+    if sparse_index is None:
+        search_kwargs = {
+            **search_kwargs,
+            **vector_search_kwargs(vector_store, filter),
+        }
+        return vector_store.as_retriever(search_kwargs=search_kwargs)
+    search_kwargs = search_kwargs.copy()
+    return HybridRetriever(
+        vector_store=vector_store,
+        sparse_index=sparse_index,
+        k=search_kwargs.pop("k", 4),
+        fetch_k=fetch_k,
+        rrf_k=rrf_k,
+        weights=weights or [1.0, 1.0],
+        search_kwargs=search_kwargs,
+        filter=filter,
+    )
+
+
+def _hybrid_args(config, collection_name: str = None) -> dict:
+    """The DocumentRetriever hybrid search args (empty if hybrid search is disabled)."""
+    sparse_index = get_sparse_index(config, collection_name)
+    if sparse_index is None:
+        return {}
+    return {
+        "sparse_index": sparse_index,
+        "rrf_k": config.hybrid_rrf_k,
+        "weights": config.hybrid_weights,
+        "fetch_k": config.hybrid_fetch_k,
+    }
+
+
+def _rerank_args(config) -> dict:
+    """The DocumentRetriever rerank args (empty if reranking is disabled)."""
+    reranker = get_reranker(config)
+    if reranker is None:
+        return {}
+    return {
+        "reranker": reranker,
+        "rerank_fetch_k": config.rerank_fetch_k,
+        "rerank_max_tokens": config.rerank_max_tokens,
+        "rerank_dedupe_threshold": config.rerank_dedupe_threshold,
+    }
+
 
-def fix_milvus_filter_arg(vector_db, search_kwargs):
-    """Fixes the milvus filter argument."""
-    # detect if its Milvus and need to swap the filter dict arg with expr string
-    if "filter" in search_kwargs and hasattr(vector_db, "_create_connection_alias"):
-        filter = search_kwargs.pop("filter")
-        if isinstance(filter, dict):
-            # convert a dict of key value pairs to a string with key1=value1 and key2=value2
-            filter = " and ".join(f"{k}={v}" for k, v in filter.items())
-        search_kwargs["expr"] = filter
+def _retriever_args(config, collection_name: str = None) -> dict:
+    return {**_hybrid_args(config, collection_name), **_rerank_args(config)}
 
 
 def get_retriever_from_config(
@@ -144,4 +321,5 @@ def get_retriever_from_config(
     vector_db = get_vector_db(config, collection_name=collection_name)
     llm = get_llm(config)
     verbose = verbose or config.verbose
+    search_kwargs = {**_retriever_args(config, collection_name), **search_kwargs}
     return DocumentRetriever(llm, vector_db, verbose=verbose, **search_kwargs)
@@ -1,74 +1,99 @@
+import asyncio
+import json
+
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from .config import logger
 
+# retry the idempotent requests on these (gateway/overload) response codes
+_retry_status_codes = (502, 503, 504)
+_idempotent_methods = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+
+
+class _ClientBase:
+    """The API methods, shared by the sync and async clients.
+
+    Every method calls self._call(path, ..) and returns its result, a value for the
+    sync Client and an awaitable for the AsyncClient.
+    """
 
-class Client:
-    def __init__(self, base_url, username=None, token=None):
+    def __init__(
+        self,
+        base_url,
+        username=None,
+        token=None,
+        timeout: float = 120,
+        connect_timeout: float = 5,
+        retries: int = 3,
+        backoff_factor: float = 0.5,
+        pool_maxsize: int = 10,
+    ):
         self.base_url = base_url
         self.username = username or "guest"
         self.token = token
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.pool_maxsize = pool_maxsize
 
-    def post_request(self, path, data=None, params=None, method="GET", files=None):
-        # Construct the URL
-        url = f"{self.base_url}/api/{path}"
-        logger.debug(
-            f"Sending {method} request to {url}, params: {params}, data: {data}"
-        )
+    def _url(self, path):
+        return f"{self.base_url}/api/{path}"
 
-        # Make the request
-        response = requests.request(
-            method,
-            url,
-            json=data,
-            params=(
-                {k: v for k, v in params.items() if v is not None} if params else None
-            ),
-            headers={"x_username": self.username},
-            files=files,
-        )
+    def _call(
+        self, path, data=None, params=None, method="GET", files=None, result=None
+    ):
+        raise NotImplementedError()
 
-        # Check the response
-        if response.status_code == 200:
-            # If the request was successful, return the JSON response
-            return response.json()
-        else:
-            # If the request failed, raise an exception
-            response.raise_for_status()
+    def list_users(
+        self, email=None, username=None, labels=None, output_mode=None, limit=None
+    ):
+        return self._call(
+            "users",
+            params={
+                "email": email,
+                "username": username,
+                "labels": _labels_param(labels),
+                "mode": output_mode,
+                "limit": limit,
+            },
+            result=_data,
+        )
 
-    def list_collections(self, owner=None, labels=None, output_mode=None):
-        response = self.post_request(
+    def list_collections(self, owner=None, labels=None, output_mode=None, limit=None):
+        return self._call(
             "collections",
             params={
                 "owner": owner,
-                "labels": labels,
+                "labels": _labels_param(labels),
                 "mode": output_mode,
+                "limit": limit,
             },
+            result=_data,
         )
-        return response["data"]
 
     def create_collection(self, name, **kwargs):
-        response = self.post_request(f"collection/{name}", data=kwargs, method="POST")
-        return response["success"]
+        return self._call(
+            f"collection/{name}",
+            data=kwargs,
+            method="POST",
+            result=lambda response: response["success"],
+        )
 
     def run_pipeline(self, name, query, collection, session_id=None, filter=None):
-        response = self.post_request(
+        return self._call(
             f"pipeline/{name or 'default'}/run",
-            data={
-                "question": query,
-                "collection": collection,
-                "session_id": session_id,
-                "filter": filter,
-            },
+            data=_query_data(query, collection, session_id, filter),
             method="POST",
+            result=_pipeline_result,
         )
-        data = response["data"]
-        print(f"response: {response}")
-        return data["answer"], data["sources"], data["returned_state"]
 
     # method to ingest a document
     def ingest(self, collection, path, loader, metadata=None, version=None):
-        return self.post_request(
+        return self._call(
             f"collection/{collection}/ingest",
             data={
                 "path": path,
@@ -78,22 +103,131 @@ class Client:
         )
 
     def get_session(self, session_id):
-        response = self.post_request(f"session/{session_id}")
-        return response["data"]
+        return self._call(f"session/{session_id}", result=_data)
 
     def list_sessions(
-        self, username=None, created_after=None, last=None, output_mode=None
+        self,
+        username=None,
+        created_after=None,
+        last=None,
+        output_mode=None,
+        labels=None,
     ):
-        response = self.post_request(
+        return self._call(
             "sessions",
             params={
                 "username": username,
                 "created_after": created_after,
                 "last": last,
                 "mode": output_mode,
+                "labels": _labels_param(labels),
             },
+            result=_data,
+        )
+
+
+class Client(_ClientBase):
+    """API client, keeps a pool of (keep-alive) connections.
+
+    Failed connections, and idempotent requests which got a 502/503/504 response,
+    are retried with exponential backoff.
+
+    Args:
+        base_url: The API server url.
+        username: The user name (sent in the x_username header).
+        timeout: Response (read) timeout in seconds.
+        connect_timeout: Connection timeout in seconds.
+        retries: Max number of retries.
+        backoff_factor: Backoff factor between retries (0.5, 1, 2, .. seconds).
+        pool_maxsize: Max number of pooled connections (concurrent requests).
+    """
+
+    def __init__(self, base_url, username=None, token=None, **kwargs):
+        super().__init__(base_url, username, token, **kwargs)
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=_retry_status_codes,
+            allowed_methods=_idempotent_methods,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_maxsize=self.pool_maxsize, max_retries=retry)
+        self._session = requests.Session()
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._session.headers["x_username"] = self.username
+
+    def close(self):
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def post_request(self, path, data=None, params=None, method="GET", files=None):
+        url = self._url(path)
+        logger.debug(
+            f"Sending {method} request to {url}, params: {params}, data: {data}"
+        )
+        response = self._session.request(
+            method,
+            url,
+            json=data,
+            params=_query_params(params),
+            files=files,
+            timeout=(self.connect_timeout, self.timeout),
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def _call(
+        self, path, data=None, params=None, method="GET", files=None, result=None
+    ):
+        response = self.post_request(path, data, params, method, files)
+        return result(response) if result else response
+
+    def iter_pages(self, path, page_size=100, **params):
+        """Iterate over the pages of a list API (users, collections or sessions).
+
+        Example:
+            for page in client.iter_pages("sessions", username="all", mode="short"):
+                print(page)
+        """
+        if "labels" in params:
+            params["labels"] = _labels_param(params["labels"])
+        cursor = None
+        while True:
+            response = self.post_request(
+                path, params={**params, "limit": page_size, "cursor": cursor}
+            )
+            if response["data"]:
+                yield response["data"]
+            cursor = response.get("next_cursor")
+            if not cursor:
+                break
+
+    def stream_pipeline(self, name, query, collection, session_id=None, filter=None):
+        """Run the pipeline and iterate over the streamed answer frames.
+
+        Yields {"type": "token", "token": ..} frames and a final frame with the
+        answer, sources and returned_state.
+        """
+        url = self._url(f"pipeline/{name or 'default'}/stream")
+        logger.debug(f"Sending streaming request to {url}, query: {query}")
+        response = self._session.post(
+            url,
+            json=_query_data(query, collection, session_id, filter),
+            stream=True,
+            timeout=(self.connect_timeout, self.timeout),
         )
-        return response["data"]
+        response.raise_for_status()
+        with response:
+            for line in response.iter_lines(decode_unicode=True):
+                frame = _parse_frame(line)
+                if frame:
+                    yield frame
 
     def transcribe(self, audio_file):
         with open(audio_file, "rb") as af:
@@ -103,3 +237,185 @@ class Client:
                 method="POST",
             )
             return response["data"]
+
+
+class AsyncClient(_ClientBase):
+    """Async API client (aiohttp), same methods as Client (awaitable).
+
+    Many requests can run concurrently over the pooled (keep-alive) connections.
+
+    Example:
+        async with AsyncClient("http://localhost:8000") as client:
+            results = await asyncio.gather(
+                *[client.run_pipeline(None, q, "default") for q in questions]
+            )
+
+    Args:
+        base_url: The API server url, see Client for the other args.
+    """
+
+    def __init__(self, base_url, username=None, token=None, **kwargs):
+        super().__init__(base_url, username, token, **kwargs)
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_maxsize),
+                timeout=aiohttp.ClientTimeout(
+                    connect=self.connect_timeout, sock_read=self.timeout
+                ),
+                headers={"x_username": self.username},
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def post_request(
+        self, path, data=None, params=None, method="GET", files=None
+    ):
+        url = self._url(path)
+        logger.debug(
+            f"Sending {method} request to {url}, params: {params}, data: {data}"
+        )
+        kwargs = {"params": _query_params(params)}
+        if files:
+            form = aiohttp.FormData()
+            for name, file in files.items():
+                form.add_field(name, file)
+            kwargs["data"] = form
+        else:
+            kwargs["json"] = data
+
+        session = self._get_session()
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            try:
+                async with session.request(method, url, **kwargs) as response:
+                    if (
+                        response.status in _retry_status_codes
+                        and method in _idempotent_methods
+                        and not last_attempt
+                    ):
+                        await self._backoff(attempt, url, response.status)
+                        continue
+                    response.raise_for_status()
+                    return await response.json()
+            except aiohttp.ClientConnectorError as exc:
+                # connection failed (the request was not sent), safe to retry
+                if last_attempt:
+                    raise
+                await self._backoff(attempt, url, exc)
+
+    async def _backoff(self, attempt, url, reason):
+        delay = self.backoff_factor * (2**attempt)
+        logger.debug(f"Retrying request to {url} in {delay} sec ({reason})")
+        await asyncio.sleep(delay)
+
+    async def _call(
+        self, path, data=None, params=None, method="GET", files=None, result=None
+    ):
+        response = await self.post_request(path, data, params, method, files)
+        return result(response) if result else response
+
+    async def iter_pages(self, path, page_size=100, **params):
+        """Iterate over the pages of a list API (async generator)."""
+        if "labels" in params:
+            params["labels"] = _labels_param(params["labels"])
+        cursor = None
+        while True:
+            response = await self.post_request(
+                path, params={**params, "limit": page_size, "cursor": cursor}
+            )
+            if response["data"]:
+                yield response["data"]
+            cursor = response.get("next_cursor")
+            if not cursor:
+                break
+
+    async def stream_pipeline(
+        self, name, query, collection, session_id=None, filter=None
+    ):
+        """Run the pipeline and iterate over the streamed answer frames."""
+        url = self._url(f"pipeline/{name or 'default'}/stream")
+        logger.debug(f"Sending streaming request to {url}, query: {query}")
+        session = self._get_session()
+        async with session.post(
+            url, json=_query_data(query, collection, session_id, filter)
+        ) as response:
+            response.raise_for_status()
+            async for line in response.content:
+                frame = _parse_frame(line.decode().strip())
+                if frame:
+                    yield frame
+
+    async def transcribe(self, audio_file):
+        with open(audio_file, "rb") as af:
+            response = await self.post_request(
+                "transcribe",
+                files={"file": af},
+                method="POST",
+            )
+            return response["data"]
+
+
+def _data(response):
+    return response["data"]
+
+
+def _pipeline_result(response):
+    data = response["data"]
+    logger.debug(f"response: {response}")
+    return data["answer"], data["sources"], data["returned_state"]
+
+
+def _query_data(query, collection, session_id=None, filter=None):
+    return {
+        "question": query,
+        "collection": collection,
+        "session_id": session_id,
+        "filter": filter,
+    }
+
+
+def _parse_frame(line: str):
+    # server sent events line: "data: {json frame}"
+    if not line or not line.startswith("data:"):
+        return None
+    frame = json.loads(line[len("data:") :])
+    if frame["type"] == "error":
+        raise ValueError(f"Pipeline failed: {frame['error']}")
+    return frame
+
+
+def _query_params(params):
+    # (name, value) pairs, skip the None values and repeat the list values
+    if not params:
+        return None
+    pairs = []
+    for name, value in params.items():
+        if value is None:
+            continue
+        for item in value if isinstance(value, (list, tuple)) else [value]:
+            pairs.append((name, str(item).lower() if isinstance(item, bool) else item))
+    return pairs
+
+
+def _labels_param(labels):
+    # labels query param: a list of "name=value" (or "name" for any value)
+    if isinstance(labels, dict):
+        labels = labels.items()
+    elif not labels or isinstance(labels, str):
+        return labels
+    return [
+        label if isinstance(label, str) else "=".join(v for v in label if v is not None)
+        for label in labels
+    ]
@@ -1,6 +1,9 @@
 import importlib
+import json
 import logging
 import os
+import threading
+from collections import OrderedDict
 from pathlib import Path
 
 import dotenv
@@ -22,9 +25,20 @@ class AppConfig(BaseModel):
 
     chunk_size: int = 1024
     chunk_overlap: int = 20
+    # Bulk ingestion: chunks per embedding/insert batch, and max queued batches per stage
+    ingest_batch_size: int = 256
+    ingest_queue_size: int = 4
+    # Number of processes for parallel file parsing (0 = number of CPUs)
+    ingest_workers: int = 0
+    # Web loaders conditional fetch, a json file of the pages ETag/Last-Modified
+    # headers (unchanged pages are skipped on re-ingestion, use a file per collection)
+    web_validators_path: str = None
 
     # Embeddings
     embeddings: dict = {"class_name": "huggingface", "model_name": "all-MiniLM-L6-v2"}
+    # Persistent (on disk) cache of document embeddings, max_rows=0 disables it
+    embeddings_cache_max_rows: int = 0
+    embeddings_cache_path: str = str(Path(default_data_path) / "embeddings_cache")
 
     # Default LLM
     default_llm: dict = {
@@ -39,8 +53,69 @@ class AppConfig(BaseModel):
         "connection_args": {"address": "localhost:19530"},
     }
 
+    # Hybrid retrieval: a per collection BM25 index is built during ingestion and its
+    # results are fused with the vector search results (reciprocal rank fusion),
+    # rrf_k is the fusion rank constant, weights are the (vector, bm25) weights and
+    # fetch_k is the number of candidates taken from each search
+    hybrid_search: bool = False
+    hybrid_rrf_k: int = 60
+    hybrid_weights: list = [1.0, 1.0]
+    hybrid_fetch_k: int = 20
+    sparse_index_path: str = str(Path(default_data_path) / "bm25")
+
+    # Rerank the retrieved chunks: over-fetch rerank_fetch_k candidates, drop near
+    # duplicates (word shingles similarity above rerank_dedupe_threshold), score them
+    # with the reranker (a cross-encoder model, falls back to the "lexical" scorer if
+    # sentence-transformers is not installed) and pass the best k chunks which fit
+    # in rerank_max_tokens to the LLM, rerank_cache_size (query, chunk) scores are cached
+    rerank: bool = False
+    reranker: dict = {
+        "class_name": "cross-encoder",
+        "model_name": "cross-encoder/ms-marco-MiniLM-L-6-v2",
+    }
+    rerank_fetch_k: int = 20
+    rerank_max_tokens: int = 2000
+    rerank_dedupe_threshold: float = 0.9
+    rerank_cache_size: int = 10_000
+
     # Pipeline kwargs
     pipeline_args: dict = {}
+    # Max number of concurrent blocking pipeline calls (per API worker)
+    pipeline_workers: int = 16
+
+    # Conversation memory: number of recent messages kept verbatim in the prompts,
+    # the history prompt token budget, and summarization of the older messages
+    history_window: int = 8
+    history_max_tokens: int = 1500
+    history_summarize: bool = False
+    history_summary_batch: int = 4
+
+    # Session store backend (sql, memory, redis or a class path) and its args,
+    # e.g. {"class_name": "redis", "url": "redis://localhost:6379/0", "ttl": 86400}
+    session_store: dict = {"class_name": "sql"}
+    # SQL store in memory cache of active sessions with write-behind (number
+    # of cached sessions, 0 to disable), max seconds between flushes, max sessions
+    # with queued writes, and the journal of the queued writes (replayed on startup)
+    session_cache_size: int = 0
+    session_flush_interval: float = 1.0
+    session_max_pending: int = 1000
+    session_journal_path: str = str(Path(default_data_path) / "sessions_journal.jsonl")
+
+    # Skip the query refinement LLM call for questions which look standalone (and
+    # share no content words with the last turn), a heuristic so it is opt-in
+    refine_skip_standalone: bool = False
+
+    # Semantic answer cache (used by the AnswerCacheLookup/AnswerCacheSaver steps)
+    answer_cache_size: int = 1000
+    answer_cache_ttl: float = 3600
+    answer_cache_threshold: float = 0.95
+    # Version files of the re-ingested collections, invalidate the cached answers
+    # of other processes (None for a process local cache)
+    answer_cache_versions_path: str = str(Path(default_data_path) / "answer_cache")
+
+    # Max number of cached embeddings/LLM/reranker objects (shared across pipelines,
+    # the vector stores and sparse indexes are not evicted)
+    object_cache_size: int = 32
 
     def default_collection(self):
         return self.default_vector_store.get("collection_name", "default")
@@ -95,6 +170,18 @@ embeddings_shortcuts = {
 vector_db_shortcuts = {
     "milvus": "langchain.vectorstores.Milvus",
     "chroma": "langchain.vectorstores.chroma.Chroma",
+    "local": "llmapps.app.vectorstore.LocalVectorStore",
+}
+
+session_store_shortcuts = {
+    "sql": "llmapps.app.sessions.SessionStore",
+    "memory": "llmapps.app.sessions.MemorySessionStore",
+    "redis": "llmapps.app.sessions.RedisSessionStore",
+}
+
+reranker_shortcuts = {
+    "cross-encoder": "llmapps.app.rerank.CrossEncoderReranker",
+    "lexical": "llmapps.app.rerank.LexicalReranker",
 }
 
 llm_shortcuts = {
@@ -103,15 +190,110 @@ llm_shortcuts = {
 }
 
 
+class ObjectCache:
+    """Thread safe LRU registry of objects created from class_name + args dicts.
+
+    Objects (embeddings, LLMs, vector stores) are created once per distinct
+    (normalized) arguments dict and shared across pipelines and the controller.
+    Stateful objects (vector stores and sparse indexes) are referenced by the
+    retrievers and data loaders, they are not evicted (an evicted store would be
+    re-created as a second live instance of the same collection files) and are not
+    counted in max_size.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 32,
+        pinned_kinds: tuple = ("vector_store", "sparse_index"),
+    ):
+        self.max_size = max_size
+        self.pinned_kinds = pinned_kinds
+        self._objects = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    @staticmethod
+    def make_key(kind: str, args) -> tuple:
+        return kind, json.dumps(args, sort_keys=True, default=str)
+
+    def get_or_create(self, kind: str, args, factory):
+        """Return the cached object for (kind, args), create it with factory() if missing."""
+        key = self.make_key(kind, args)
+        with self._lock:
+            if key in self._objects:
+                self._objects.move_to_end(key)
+                return self._objects[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # build outside the global lock, so slow model loads only block same key callers
+        with key_lock:
+            with self._lock:
+                if key in self._objects:
+                    self._objects.move_to_end(key)
+                    return self._objects[key]
+            logger.debug(f"Creating new {kind} object: {key[1]}")
+            obj = factory()
+            with self._lock:
+                self._objects[key] = obj
+                self._key_locks.pop(key, None)
+                self._evict()
+        return obj
+
+    def _evict(self):
+        # evict the least recently used objects, except the pinned kinds
+        keys = [key for key in self._objects if key[0] not in self.pinned_kinds]
+        for old_key in keys[: max(len(keys) - self.max_size, 0)]:
+            del self._objects[old_key]
+            logger.debug(f"Evicted {old_key[0]} object from cache: {old_key[1]}")
+
+    def invalidate(self, kind: str = None):
+        """Drop cached objects (of a specific kind, or all if kind is None)."""
+        with self._lock:
+            if kind is None:
+                self._objects.clear()
+                return
+            for key in [key for key in self._objects if key[0] == kind]:
+                del self._objects[key]
+
+    def __len__(self):
+        return len(self._objects)
+
+
+object_cache = ObjectCache(config.object_cache_size)
+
+
+def clear_object_cache(config: AppConfig = None):
+    """Clear the shared objects cache (e.g. when the config changes)."""
+    object_cache.invalidate()
+    if config:
+        object_cache.max_size = config.object_cache_size
+
+
 def get_embedding_function(config: AppConfig, embeddings_args: dict = None):
-    return get_object_from_dict(
-        embeddings_args or config.embeddings, embeddings_shortcuts
-    )
+    embeddings_args = embeddings_args or config.embeddings
+
+    def create_embeddings():
+        embeddings = get_object_from_dict(embeddings_args, embeddings_shortcuts)
+        if config.embeddings_cache_max_rows and isinstance(embeddings_args, dict):
+            from .embeddings import CachedEmbeddings
+
+            embeddings = CachedEmbeddings(
+                embeddings,
+                config.embeddings_cache_path,
+                model_name=json.dumps(embeddings_args, sort_keys=True),
+                max_rows=config.embeddings_cache_max_rows,
+            )
+        return embeddings
+
+    return object_cache.get_or_create("embeddings", embeddings_args, create_embeddings)
 
 
 def get_llm(config: AppConfig, llm_args: dict = None):
     """Get a language model instance."""
-    return get_object_from_dict(llm_args or config.default_llm, llm_shortcuts)
+    llm_args = llm_args or config.default_llm
+    return object_cache.get_or_create(
+        "llm", llm_args, lambda: get_object_from_dict(llm_args, llm_shortcuts)
+    )
 
 
 def get_vector_db(
@@ -125,14 +307,59 @@ def get_vector_db(
         config: An AppConfig instance.
         collection_name: The name of the collection to use (if not default).
         vector_store_args: class_name and arguments to pass to the vector store class (None will use the config).
+                           args without a class_name are applied over the config vector store args.
     """
-    embeddings = get_embedding_function(config=config)
+    if vector_store_args and "class_name" not in vector_store_args:
+        vector_store_args = {**config.default_vector_store, **vector_store_args}
     vector_store_args = vector_store_args or config.default_vector_store
     vector_store_args = vector_store_args.copy()
     if collection_name:
         vector_store_args["collection_name"] = collection_name
-    vector_store_args["embedding_function"] = embeddings
-    return get_object_from_dict(vector_store_args, vector_db_shortcuts)
+
+    def create_vector_store():
+        vector_store_args["embedding_function"] = get_embedding_function(config)
+        return get_object_from_dict(vector_store_args, vector_db_shortcuts)
+
+    return object_cache.get_or_create(
+        "vector_store",
+        {"store": vector_store_args, "embeddings": config.embeddings},
+        create_vector_store,
+    )
+
+
+def get_sparse_index(config: AppConfig, collection_name: str = None):
+    """Get the BM25 index of a collection (None if hybrid search is disabled)."""
+    if not config.hybrid_search:
+        return None
+    from .sparse import BM25Index
+
+    path = str(
+        Path(config.sparse_index_path)
+        / (collection_name or config.default_collection())
+    )
+    return object_cache.get_or_create("sparse_index", path, lambda: BM25Index(path))
+
+
+def get_reranker(config: AppConfig):
+    """Get the retrieval reranker (None if reranking is disabled)."""
+    if not config.rerank:
+        return None
+    reranker_args = {"cache_size": config.rerank_cache_size, **config.reranker}
+
+    def create_reranker():
+        try:
+            return get_object_from_dict(reranker_args, reranker_shortcuts)
+        except ImportError as exc:
+            logger.warning(
+                f"Reranker {reranker_args['class_name']} is not available ({exc}), "
+                "using the lexical reranker"
+            )
+            return get_object_from_dict(
+                {"class_name": "lexical", "cache_size": config.rerank_cache_size},
+                reranker_shortcuts,
+            )
+
+    return object_cache.get_or_create("reranker", reranker_args, create_reranker)
 
 
 def get_class_from_string(class_path, shortcuts: dict = {}) -> type:
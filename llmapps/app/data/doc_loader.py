@@ -1,5 +1,19 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
 import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
+from typing import Dict, Union
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
 
 from langchain.document_loaders import (
     CSVLoader,
@@ -12,10 +26,12 @@ from langchain.document_loaders import (
     WebBaseLoader,
 )
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+from pydantic import BaseModel
 
-from ..config import AppConfig, get_vector_db, logger
-from .web_loader import SmartWebLoader
-from llmapps.controller.model import DocCollection
+from ..answer_cache import invalidate_answers
+from ..config import AppConfig, get_sparse_index, get_vector_db, logger
+from .web_loader import AsyncWebLoader, SmartWebLoader
+from llmapps.controller.model import DocCollection, Document
 from llmapps.controller.sqlclient import client
 
 LOADER_MAPPING = {
@@ -32,13 +48,32 @@ LOADER_MAPPING = {
 }
 
 
+WEB_LOADERS = {
+    "web": AsyncWebLoader,
+    "eweb": SmartWebLoader,
+    "sweb": WebBaseLoader,  # sequential (requests based) web loader
+}
+
+
 # get the initialized loader class and its arguments from the type (web or file) and full file path
 # use Path().suffix lib to extract the file extension from the file path
-def get_loader_obj(doc_path: str, loader_type: str = None, **extra_args):
-    if loader_type == "web":
-        return WebBaseLoader([doc_path], **extra_args)
-    elif loader_type == "eweb":
-        return SmartWebLoader([doc_path], **extra_args)
+def get_loader_obj(
+    doc_path: Union[str, list],
+    loader_type: str = None,
+    validators_path: str = None,
+    **extra_args,
+):
+    """Get a document loader object, web loaders accept a list of urls.
+
+    validators_path is the pages ETag/Last-Modified file of the async web loaders
+    (unchanged pages are skipped), ignored by the other loaders.
+    """
+    if loader_type in WEB_LOADERS:
+        urls = doc_path if isinstance(doc_path, list) else [doc_path]
+        loader_class = WEB_LOADERS[loader_type]
+        if validators_path and issubclass(loader_class, AsyncWebLoader):
+            extra_args["validators_path"] = validators_path
+        return loader_class(urls, **extra_args)
     else:
         ext = Path(doc_path).suffix
         if ext in LOADER_MAPPING:
@@ -47,8 +82,143 @@ def get_loader_obj(doc_path: str, loader_type: str = None, **extra_args):
         raise ValueError(f"Unsupported file extension '{ext}'")
 
 
+def _peak_memory_mb() -> float:
+    if resource is None:
+        return 0.0
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class IngestStats(BaseModel):
+    """Ingestion statistics."""
+
+    documents: int = 0
+    sources: int = 0
+    skipped: int = 0
+    chunks: int = 0
+    batches: int = 0
+    elapsed: float = 0.0
+    chunks_per_second: float = 0.0
+    peak_memory_mb: float = 0.0
+    # per file parsing time (seconds) and errors, in parallel file ingestion
+    file_timings: Dict[str, float] = {}
+    failures: Dict[str, str] = {}
+
+    def done(self, start: float):
+        self.elapsed = time.monotonic() - start
+        self.chunks_per_second = self.chunks / self.elapsed if self.elapsed else 0
+        self.peak_memory_mb = _peak_memory_mb()
+
+    def __str__(self):
+        failures = f", {len(self.failures)} failed files" if self.failures else ""
+        return (
+            f"ingested {self.documents} documents from {self.sources} sources "
+            f"({self.skipped} unchanged{failures}), {self.chunks} chunks in "
+            f"{self.batches} batches, {self.elapsed:.2f}s "
+            f"({self.chunks_per_second:.1f} chunks/s), "
+            f"peak memory {self.peak_memory_mb:.1f} MB"
+        )
+
+
+class ParsedSource(BaseModel):
+    """The chunks of a source (file, url, ..) ready for ingestion."""
+
+    source: str
+    num_docs: int
+    content_hash: str
+    chunks: list
+
+
+def parse_documents(docs: list, text_splitter, to_chunk: bool, hash_args) -> list:
+    """Group the documents by source, hash and split them into chunks.
+
+    Args:
+        docs: A list of documents (from a loader).
+        text_splitter: A text splitter.
+        to_chunk: Whether to split the documents (False if already chunked).
+        hash_args: The ingestion args which affect the content hash (chunk args,
+            metadata and extra args).
+
+    Returns:
+        A list of ParsedSource objects.
+    """
+    sources = []
+    for source, source_docs in _group_by_source(docs).items():
+        chunks = []
+        for doc in source_docs:
+            if to_chunk:
+                doc_chunks = text_splitter.split_documents([doc])
+                for i, chunk in enumerate(doc_chunks):
+                    chunk.metadata["chunk"] = i
+                chunks.extend(doc_chunks)
+            else:
+                chunks.append(doc)
+        sources.append(
+            ParsedSource(
+                source=source,
+                num_docs=len(source_docs),
+                # the settings layout of the already ingested sources hashes
+                content_hash=_content_hash(
+                    source_docs, [hash_args[0], to_chunk, *hash_args[1:]]
+                ),
+                chunks=chunks,
+            )
+        )
+    return sources
+
+
+def parse_file(
+    path: str, loader_type: str, chunk_size: int, chunk_overlap: int, hash_args
+):
+    """Load and parse a file (runs in a worker process), returns (sources, elapsed)."""
+    start = time.monotonic()
+    loader = get_loader_obj(path, loader_type=loader_type)
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    )
+    to_chunk = not hasattr(loader, "chunked")
+    sources = parse_documents(loader.load(), text_splitter, to_chunk, hash_args)
+    return sources, time.monotonic() - start
+
+
+def supports_embedded_insert(vector_store) -> bool:
+    """Check if we can insert pre-computed embeddings into the vector store."""
+    if hasattr(vector_store, "add_embeddings"):
+        return True
+    collection = getattr(vector_store, "_collection", None)  # Chroma
+    return collection is not None and hasattr(collection, "upsert")
+
+
+def add_embedded_documents(
+    vector_store, chunks: list, embeddings: list, ids: list = None
+) -> list:
+    """Insert documents with pre-computed embeddings into the vector store."""
+    texts = [chunk.page_content for chunk in chunks]
+    metadatas = [chunk.metadata for chunk in chunks]
+    if hasattr(vector_store, "add_embeddings"):
+        return vector_store.add_embeddings(
+            list(zip(texts, embeddings)), metadatas=metadatas, ids=ids
+        )
+    ids = ids or [uuid.uuid4().hex for _ in chunks]
+    vector_store._collection.upsert(
+        ids=ids, embeddings=embeddings, metadatas=metadatas, documents=texts
+    )
+    return ids
+
+
+_end_of_stream = object()
+
+
 class DataLoader:
     """Loads documents into a vector store.
+
+    When a collection name is specified, each ingested source (e.g. file or url) is
+    recorded in the documents table with its content hash, version and number of
+    chunks. Unchanged sources are skipped and changed sources replace their old chunks.
+    When a sparse (BM25) index is specified, the chunks are also added to it (for
+    hybrid retrieval). Loaders with a commit() method (e.g. the web loaders fetch
+    validators) are committed after their documents were ingested.
+
     Example:
 
         data_loader = DataLoader(config)
@@ -56,24 +226,406 @@ class DataLoader:
         data_loader.load(loader, metadata={"xx": "web"})
     """
 
-    def __init__(self, config: AppConfig, vector_store=None):
+    def __init__(
+        self,
+        config: AppConfig,
+        vector_store=None,
+        collection_name: str = None,
+        session=None,
+        sparse_index=None,
+    ):
         self.vector_store = vector_store
+        self.sparse_index = sparse_index
+        self.collection_name = collection_name
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=config.chunk_size, chunk_overlap=config.chunk_overlap
         )
+        self.batch_size = config.ingest_batch_size
+        self.queue_size = config.ingest_queue_size
+        self.workers = config.ingest_workers
+        self._chunk_args = [config.chunk_size, config.chunk_overlap]
+        self._answers_versions_path = config.answer_cache_versions_path
+        self._session = session
+
+    def _get_session(self):
+        if not self.collection_name:
+            return None
+        return self._session or client.get_db_session()
+
+    def _close_session(self, session):
+        if session is not None and session is not self._session:
+            session.close()
+
+    def _hash_args(self, metadata) -> list:
+        """The ingestion args which affect the sources content hash."""
+        hash_args = [self._chunk_args, metadata]
+        if self.sparse_index is not None:
+            # sources ingested before the BM25 index was enabled are re-ingested
+            hash_args.append("bm25")
+        return hash_args
 
-    def load(self, loader, metadata: dict = None, version: int = None):
+    def _parse(self, loader, metadata) -> list:
+        to_chunk = not hasattr(loader, "chunked")
+        hash_args = self._hash_args(metadata)
+        return parse_documents(loader.load(), self.text_splitter, to_chunk, hash_args)
+
+    def load(self, loader, metadata: dict = None, version: int = None) -> IngestStats:
         """Loads documents into the vector store.
 
         Args:
             loader: A document loader.
             metadata: A dictionary of metadata to attach to the documents.
             version: A version number for the documents.
+
+        Returns:
+            The ingestion statistics.
+        """
+        start = time.monotonic()
+        stats = IngestStats()
+        session = self._get_session()
+        try:
+            for parsed in self._parse(loader, metadata):
+                stats.documents += parsed.num_docs
+                stats.sources += 1
+                prepared = self._prepare_source(parsed, metadata, version, session)
+                if prepared is None:
+                    stats.skipped += 1
+                    continue
+                chunks, ids, record, old_record = prepared
+                self.vector_store.add_documents(chunks, ids=ids)
+                self._index_sparse(chunks, ids)
+                self._delete_old_chunks(old_record)
+                stats.chunks += len(chunks)
+                stats.batches += 1
+                self._save_record(record, old_record, session)
+        finally:
+            self._close_session(session)
+            self._invalidate_answers(stats)
+            self._flush_embeddings()
+        _commit_loaders([loader])
+        stats.done(start)
+        return stats
+
+    def load_bulk(
+        self,
+        loaders,
+        metadata: dict = None,
+        version: int = None,
+        batch_size: int = None,
+    ) -> IngestStats:
+        """Loads documents from one or more loaders using a batched ingestion pipeline.
+
+        Parsing/chunking, embedding and inserting run as overlapping stages connected
+        by bounded queues, the embedding and insert calls are done in batches.
+
+        Args:
+            loaders: A document loader or a list of loaders.
+            metadata: A dictionary of metadata to attach to the documents.
+            version: A version number for the documents.
+            batch_size: Number of chunks per embedding/insert batch.
+
+        Returns:
+            The ingestion statistics.
         """
-        docs = loader.load()
-        to_chunk = not hasattr(loader, "chunked")
-        for doc in docs:
-            self.ingest_document(doc, metadata, version, to_chunk=to_chunk)
+        if not isinstance(loaders, (list, tuple)):
+            loaders = [loaders]
+
+        def parsed_sources(stats):
+            for loader in loaders:
+                yield from self._parse(loader, metadata)
+
+        stats = self._run_pipeline(parsed_sources, metadata, version, batch_size)
+        _commit_loaders(loaders)
+        return stats
+
+    def load_files(
+        self,
+        paths: list,
+        loader_type: str = None,
+        metadata: dict = None,
+        version: int = None,
+        workers: int = None,
+        batch_size: int = None,
+    ) -> IngestStats:
+        """Loads files using a pool of processes for parsing and chunking.
+
+        The parsed files are streamed (as they complete) into the batched
+        embedding/insert pipeline (see load_bulk). A file which fails to parse is
+        reported in the stats failures and does not abort the batch.
+
+        Args:
+            paths: A list of file paths.
+            loader_type: The loader type (None to select the loader by file extension).
+            metadata: A dictionary of metadata to attach to the documents.
+            version: A version number for the documents.
+            workers: Number of parsing processes (default to config.ingest_workers).
+            batch_size: Number of chunks per embedding/insert batch.
+
+        Returns:
+            The ingestion statistics.
+        """
+        workers = workers or self.workers or os.cpu_count()
+        hash_args = self._hash_args(metadata)
+        # the workers are started on demand (from the pipeline parse thread), forking
+        # a process with running threads (and held locks) is not safe, use spawn
+        executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+        def parsed_sources(stats):
+            paths_iter = iter(enumerate(paths))
+            pending = {}
+
+            def submit_next():
+                for i, path in paths_iter:
+                    future = executor.submit(
+                        parse_file, path, loader_type, *self._chunk_args, hash_args
+                    )
+                    pending[future] = (i, path)
+                    return
+
+            # keep a bounded number of files in flight
+            for _ in range(workers * 2):
+                submit_next()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i, path = pending.pop(future)
+                    submit_next()
+                    try:
+                        sources, elapsed = future.result()
+                    except Exception as exc:
+                        logger.error(f"Failed to parse {path}: {exc!r}")
+                        stats.failures[path] = repr(exc)
+                        continue
+                    stats.file_timings[path] = round(elapsed, 3)
+                    num_chunks = sum(len(source.chunks) for source in sources)
+                    logger.info(
+                        f"[{len(stats.file_timings) + len(stats.failures)}/"
+                        f"{len(paths)}] Parsed {path} in {elapsed:.2f}s "
+                        f"({num_chunks} chunks)"
+                    )
+                    yield from sources
+
+        with executor:
+            return self._run_pipeline(parsed_sources, metadata, version, batch_size)
+
+    def _run_pipeline(
+        self, parsed_sources, metadata, version, batch_size: int = None
+    ) -> IngestStats:
+        """Run the parse -> embed -> insert pipeline over parsed_sources(stats)."""
+        batch_size = batch_size or self.batch_size
+        embeddings = getattr(self.vector_store, "embeddings", None)
+        if not supports_embedded_insert(self.vector_store):
+            # the vector store embeds internally, only batch the inserts
+            embeddings = None
+
+        stats = IngestStats()
+        records = []
+        errors = []
+        stop = threading.Event()
+        chunks_queue = queue.Queue(maxsize=self.queue_size)
+        embedded_queue = queue.Queue(maxsize=self.queue_size)
+
+        def put(q, item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def get(q):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            return _end_of_stream
+
+        def parse_stage():
+            try:
+                batch = []
+                for parsed in parsed_sources(stats):
+                    stats.documents += parsed.num_docs
+                    stats.sources += 1
+                    prepared = self._prepare_source(parsed, metadata, version, session)
+                    if prepared is None:
+                        stats.skipped += 1
+                        continue
+                    chunks, ids, record, old_record = prepared
+                    records.append((record, old_record))
+                    batch.extend(zip(chunks, ids or [None] * len(chunks)))
+                    while len(batch) >= batch_size:
+                        if not put(chunks_queue, batch[:batch_size]):
+                            return
+                        batch = batch[batch_size:]
+                if batch:
+                    put(chunks_queue, batch)
+            except Exception as exc:
+                errors.append(exc)
+                stop.set()
+            finally:
+                put(chunks_queue, _end_of_stream)
+
+        def embed_stage():
+            try:
+                while True:
+                    batch = get(chunks_queue)
+                    if batch is _end_of_stream:
+                        break
+                    vectors = None
+                    if embeddings is not None:
+                        vectors = embeddings.embed_documents(
+                            [chunk.page_content for chunk, _ in batch]
+                        )
+                    if not put(embedded_queue, (batch, vectors)):
+                        return
+            except Exception as exc:
+                errors.append(exc)
+                stop.set()
+            finally:
+                put(embedded_queue, _end_of_stream)
+
+        start = time.monotonic()
+        session = self._get_session()
+        threads = [
+            threading.Thread(target=parse_stage, daemon=True),
+            threading.Thread(target=embed_stage, daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                item = get(embedded_queue)
+                if item is _end_of_stream:
+                    break
+                batch, vectors = item
+                chunks = [chunk for chunk, _ in batch]
+                ids = [chunk_id for _, chunk_id in batch]
+                ids = ids if all(ids) else None
+                if vectors is None:
+                    self.vector_store.add_documents(chunks, ids=ids)
+                else:
+                    add_embedded_documents(self.vector_store, chunks, vectors, ids)
+                self._index_sparse(chunks, ids)
+                stats.chunks += len(batch)
+                stats.batches += 1
+                logger.debug(f"Inserted batch of {len(batch)} chunks")
+            if errors:
+                raise errors[0]
+            # delete the old chunks and record the sources only after all their
+            # (new) chunks were inserted
+            for record, old_record in records:
+                self._delete_old_chunks(old_record)
+                self._save_record(record, old_record, session)
+        except Exception:
+            stop.set()
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+            self._close_session(session)
+            self._invalidate_answers(stats)
+            self._flush_embeddings()
+
+        stats.done(start)
+        logger.info(f"Bulk ingestion done, {stats}")
+        return stats
+
+    def _flush_embeddings(self):
+        # save the new vectors of a caching embeddings (see CachedEmbeddings)
+        embeddings = getattr(self.vector_store, "embeddings", None)
+        if hasattr(embeddings, "flush"):
+            embeddings.flush()
+
+    def _invalidate_answers(self, stats: IngestStats):
+        # cached answers of the collection may be stale after (partial) ingestion,
+        # other processes are signaled for the (tracked) collections
+        if stats.chunks:
+            versions_path = self.collection_name and self._answers_versions_path
+            invalidate_answers(self.collection_name, versions_path)
+
+    def _prepare_source(self, parsed: ParsedSource, metadata, version, session):
+        """Attach the metadata to the source chunks and prepare its documents record.
+
+        Returns:
+            None if the source is unchanged, or (chunks, chunk ids, record, old record)
+        """
+        record = old_record = ids = None
+        doc_uid = None
+        if self.collection_name:
+            old_records = client.list_documents(
+                collection=self.collection_name, source=parsed.source, session=session
+            ).data
+            old_record = old_records[0] if old_records else None
+            if old_record and old_record.content_hash == parsed.content_hash:
+                logger.debug(f"Source {parsed.source} is unchanged, skipping")
+                return None
+            doc_uid = old_record.name if old_record else uuid.uuid4().hex
+            if version:
+                new_version = str(version)
+            elif old_record and str(old_record.version).isdigit():
+                new_version = str(int(old_record.version) + 1)
+            else:
+                new_version = "1"
+            record = Document(
+                name=doc_uid,
+                collection=self.collection_name,
+                source=parsed.source,
+                version=new_version,
+                content_hash=parsed.content_hash,
+                num_chunks=len(parsed.chunks),
+            )
+            ids = _chunk_ids(doc_uid, len(parsed.chunks), parsed.content_hash)
+            _apply_metadata(parsed.chunks, metadata, version, doc_uid, ids)
+        else:
+            # not tracked, a unique id per document (page)
+            doc_uid = None
+            ids = []
+            for chunk in parsed.chunks:
+                if chunk.metadata.get("chunk", 0) == 0:
+                    doc_uid = uuid.uuid4().hex
+                ids.append(f"{doc_uid}-{chunk.metadata.get('chunk', 0)}")
+                _apply_metadata([chunk], metadata, version, doc_uid, ids[-1:])
+        return parsed.chunks, ids, record, old_record
+
+    def _index_sparse(self, chunks: list, ids: list = None):
+        if self.sparse_index is not None:
+            self.sparse_index.add_documents(chunks, ids=ids)
+
+    def _delete_old_chunks(self, old_record: Document):
+        """Delete the chunks of the previous version of a source.
+
+        Called after the new chunks were inserted, the chunk ids include the content
+        hash so the new chunks never reuse (and depend on the store to overwrite) the
+        old ids.
+        """
+        if not old_record or not old_record.num_chunks:
+            return
+        ids = _chunk_ids(
+            old_record.name, old_record.num_chunks, old_record.content_hash
+        )
+        logger.debug(f"Deleting {len(ids)} old chunks of {old_record.source}")
+        if self.sparse_index is not None:
+            self.sparse_index.delete(ids)
+        try:
+            self.vector_store.delete(ids)
+        except NotImplementedError:
+            logger.warning(
+                f"Vector store {type(self.vector_store).__name__} does not support "
+                "delete, old chunks were not removed"
+            )
+
+    def _save_record(self, record: Document, old_record: Document, session):
+        if record is None:
+            return
+        if old_record:
+            client.update_document(record, session=session).with_raise()
+        else:
+            client.create_document(record, session=session).with_raise()
 
     def ingest_document(
         self,
@@ -91,25 +643,17 @@ class DataLoader:
             version: A version number for the document.
             doc_uid: A unique identifier for the document (will be generated if None).
         """
-        if not doc_uid:
-            doc_uid = uuid.uuid4().hex
         if to_chunk:
             chunks = self.text_splitter.split_documents([doc])
+            for i, chunk in enumerate(chunks):
+                chunk.metadata["chunk"] = i
         else:
             chunks = [doc]
-        for i, chunk in enumerate(chunks):
-            if to_chunk:
-                chunk.metadata["chunk"] = i
-            if metadata:
-                for key, value in metadata.items():
-                    chunk.metadata[key] = value
-            chunk.metadata["doc_uid"] = doc_uid
-            if version:
-                chunk.metadata["version"] = version
-            logger.debug(
-                f"Loading doc chunk:\n{chunk.page_content}\nMetadata: {chunk.metadata}"
-            )
-        self.vector_store.add_documents(chunks)
+        doc_uid = doc_uid or uuid.uuid4().hex
+        ids = _chunk_ids(doc_uid, len(chunks))
+        _apply_metadata(chunks, metadata, version, doc_uid, ids)
+        self.vector_store.add_documents(chunks, ids=ids)
+        self._index_sparse(chunks, ids)
 
 
 def get_data_loader(
@@ -132,4 +676,61 @@ def get_data_loader(
         collection_name=collection_name,
         vector_store_args=db_args,
     )
-    return DataLoader(config, vector_store=vector_db)
+    return DataLoader(
+        config,
+        vector_store=vector_db,
+        collection_name=collection_name,
+        session=None if close_session else session,
+        sparse_index=get_sparse_index(config, collection_name),
+    )
+
+
+def _commit_loaders(loaders: list):
+    for loader in loaders:
+        if hasattr(loader, "commit"):
+            loader.commit()
+
+
+def _normalize_metadata(metadata):
+    if metadata and not isinstance(metadata, dict):
+        return dict(metadata)
+    return metadata
+
+
+def _apply_metadata(chunks: list, metadata, version, doc_uid: str, ids: list):
+    metadata = _normalize_metadata(metadata)
+    for chunk, chunk_id in zip(chunks, ids):
+        if metadata:
+            for key, value in metadata.items():
+                chunk.metadata[key] = value
+        chunk.metadata["doc_uid"] = doc_uid
+        # unique per chunk (the chunk index is per document page)
+        chunk.metadata["chunk_id"] = chunk_id
+        if version:
+            chunk.metadata["version"] = version
+        logger.debug(
+            f"Loading doc chunk:\n{chunk.page_content}\nMetadata: {chunk.metadata}"
+        )
+
+
+def _content_hash(docs: list, settings) -> str:
+    hasher = hashlib.sha256()
+    hasher.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    for doc in docs:
+        hasher.update(doc.page_content.encode("utf-8"))
+        hasher.update(json.dumps(doc.metadata, sort_keys=True, default=str).encode())
+    return hasher.hexdigest()
+
+
+def _group_by_source(docs: list) -> dict:
+    groups = {}
+    for doc in docs:
+        groups.setdefault(str(doc.metadata.get("source", "")), []).append(doc)
+    return groups
+
+
+def _chunk_ids(doc_uid: str, num_chunks: int, content_hash: str = None) -> list:
+    # ids of a tracked source are unique per content version (most vector stores,
+    # e.g. Milvus, insert duplicate ids instead of replacing the rows)
+    prefix = f"{doc_uid}-{content_hash[:12]}" if content_hash else doc_uid
+    return [f"{prefix}-{i}" for i in range(num_chunks)]
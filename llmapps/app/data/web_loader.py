@@ -1,60 +1,236 @@
+import asyncio
+import json
+import random
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
 from urllib.parse import urlparse
 
-import requests
+import aiohttp
 from bs4 import BeautifulSoup
 from langchain_core.documents import Document
 
+from ..config import logger
 
-class SmartWebLoader:
-    chunked = True
+_retry_status_codes = [429, 500, 502, 503, 504]
+
+
+class AsyncFetcher:
+    """Fetch web pages concurrently and parse them in a worker pool.
+
+    Uses a single aiohttp session (keep-alive connections pooled per host), a bound
+    on the number of in-flight requests, retries with exponential backoff and
+    (optionally) conditional GET using the ETag/Last-Modified of the last fetch.
+
+    Args:
+        max_concurrency: Max number of concurrent requests.
+        limit_per_host: Max number of open connections per host.
+        retries: Number of retries on connection errors or 429/5xx responses.
+        backoff: Initial retry delay in seconds (doubled on every retry).
+        timeout: Request timeout in seconds.
+        validators_path: Path of a json file with the pages ETag/Last-Modified
+            headers, if set, unchanged pages (304) are skipped. The headers of the
+            fetched pages are saved by commit() (after the pages were ingested).
+        parse_workers: Number of processes for parsing html (0 for a thread pool).
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 16,
+        limit_per_host: int = 4,
+        retries: int = 3,
+        backoff: float = 0.5,
+        timeout: float = 30,
+        validators_path: str = None,
+        parse_workers: int = 0,
+    ):
+        self.max_concurrency = max_concurrency
+        self.limit_per_host = limit_per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.validators_path = validators_path
+        self.parse_workers = parse_workers
+        self.validators = {}
+        self.fetched_validators = {}  # of the fetched pages, saved by commit()
+        if validators_path and Path(validators_path).exists():
+            with open(validators_path) as fp:
+                self.validators = json.load(fp)
+
+    def commit(self):
+        """Save the validators of the fetched pages (call after they were ingested)."""
+        if not self.validators_path or not self.fetched_validators:
+            return
+        self.validators.update(self.fetched_validators)
+        self.fetched_validators = {}
+        path = Path(self.validators_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w") as fp:
+            json.dump(self.validators, fp)
+        tmp_path.replace(path)
+
+    def _conditional_headers(self, url: str) -> dict:
+        headers = {}
+        if not self.validators_path or url not in self.validators:
+            return headers
+        validators = self.validators[url]
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+        return headers
+
+    async def _fetch(self, session, semaphore, url: str):
+        """Fetch a url, returns the page content or None if unchanged or failed."""
+        headers = self._conditional_headers(url)
+        for attempt in range(self.retries + 1):
+            try:
+                async with semaphore:
+                    async with session.get(url, headers=headers) as response:
+                        if response.status == 304:
+                            logger.debug(f"Page not modified: {url}")
+                            return None
+                        if response.status not in _retry_status_codes:
+                            response.raise_for_status()
+                            content = await response.read()
+                            self.fetched_validators[url] = {
+                                "etag": response.headers.get("ETag"),
+                                "last_modified": response.headers.get("Last-Modified"),
+                            }
+                            return content
+                        error = f"status {response.status}"
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as exc:
+                error = repr(exc)
+            except aiohttp.ClientResponseError as exc:
+                logger.warning(f"Failed to fetch {url}: {exc}")
+                return None
+            if attempt < self.retries:
+                delay = self.backoff * 2**attempt * (1 + random.random() / 2)
+                logger.debug(f"Retrying {url} in {delay:.2f}s ({error})")
+                await asyncio.sleep(delay)
+        logger.warning(f"Failed to fetch {url} after {self.retries} retries: {error}")
+        return None
+
+    async def afetch_pages(self, urls: list, parse_fn) -> list:
+        """Fetch the urls and parse each page with parse_fn(url, content) -> documents."""
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        connector = aiohttp.TCPConnector(
+            limit=self.max_concurrency, limit_per_host=self.limit_per_host
+        )
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        if self.parse_workers:
+            executor = ProcessPoolExecutor(self.parse_workers)
+        else:
+            executor = ThreadPoolExecutor(max(1, min(4, self.max_concurrency)))
+
+        async def fetch_and_parse(session, url):
+            content = await self._fetch(session, semaphore, url)
+            if content is None:
+                return []
+            return await loop.run_in_executor(executor, parse_fn, url, content)
+
+        try:
+            async with aiohttp.ClientSession(
+                connector=connector, timeout=timeout
+            ) as session:
+                results = await asyncio.gather(
+                    *[fetch_and_parse(session, url) for url in urls]
+                )
+        finally:
+            executor.shutdown(wait=False)
+        return [doc for docs in results for doc in docs]
+
+    def fetch_pages(self, urls: list, parse_fn) -> list:
+        """Sync version of afetch_pages (can be called with or without a running loop)."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.afetch_pages(urls, parse_fn))
+        # called from a running event loop (e.g. FastAPI handler), use a new thread
+        with ThreadPoolExecutor(1) as executor:
+            return executor.submit(
+                asyncio.run, self.afetch_pages(urls, parse_fn)
+            ).result()
+
+
+def parse_faq_page(url: str, content: bytes) -> list:
+    """Parse an accordion style FAQ page into question/answer documents."""
+    # Get url parts:
+    parsed_url = urlparse(url)
+    url_parts = parsed_url.path.rsplit("/", 4)
+
+    soup = BeautifulSoup(content, "html.parser")
+
+    # Get titles:
+    titles_span = soup.find_all("span", class_="cmp-accordion__title")
+    titles = [title.text for title in titles_span]
+
+    # Get answers:
+    answers_div = soup.find_all("div", class_="cmp-text")
+    # answers = [answer.encode_contents() for answer in answers_div]
+    answers = [answer.get_text() for answer in answers_div]
+
+    # Get hyperlinks to content:
+    specific_links_button = soup.find_all("button", class_="cmp-accordion__button")
+    specific_links = [
+        url + "#" + button.attrs["id"] for button in specific_links_button
+    ]
+
+    chunks = []
+    for title, answer, specific_link in zip(titles, answers, specific_links):
+        content = f"Question: {title}\nAnswer: {answer}\n"
+        full_title = f"{url_parts[-4]}/{url_parts[-3]}/{url_parts[-2]}/{title}"
+        metadata = {
+            "service": url_parts[-4],
+            "topic": url_parts[-3],
+            "subtopic": url_parts[-2],
+            "section": url_parts[-1].removesuffix(".html"),
+            "title": full_title,
+            "source": specific_link,
+        }
+        chunks.append(Document(page_content=content, metadata=metadata))
+
+    return chunks
+
+
+def parse_web_page(url: str, content: bytes) -> list:
+    """Parse a web page into a single text document (same as WebBaseLoader)."""
+    soup = BeautifulSoup(content, "html.parser")
+    metadata = {"source": url}
+    if title := soup.find("title"):
+        metadata["title"] = title.get_text()
+    if description := soup.find("meta", attrs={"name": "description"}):
+        metadata["description"] = description.get("content", "No description found.")
+    if html := soup.find("html"):
+        metadata["language"] = html.get("lang", "No language found.")
+    return [Document(page_content=soup.get_text(), metadata=metadata)]
+
+
+class AsyncWebLoader:
+    """Load web pages concurrently (see AsyncFetcher for the args)."""
+
+    _parse_fn = staticmethod(parse_web_page)
 
     def __init__(self, urls: list, **kwargs):
         if isinstance(urls, str):
             urls = [urls]
         self.urls = urls
-
-    def _parse_page(self, url: str) -> Document:
-        # Get url parts:
-        parsed_url = urlparse(url)
-        url_parts = parsed_url.path.rsplit("/", 4)
-
-        # Get html from web url:
-        page = requests.get(url)
-        soup = BeautifulSoup(page.content, "html.parser")
-
-        # Get titles:
-        titles_span = soup.find_all("span", class_="cmp-accordion__title")
-        titles = [title.text for title in titles_span]
-
-        # Get answers:
-        answers_div = soup.find_all("div", class_="cmp-text")
-        # answers = [answer.encode_contents() for answer in answers_div]
-        answers = [answer.get_text() for answer in answers_div]
-
-        # Get hyperlinks to content:
-        specific_links_button = soup.find_all("button", class_="cmp-accordion__button")
-        specific_links = [
-            url + "#" + button.attrs["id"] for button in specific_links_button
-        ]
-
-        chunks = []
-        for title, answer, specific_link in zip(titles, answers, specific_links):
-            content = f"Question: {title}\nAnswer: {answer}\n"
-            full_title = f"{url_parts[-4]}/{url_parts[-3]}/{url_parts[-2]}/{title}"
-            metadata = {
-                "service": url_parts[-4],
-                "topic": url_parts[-3],
-                "subtopic": url_parts[-2],
-                "section": url_parts[-1].removesuffix(".html"),
-                "title": full_title,
-                "source": specific_link,
-            }
-            chunks.append(Document(page_content=content, metadata=metadata))
-
-        return chunks
+        self.fetcher = AsyncFetcher(**kwargs)
 
     def load(self):
-        docs = []
-        for url in self.urls:
-            docs.extend(self._parse_page(url))
-        return docs
+        return self.fetcher.fetch_pages(self.urls, self._parse_fn)
+
+    async def aload(self):
+        return await self.fetcher.afetch_pages(self.urls, self._parse_fn)
+
+    def commit(self):
+        """Save the fetched pages validators, called by the DataLoader after ingestion."""
+        self.fetcher.commit()
+
+
+class SmartWebLoader(AsyncWebLoader):
+    """Load FAQ web pages concurrently, each question/answer is a separate chunk."""
+
+    chunked = True
+    _parse_fn = staticmethod(parse_faq_page)
@@ -0,0 +1,271 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from langchain.schema.embeddings import Embeddings
+
+from .config import logger
+
+_key_size = 20  # sha1 digest
+
+
+class EmbeddingsStore:
+    """A persistent, content addressed store of float32 embedding vectors.
+
+    The vectors are kept in a memory mapped float32 matrix (vectors.f32) and the
+    index (text hash -> row, last access tick) is saved in a compact numpy file
+    (index.npz). When the store reaches max_rows the least recently used rows
+    are evicted and their slots are reused.
+
+    New vectors are saved (flush) when flush_rows were added or flush_interval
+    seconds passed since the last save, and at the end of an ingestion. The files
+    are replaced atomically, and evicted slots are reused only after the index
+    without them was saved, so a crash loses only the unsaved vectors.
+
+    Args:
+        path: The directory of the store (one store per embedding model).
+        max_rows: Max number of cached vectors.
+        evict_ratio: The fraction of rows to evict when the store is full.
+        flush_rows: Number of new vectors which triggers a save.
+        flush_interval: Max seconds between saves of new vectors.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_rows: int = 500_000,
+        evict_ratio: float = 0.1,
+        flush_rows: int = 10_000,
+        flush_interval: float = 60.0,
+    ):
+        self.path = Path(path)
+        self.max_rows = max_rows
+        self.evict_ratio = evict_ratio
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.dim = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._vectors = None
+        self._capacity = 0
+        self._rows = {}  # key -> row
+        self._last_used = {}  # key -> tick
+        self._free = []
+        self._next_row = 0
+        self._tick = 0
+        self._unsaved = 0  # vectors added since the last save
+        self._last_save = time.monotonic()
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._open()
+
+    @property
+    def _vectors_path(self):
+        return self.path / "vectors.f32"
+
+    @property
+    def _index_path(self):
+        return self.path / "index.npz"
+
+    @property
+    def _meta_path(self):
+        return self.path / "meta.json"
+
+    def _open(self):
+        if not self._meta_path.exists() or not self._index_path.exists():
+            return
+        with open(self._meta_path) as fp:
+            meta = json.load(fp)
+        self.dim = meta["dim"]
+        self._capacity = meta["capacity"]
+        index = np.load(self._index_path)
+        keys = [key.tobytes() for key in index["keys"]]
+        rows, ticks = index["rows"], index["ticks"]
+        self._rows = dict(zip(keys, rows.tolist()))
+        self._last_used = dict(zip(keys, ticks.tolist()))
+        self._tick = int(ticks.max()) if len(ticks) else 0
+        self._next_row = int(rows.max()) + 1 if len(rows) else 0
+        used = set(self._rows.values())
+        self._free = [row for row in range(self._next_row) if row not in used]
+        self._vectors = np.memmap(
+            self._vectors_path,
+            dtype=np.float32,
+            mode="r+",
+            shape=(self._capacity, self.dim),
+        )
+        logger.debug(f"Opened embeddings cache {self.path} with {len(self._rows)} rows")
+
+    def _grow(self, min_rows: int):
+        capacity = min(self.max_rows, max(1024, self._capacity * 2, min_rows))
+        if capacity <= self._capacity:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        if self._vectors is not None:
+            self._vectors.flush()
+            del self._vectors
+        with open(self._vectors_path, "ab") as fp:
+            fp.truncate(capacity * self.dim * 4)
+        self._vectors = np.memmap(
+            self._vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim)
+        )
+        self._capacity = capacity
+
+    def _evict(self):
+        num_evict = max(1, int(self.max_rows * self.evict_ratio))
+        rows = []
+        for key, _ in sorted(self._last_used.items(), key=lambda x: x[1])[:num_evict]:
+            rows.append(self._rows.pop(key))
+            del self._last_used[key]
+        # the saved index must not point to the slots before they are reused
+        self._save()
+        self._free.extend(rows)
+        self.evictions += num_evict
+
+    def _allocate_row(self) -> int:
+        if self._free:
+            return self._free.pop()
+        if self._next_row >= self.max_rows:
+            self._evict()
+            return self._free.pop()
+        if self._next_row >= self._capacity:
+            self._grow(self._next_row + 1)
+        self._next_row += 1
+        return self._next_row - 1
+
+    def get_many(self, keys: List[bytes]) -> list:
+        """Return the cached vectors for the keys (None for missing keys)."""
+        results = []
+        with self._lock:
+            for key in keys:
+                row = self._rows.get(key)
+                if row is None:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                self.hits += 1
+                self._tick += 1
+                self._last_used[key] = self._tick
+                results.append(self._vectors[row].tolist())
+        return results
+
+    def put_many(self, keys: List[bytes], vectors: List[List[float]]):
+        """Add vectors to the store."""
+        if not keys:
+            return
+        with self._lock:
+            if self.dim is None:
+                self.dim = len(vectors[0])
+            for key, vector in zip(keys, vectors):
+                row = self._rows.get(key)
+                if row is None:
+                    row = self._allocate_row()
+                    self._rows[key] = row
+                self._tick += 1
+                self._last_used[key] = self._tick
+                self._vectors[row] = vector
+            self._dirty = True
+            self._unsaved += len(keys)
+            if (
+                self._unsaved >= self.flush_rows
+                or time.monotonic() - self._last_save >= self.flush_interval
+            ):
+                self._save()
+
+    def flush(self):
+        """Persist the vectors and index to disk."""
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        if not self._dirty:
+            return
+        self._vectors.flush()
+        # the meta file first, the capacity only grows (covers the saved index rows)
+        tmp_path = self._meta_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as fp:
+            json.dump({"dim": self.dim, "capacity": self._capacity}, fp)
+        os.replace(tmp_path, self._meta_path)
+        keys = list(self._rows.keys())
+        tmp_path = self.path / "index.tmp.npz"
+        np.savez(
+            tmp_path,
+            keys=np.frombuffer(b"".join(keys), dtype=np.uint8).reshape(-1, _key_size),
+            rows=np.array([self._rows[k] for k in keys], dtype=np.int64),
+            ticks=np.array([self._last_used[k] for k in keys], dtype=np.int64),
+        )
+        os.replace(tmp_path, self._index_path)
+        self._dirty = False
+        self._unsaved = 0
+        self._last_save = time.monotonic()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "rows": len(self._rows),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def __len__(self):
+        return len(self._rows)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper which caches document embeddings on disk.
+
+    Example:
+        embeddings = CachedEmbeddings(HuggingFaceEmbeddings(), "./data/cache", "all-MiniLM-L6-v2")
+
+    Args:
+        embeddings: The underlying embeddings object.
+        cache_path: The root directory of the cache.
+        model_name: The embedding model name (part of the cache key).
+        max_rows: Max number of cached vectors.
+    """
+
+    def __init__(
+        self, embeddings, cache_path: str, model_name: str, max_rows: int = 500_000
+    ):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        model_dir = hashlib.sha1(model_name.encode()).hexdigest()[:16]
+        self.store = EmbeddingsStore(os.path.join(cache_path, model_dir), max_rows)
+        atexit.register(self.flush)
+
+    @staticmethod
+    def _text_key(text: str) -> bytes:
+        return hashlib.sha1(text.encode("utf-8")).digest()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._text_key(text) for text in texts]
+        vectors = self.store.get_many(keys)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            new_vectors = self.embeddings.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+            self.store.put_many([keys[i] for i in missing], new_vectors)
+        logger.debug(
+            f"Embeddings cache: {len(texts) - len(missing)} hits, {len(missing)} misses"
+        )
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    def flush(self):
+        """Save the new vectors (called at the end of an ingestion)."""
+        self.store.flush()
+
+    def stats(self) -> dict:
+        return self.store.stats()
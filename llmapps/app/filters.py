@@ -0,0 +1,278 @@
+"""Backend agnostic metadata filter expressions.
+
+A filter is given as a dict (Chroma/Mongo style operators) or as a list of
+(key, value) pairs (the API QueryItem.filter and the CLI --filter option), e.g.:
+
+    {"service": "billing"}
+    {"$and": [{"topic": {"$in": ["auth", "sso"]}}, {"version": {"$gte": 2}}]}
+    [("service", "billing"), ("topic", "auth"), ("topic", "sso")]
+
+In the pairs form the conditions are and-ed, and repeated keys match any of their
+values. The parsed expression is translated to a Chroma where clause, a Milvus
+boolean expression, or a rows mask over a MetadataIndex (the local vector store
+and the BM25 index).
+"""
+
+import json
+from functools import reduce
+from typing import Any, List, Optional, Union
+
+import numpy as np
+
+_comparisons = {
+    "$eq": "==",
+    "$ne": "!=",
+    "$gt": ">",
+    "$gte": ">=",
+    "$lt": "<",
+    "$lte": "<=",
+    "$in": "in",
+    "$nin": "not in",
+}
+
+
+class FilterExpr:
+    """A parsed filter expression."""
+
+    def to_chroma(self) -> dict:
+        raise NotImplementedError()
+
+    def to_milvus(self) -> str:
+        raise NotImplementedError()
+
+    def mask(self, index: "MetadataIndex", num_rows: int) -> np.ndarray:
+        """The rows (of the index) which match the expression."""
+        raise NotImplementedError()
+
+    def __eq__(self, other):
+        return isinstance(other, FilterExpr) and self.to_chroma() == other.to_chroma()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_chroma()})"
+
+
+class Condition(FilterExpr):
+    """A metadata key comparison, e.g. Condition("version", "$gte", 2)."""
+
+    def __init__(self, key: str, op: str, value: Any):
+        if op not in _comparisons:
+            raise ValueError(f"Unsupported filter operator {op}")
+        if op in ("$in", "$nin") and not isinstance(value, (list, tuple)):
+            raise ValueError(f"Filter operator {op} expects a list of values")
+        self.key = key
+        self.op = op
+        self.value = list(value) if op in ("$in", "$nin") else value
+
+    def to_chroma(self) -> dict:
+        return {self.key: {self.op: self.value}}
+
+    def to_milvus(self) -> str:
+        return f"{self.key} {_comparisons[self.op]} {_milvus_literal(self.value)}"
+
+    def matches(self, value) -> bool:
+        try:
+            if self.op == "$eq":
+                return value == self.value
+            if self.op == "$ne":
+                return value != self.value
+            if self.op == "$in":
+                return value in self.value
+            if self.op == "$nin":
+                return value not in self.value
+            if self.op == "$gt":
+                return value > self.value
+            if self.op == "$gte":
+                return value >= self.value
+            if self.op == "$lt":
+                return value < self.value
+            return value <= self.value
+        except TypeError:  # e.g. a str value compared with a number
+            return False
+
+    def mask(self, index: "MetadataIndex", num_rows: int) -> np.ndarray:
+        mask = np.zeros(num_rows, dtype=bool)
+        column = index.columns.get(self.key)
+        if column is None:
+            return mask  # rows without the key never match
+        if self.op in ("$eq", "$in"):
+            # inverted lists, only the matching rows are touched
+            values = [self.value] if self.op == "$eq" else self.value
+            for value in values:
+                rows = column.rows(value)
+                mask[rows[rows < num_rows]] = True
+            return mask
+        codes = [code for code, v in enumerate(column.values) if self.matches(v)]
+        column_codes = column.codes[:num_rows]
+        mask[: len(column_codes)] = np.isin(column_codes, codes)
+        return mask
+
+
+class BoolExpr(FilterExpr):
+    """And/or of expressions."""
+
+    def __init__(self, op: str, items: List[FilterExpr]):
+        if op not in ("$and", "$or"):
+            raise ValueError(f"Unsupported filter operator {op}")
+        if not items:
+            raise ValueError(f"Filter operator {op} expects a non empty list")
+        self.op = op
+        self.items = items
+
+    def to_chroma(self) -> dict:
+        if len(self.items) == 1:
+            return self.items[0].to_chroma()
+        return {self.op: [item.to_chroma() for item in self.items]}
+
+    def to_milvus(self) -> str:
+        if len(self.items) == 1:
+            return self.items[0].to_milvus()
+        separator = " and " if self.op == "$and" else " or "
+        return "(" + separator.join(item.to_milvus() for item in self.items) + ")"
+
+    def mask(self, index: "MetadataIndex", num_rows: int) -> np.ndarray:
+        masks = [item.mask(index, num_rows) for item in self.items]
+        return reduce(np.logical_and if self.op == "$and" else np.logical_or, masks)
+
+
+def parse_filter(filter: Union[dict, list, FilterExpr, None]) -> Optional[FilterExpr]:
+    """Parse a filter dict, (key, value) pairs list or expression (None if empty)."""
+    if not filter:
+        return None
+    if isinstance(filter, FilterExpr):
+        return filter
+    if isinstance(filter, dict):
+        return _parse_dict(filter)
+    if isinstance(filter, (list, tuple)):
+        values = {}
+        for pair in filter:
+            if len(pair) != 2:
+                raise ValueError(f"Filter items must be (key, value) pairs, got {pair}")
+            values.setdefault(pair[0], []).append(pair[1])
+        items = [
+            (
+                Condition(key, "$eq", value[0])
+                if len(value) == 1
+                else Condition(key, "$in", value)
+            )
+            for key, value in values.items()
+        ]
+        return items[0] if len(items) == 1 else BoolExpr("$and", items)
+    raise ValueError(
+        f"Unsupported filter {filter!r}, expected a dict or a list of (key, value)"
+    )
+
+
+def parse_literal(value: str):
+    """Convert a number or boolean string (e.g. a CLI filter value) to its type, so
+    it matches the typed metadata values, other strings are returned as is."""
+    try:
+        parsed = json.loads(value)
+    except ValueError:
+        return value
+    return parsed if isinstance(parsed, (bool, int, float)) else value
+
+
+def _parse_dict(filter: dict) -> FilterExpr:
+    items = []
+    for key, value in filter.items():
+        if key in ("$and", "$or"):
+            items.append(BoolExpr(key, [_parse_dict(item) for item in value]))
+        elif key.startswith("$"):
+            raise ValueError(f"Unsupported filter operator {key}")
+        elif isinstance(value, dict):
+            items.extend(Condition(key, op, v) for op, v in value.items())
+        else:
+            items.append(Condition(key, "$eq", value))
+    if not items:
+        raise ValueError("Empty filter expression")
+    return items[0] if len(items) == 1 else BoolExpr("$and", items)
+
+
+def vector_search_kwargs(vector_store, filter) -> dict:
+    """The vector store similarity search kwargs for a filter."""
+    expr = parse_filter(filter)
+    if expr is None:
+        return {}
+    from langchain_community.vectorstores import Milvus
+
+    if isinstance(vector_store, Milvus):
+        return {"expr": expr.to_milvus()}
+    # Chroma and the local vector store accept the Chroma (Mongo like) form
+    return {"filter": expr.to_chroma()}
+
+
+def _milvus_literal(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join(_milvus_literal(v) for v in value) + "]"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return json.dumps(str(value))
+
+
+class MetadataColumn:
+    """A dictionary encoded metadata column with inverted (value -> rows) lists."""
+
+    def __init__(self):
+        self.values = []
+        self.value_codes = {}
+        self.codes = np.full(1024, -1, dtype=np.int32)  # value code per row, -1 = none
+        self._rows = []  # rows list per value code
+        self._arrays = {}  # value code -> (number of rows, rows array) cache
+
+    @staticmethod
+    def key(value):
+        # unhashable values (lists, dicts) are encoded by their json
+        return json.dumps(value) if isinstance(value, (list, dict)) else value
+
+    def add(self, row: int, value):
+        if row >= len(self.codes):
+            codes = np.full(max(len(self.codes) * 2, row + 1), -1, dtype=np.int32)
+            codes[: len(self.codes)] = self.codes
+            self.codes = codes
+        key = self.key(value)
+        code = self.value_codes.get(key)
+        if code is None:
+            code = self.value_codes[key] = len(self.values)
+            self.values.append(value)
+            self._rows.append([])
+        self.codes[row] = code
+        self._rows[code].append(row)
+
+    def rows(self, value) -> np.ndarray:
+        """The rows with the value."""
+        code = self.value_codes.get(self.key(value))
+        if code is None:
+            return np.zeros(0, dtype=np.int64)
+        rows = self._rows[code]
+        cached = self._arrays.get(code)
+        if cached is None or cached[0] != len(rows):
+            cached = self._arrays[code] = len(rows), np.array(rows, dtype=np.int64)
+        return cached[1]
+
+
+class MetadataIndex:
+    """Metadata index of a collection rows, used to pre-filter the searches.
+
+    Example:
+        index = MetadataIndex()
+        index.add(0, {"service": "billing", "version": 2})
+        mask = index.mask({"version": {"$gte": 2}}, num_rows=1)
+    """
+
+    def __init__(self):
+        self.columns = {}
+
+    def add(self, row: int, metadata: dict):
+        for key, value in (metadata or {}).items():
+            if key not in self.columns:
+                self.columns[key] = MetadataColumn()
+            self.columns[key].add(row, value)
+
+    def mask(self, filter, num_rows: int) -> Optional[np.ndarray]:
+        """The matching rows mask (None if there is no filter)."""
+        expr = parse_filter(filter)
+        if expr is None:
+            return None
+        return expr.mask(self, num_rows)
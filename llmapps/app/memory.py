@@ -0,0 +1,90 @@
+from langchain.chains import LLMChain
+from langchain.prompts import PromptTemplate
+
+from .config import logger
+from .schema import Conversation
+
+_summary_prompt_template = """
+Progressively summarize the lines of conversation provided, adding onto the previous summary and returning a new summary.
+Keep the facts, names and user requests which may be needed to answer follow up questions, use at most {max_words} words.
+
+Current summary:
+{summary}
+
+New lines of conversation:
+{new_lines}
+
+New summary:
+"""
+
+
+class ConversationSummarizer:
+    """Incrementally summarize the conversation messages which left the window.
+
+    The last window messages are kept verbatim, older messages are folded into the
+    conversation rolling summary in batches (at least batch messages per LLM call),
+    so the history prompt size stays bounded regardless of the session length.
+
+    Args:
+        llm: The LLM used for summarization.
+        window: Number of recent messages kept verbatim (not summarized).
+        batch: Min number of messages to summarize per LLM call.
+        max_words: The target max length of the summary.
+        prompt_template: The summarization prompt template.
+    """
+
+    def __init__(
+        self,
+        llm,
+        window: int = 8,
+        batch: int = 4,
+        max_words: int = 200,
+        prompt_template: str = None,
+        verbose: bool = False,
+    ):
+        self.window = window
+        self.batch = batch
+        self.max_words = max_words
+        prompt = PromptTemplate.from_template(
+            prompt_template or _summary_prompt_template
+        )
+        self._chain = LLMChain(llm=llm, prompt=prompt, verbose=verbose)
+
+    def _pending(self, conversation: Conversation) -> list:
+        start = max(conversation.summarized - conversation.offset, 0)
+        end = len(conversation.messages) - self.window
+        if end - start < self.batch:
+            return []
+        return conversation.messages[start:end]
+
+    def _inputs(self, conversation: Conversation, messages: list) -> dict:
+        return {
+            "summary": conversation.summary,
+            "new_lines": "\n".join(f"{m.role}: {m.content}" for m in messages),
+            "max_words": self.max_words,
+        }
+
+    def _apply(self, conversation: Conversation, messages: list, summary: str):
+        conversation.summary = summary.strip()
+        conversation.summarized += len(messages)
+        logger.debug(
+            f"Summarized {conversation.summarized} conversation messages: "
+            f"{conversation.summary}"
+        )
+
+    def update(self, conversation: Conversation) -> bool:
+        """Fold the messages which left the window into the summary (if enough)."""
+        messages = self._pending(conversation)
+        if not messages:
+            return False
+        summary = self._chain.run(self._inputs(conversation, messages))
+        self._apply(conversation, messages, summary)
+        return True
+
+    async def aupdate(self, conversation: Conversation) -> bool:
+        messages = self._pending(conversation)
+        if not messages:
+            return False
+        summary = await self._chain.arun(self._inputs(conversation, messages))
+        self._apply(conversation, messages, summary)
+        return True
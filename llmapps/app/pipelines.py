@@ -1,10 +1,18 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
 import mlrun
 from mlrun import serving
 from mlrun.utils import get_caller_globals
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from .answer_cache import clear_answer_cache
+from .chains.base import update_event
+from .config import clear_object_cache
 from .config import config as default_config
-from .schema import ApiDictResponse
+from .schema import ApiDictResponse, PipelineEvent
 from .sessions import get_session_store
+from .streaming import TokenStreamHandler
 
 
 class AppServer:
@@ -14,12 +22,19 @@ class AppServer:
         self._session_store = get_session_store(self._config)
         self._pipelines = {}
         self.verbose = verbose
+        # bounded executor for blocking pipeline steps (LLM, vector and SQL calls)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._config.pipeline_workers, thread_name_prefix="pipeline"
+        )
 
     def set_config(self, config):
         self._config = config
+        clear_object_cache(config)
+        clear_answer_cache()
+        self._session_store.close()
         self._session_store = get_session_store(self._config)
         for pipeline in self._pipelines.values():
-            pipeline._server = None
+            pipeline.reset()
 
     def add_pipeline(self, name, graph):
         pipeline = AppPipeline(self, name, graph)
@@ -39,9 +54,46 @@ class AppServer:
             raise ValueError(f"pipeline {name} not found")
         return pipeline.run(event)
 
+    async def arun_pipeline(self, name, event):
+        """Run the pipeline without blocking the event loop."""
+        pipeline = self.get_pipeline(name)
+        if not pipeline:
+            raise ValueError(f"pipeline {name} not found")
+        return await pipeline.arun(event)
+
+    async def astream_pipeline(self, name, event: dict):
+        """Run the pipeline and stream the answer.
+
+        Yields dict frames: {"type": "token", "token": ..} for every answer token and
+        a final {"type": "final", "answer": .., "sources": .., "returned_state": ..}.
+        """
+        pipeline = self.get_pipeline(name)
+        if not pipeline:
+            raise ValueError(f"pipeline {name} not found")
+        handler = TokenStreamHandler()
+        if pipeline.supports_streaming:
+            event = {**event, "stream_handler": handler}
+        task = asyncio.create_task(pipeline.arun(event))
+        task.add_done_callback(lambda _: handler.close())
+        async for token in handler.atokens():
+            yield {"type": "token", "token": token}
+        resp = await task
+        if handler.time_to_first_token is None and resp.data.get("answer"):
+            # the steps did not stream the answer (e.g. graph server pipeline)
+            yield {"type": "token", "token": resp.data["answer"]}
+        yield {
+            "type": "final",
+            **resp.data,
+            "time_to_first_token": handler.time_to_first_token,
+        }
+
     def api_startup(self):
         print("\nstartup event\n")
 
+    def api_shutdown(self):
+        # flush the queued session writes
+        self._session_store.close()
+
     def to_fastapi(self, router=None, with_controller=False):
         from fastapi import FastAPI
         from fastapi.middleware.cors import CORSMiddleware
@@ -72,6 +124,7 @@ class AppServer:
         extra["app_server"] = self
         app.extra = extra
         router.add_event_handler("startup", self.api_startup)
+        router.add_event_handler("shutdown", self.api_shutdown)
 
         app.include_router(router)
         return app
@@ -83,16 +136,38 @@ app_server = AppServer()
 pipelines = {}
 
 
+class StepsContext:
+    """A minimal graph context, used when running the steps natively (async)."""
+
+    def __init__(self, config, session_store, executor, verbose=False):
+        self._config = config
+        self.session_store = session_store
+        self.executor = executor
+        self.verbose = verbose
+        self.prompts = {}
+
+
 class AppPipeline:
     def __init__(self, parent, name=None, graph=None):
         self.name = name or ""
         self._parent = parent
         self._graph = None
         self._server = None
+        self._steps = None  # list of step objects (for the native async path)
+        self._steps_ready = False
 
         if graph:
             self.graph = graph
 
+    @property
+    def supports_streaming(self):
+        # per request callbacks can only be passed to natively executed steps
+        return bool(self._steps)
+
+    def reset(self):
+        self._server = None
+        self._steps_ready = False
+
     @property
     def graph(self) -> serving.states.RootFlowStep:
         return self._graph
@@ -111,6 +186,8 @@ class AppPipeline:
                     step = step.to(item)
             step.respond()
             self._graph = graph_obj
+            if all(hasattr(item, "arun") for item in graph):
+                self._steps = graph
             return
 
         if isinstance(graph, dict):
@@ -146,9 +223,28 @@ class AppPipeline:
             context._config = self._parent._config
         if getattr(context, "session_store", None) is None:
             context.session_store = self._parent._session_store
+        if getattr(context, "executor", None) is None:
+            context.executor = self._parent._executor
+
+    def _init_steps(self):
+        if self._steps_ready:
+            return
+        context = StepsContext(
+            self._parent._config,
+            self._parent._session_store,
+            self._parent._executor,
+            verbose=self._parent.verbose,
+        )
+        for step in self._steps:
+            step.context = context
+            step.verbose = step.verbose or context.verbose
+            if hasattr(step, "post_init"):
+                step.post_init("async")
+        self._steps_ready = True
 
     def run(self, event, db_session=None):
-        # todo: pass sql db_session to steps via context or event
+        if db_session is not None:
+            event = {**event, "db_session": db_session}
         server = self.get_server()
         try:
             resp = server.test("", body=event)
@@ -157,11 +253,40 @@ class AppPipeline:
             raise e
 
         print("resp: ", resp)
-        return ApiDictResponse(
-            success=True,
-            data={
-                "answer": resp.results["answer"],
-                "sources": resp.results["sources"],
-                "returned_state": {},
-            },
-        )
+        return self._to_response(resp)
+
+    async def arun(self, event):
+        """Run the pipeline asynchronously.
+
+        When the graph is a list of steps, the steps run natively on the event loop
+        (async LLM calls, blocking steps in the bounded executor), so many events can
+        be processed concurrently. Otherwise the graph server runs in the executor.
+        """
+        loop = asyncio.get_running_loop()
+        if not self._steps:
+            if isinstance(event.get("db_session"), AsyncSession):
+                # the async db session is bound to this loop, the graph runs in a thread
+                event = {**event, "db_session": None}
+            return await loop.run_in_executor(self._parent._executor, self.run, event)
+
+        if not self._steps_ready:
+            # initializing the steps may load models, don't block the event loop
+            await loop.run_in_executor(self._parent._executor, self._init_steps)
+        if isinstance(event, dict):
+            event = PipelineEvent(**event)
+        for step in self._steps:
+            resp = await step.arun(event)
+            update_event(event, resp)
+        return self._to_response(event)
+
+    @staticmethod
+    def _to_response(event: PipelineEvent):
+        data = {
+            "answer": event.results["answer"],
+            "sources": event.results["sources"],
+            "returned_state": {},
+        }
+        if "rerank" in event.results:
+            # the retrieval rerank stats (token savings) of the query
+            data["rerank"] = event.results["rerank"]
+        return ApiDictResponse(success=True, data=data)
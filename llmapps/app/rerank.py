@@ -0,0 +1,251 @@
+import asyncio
+import hashlib
+import math
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, List, Optional, Tuple
+
+from langchain.schema import BaseRetriever, Document
+from langchain.schema.callbacks.base import BaseCallbackHandler
+
+from .config import logger
+from .sparse import tokenize
+from .utils import count_tokens
+
+# common words, ignored by the lexical reranker
+_stop_words = set(
+    "a an and are as at be by can do does for from has have how i in is it its me my "
+    "of on or that the this to was what when where which who why will with you your".split()
+)
+
+
+class Reranker:
+    """Scores (query, chunk) pairs, the scores of the pairs are cached (LRU).
+
+    Args:
+        cache_size: Max number of cached (query, chunk) scores, 0 to disable.
+    """
+
+    def __init__(self, cache_size: int = 10_000):
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _score_pairs(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        raise NotImplementedError()
+
+    @staticmethod
+    def _key(query: str, text: str) -> bytes:
+        return hashlib.sha1(f"{query}\0{text}".encode("utf-8")).digest()
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        """The relevance score of each text to the query (higher is better)."""
+        keys = [self._key(query, text) for text in texts]
+        scores = [None] * len(texts)
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[i] = self._cache[key]
+            missing = [i for i, score in enumerate(scores) if score is None]
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        if missing:
+            new_scores = self._score_pairs([(query, texts[i]) for i in missing])
+            with self._lock:
+                for i, score in zip(missing, new_scores):
+                    scores[i] = float(score)
+                    if self.cache_size:
+                        self._cache[keys[i]] = scores[i]
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return scores
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "cached": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class CrossEncoderReranker(Reranker):
+    """Scores the pairs with a (small, CPU friendly) sentence-transformers
+    cross-encoder model, in batches.
+
+    Args:
+        model_name: The cross-encoder model.
+        batch_size: Number of pairs per model batch.
+        device: The model device.
+        cache_size: Max number of cached (query, chunk) scores.
+    """
+
+    def __init__(
+        self,
+        model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+        batch_size: int = 16,
+        device: str = "cpu",
+        cache_size: int = 10_000,
+    ):
+        from sentence_transformers import CrossEncoder
+
+        super().__init__(cache_size)
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.model = CrossEncoder(model_name, device=device)
+
+    def _score_pairs(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        scores = self.model.predict(
+            pairs, batch_size=self.batch_size, show_progress_bar=False
+        )
+        return scores.tolist()
+
+
+class LexicalReranker(Reranker):
+    """A lightweight (no model) reranker, scores the query terms found in the chunk
+    with the BM25 term frequency saturation and length normalization.
+
+    Args:
+        k1: Term frequency saturation.
+        b: Length normalization.
+        avg_length: The typical chunk length (in terms).
+        cache_size: Max number of cached (query, chunk) scores.
+    """
+
+    def __init__(
+        self,
+        k1: float = 1.5,
+        b: float = 0.75,
+        avg_length: int = 200,
+        cache_size: int = 10_000,
+    ):
+        super().__init__(cache_size)
+        self.k1 = k1
+        self.b = b
+        self.avg_length = avg_length
+
+    def _score_pairs(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        scores = []
+        for query, text in pairs:
+            terms = set(tokenize(query)) - _stop_words
+            counts = Counter(tokenize(text))
+            length = sum(counts.values())
+            norm = self.k1 * (1 - self.b + self.b * length / self.avg_length)
+            score = 0.0
+            for term in terms:
+                tf = counts.get(term, 0)
+                if tf:
+                    # longer (more specific) terms, e.g. codes, weigh more
+                    weight = math.log(1 + len(term))
+                    score += weight * tf * (self.k1 + 1) / (tf + norm)
+            scores.append(score)
+        return scores
+
+
+def _shingles(text: str) -> set:
+    words = tokenize(text)
+    return {tuple(words[i : i + 3]) for i in range(max(1, len(words) - 2))}
+
+
+def _is_duplicate(shingles: set, kept: List[set], threshold: float) -> bool:
+    for other in kept:
+        union = len(shingles | other)
+        if union and len(shingles & other) / union >= threshold:
+            return True
+    return False
+
+
+class RerankStatsHandler(BaseCallbackHandler):
+    """Collects the rerank stats of a query (reported by the RerankRetriever)."""
+
+    def __init__(self):
+        self.stats = None
+
+    def on_text(self, text: str, **kwargs: Any) -> Any:
+        if "rerank_stats" in kwargs:
+            self.stats = kwargs["rerank_stats"]
+
+
+class RerankRetriever(BaseRetriever):
+    """Over-fetch candidates with the base retriever and rerank them.
+
+    Near duplicate chunks are dropped, the rest are scored by the reranker and the
+    best (up to k) chunks which fit in the token budget are returned. The stats of
+    each query (candidates, duplicates, tokens and the tokens saved vs. the base
+    retriever top k) are logged and reported to the callbacks (RerankStatsHandler).
+
+    Args:
+        base_retriever: The candidates retriever (returns fetch_k documents).
+        reranker: The (query, chunk) scorer.
+        k: Max number of returned documents.
+        max_tokens: The returned documents token budget (None for no limit).
+        dedupe_threshold: Min word shingles similarity (jaccard) of duplicates.
+    """
+
+    base_retriever: BaseRetriever
+    reranker: Any
+    k: int = 4
+    max_tokens: Optional[int] = None
+    dedupe_threshold: float = 0.9
+
+    def _rerank(self, query: str, candidates: List[Document]):
+        documents, kept_shingles = [], []
+        for doc in candidates:
+            shingles = _shingles(doc.page_content)
+            if not _is_duplicate(shingles, kept_shingles, self.dedupe_threshold):
+                documents.append(doc)
+                kept_shingles.append(shingles)
+
+        scores = self.reranker.score(query, [doc.page_content for doc in documents])
+        ranked = sorted(zip(scores, documents), key=lambda x: -x[0])
+        results, tokens = [], 0
+        for _, doc in ranked:
+            if len(results) >= self.k:
+                break
+            doc_tokens = count_tokens(doc.page_content)
+            if self.max_tokens and results and tokens + doc_tokens > self.max_tokens:
+                continue  # a smaller chunk may still fit
+            results.append(doc)
+            tokens += doc_tokens
+
+        baseline = sum(count_tokens(doc.page_content) for doc in candidates[: self.k])
+        stats = {
+            "candidates": len(candidates),
+            "duplicates": len(candidates) - len(documents),
+            "documents": len(results),
+            "tokens": tokens,
+            "baseline_tokens": baseline,
+            "saved_tokens": baseline - tokens,
+        }
+        text = (
+            f"Reranked {stats['candidates']} candidates ({stats['duplicates']} "
+            f"duplicates) to {stats['documents']} documents, {tokens} tokens "
+            f"({stats['saved_tokens']} saved vs. the top {self.k})"
+        )
+        logger.info(text)
+        return results, stats, text
+
+    def _get_relevant_documents(self, query: str, *, run_manager) -> List[Document]:
+        candidates = self.base_retriever.get_relevant_documents(
+            query, callbacks=run_manager.get_child()
+        )
+        results, stats, text = self._rerank(query, candidates)
+        run_manager.on_text(text, rerank_stats=stats)
+        return results
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager
+    ) -> List[Document]:
+        candidates = await self.base_retriever.aget_relevant_documents(
+            query, callbacks=run_manager.get_child()
+        )
+        # model inference, don't block the event loop
+        results, stats, text = await asyncio.get_running_loop().run_in_executor(
+            None, self._rerank, query, candidates
+        )
+        await run_manager.on_text(text, rerank_stats=stats)
+        return results
@@ -1,9 +1,11 @@
 from enum import Enum
 from http.client import HTTPException
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from pydantic import BaseModel
 
+from .utils import count_tokens, truncate_tokens
+
 
 class ChatRole(str, Enum):
     Human = "Human"
@@ -20,17 +22,74 @@ class Message(BaseModel):
     sources: Optional[List[dict]] = None
     rating: Optional[int] = None
     suggestion: Optional[str] = None
+    tokens: Optional[int] = None
 
 
 class Conversation(BaseModel):
     messages: list[Message] = []
+    # conversation index of the first loaded message (older messages are not loaded)
+    offset: int = 0
+    # number of messages already saved (conversation index of the next message)
     saved_index: int = 0
+    # rolling summary of the first `summarized` messages (see ConversationSummarizer)
+    summary: str = ""
+    summarized: int = 0
+    # total number of tokens in the conversation messages
+    tokens: int = 0
 
     def __str__(self):
         return "\n".join([f"{m.role}: {m.content}" for m in self.messages])
 
     def add_message(self, role, content, sources=None):
-        self.messages.append(Message(role=role, content=content, sources=sources))
+        tokens = count_tokens(content)
+        self.messages.append(
+            Message(role=role, content=content, sources=sources, tokens=tokens)
+        )
+        self.tokens += tokens
+
+    def to_prompt(self, max_messages: int = None, max_tokens: int = None) -> str:
+        """Return the conversation history text for a prompt, bounded in size.
+
+        The history is the rolling summary followed by the last max_messages
+        messages which were not summarized, the oldest messages are dropped to keep
+        the text within max_tokens (the newest message is truncated if it alone
+        exceeds the budget).
+        """
+        start = max(self.summarized - self.offset, 0)
+        if max_messages is not None:
+            start = max(start, len(self.messages) - max_messages)
+        summary = f"Summary: {self.summary}" if self.summary else ""
+        if max_tokens:
+            summary = truncate_tokens(summary, max_tokens)
+        budget = (max_tokens or 0) - count_tokens(summary)
+        lines = []
+        for message in reversed(self.messages[start:]):
+            line = f"{message.role}: {message.content}"
+            if max_tokens:
+                tokens = message.tokens or count_tokens(line)
+                budget -= tokens
+                if budget < 0:
+                    if lines:
+                        break
+                    line = truncate_tokens(line, budget + tokens)
+                    if not line:
+                        break
+            lines.append(line)
+        if summary:
+            lines.append(summary)
+        return "\n".join(reversed(lines))
+
+    def new_messages(self) -> list:
+        """The messages which were added since the conversation was loaded/saved."""
+        return self.messages[max(self.saved_index - self.offset, 0) :]
+
+    def memory_state(self) -> dict:
+        """The conversation memory fields (saved with the session)."""
+        return {
+            "summary": self.summary,
+            "summarized": self.summarized,
+            "tokens": self.tokens,
+        }
 
     def to_list(self):
         return self.dict()["messages"]
@@ -41,8 +100,14 @@ class Conversation(BaseModel):
         # return self.model_dump(mode="json")["messages"]
 
     @classmethod
-    def from_list(cls, data: list):
-        return cls.parse_obj({"messages": data or []})
+    def from_list(cls, data: list, memory: dict = None):
+        conversation = cls.parse_obj({"messages": data or [], **(memory or {})})
+        if memory is None:
+            # sessions saved without the memory state
+            for message in conversation.messages:
+                message.tokens = message.tokens or count_tokens(message.content)
+                conversation.tokens += message.tokens
+        return conversation
         # return cls.model_validate({"messages": data or []})
 
 
@@ -96,7 +161,8 @@ class TerminateResponse(BaseModel):
 class QueryItem(BaseModel):
     question: str
     session_id: Optional[str] = None
-    filter: Optional[List[Tuple[str, str]]] = None
+    # metadata filter, (key, value) pairs or a filter dict (see app.filters)
+    filter: Optional[Union[List[Tuple[str, Any]], Dict[str, Any]]] = None
     collection: Optional[str] = None
 
 
@@ -104,6 +170,7 @@ class ApiResponse(BaseModel):
     success: bool
     data: Optional[Union[list, BaseModel, dict]] = None
     error: Optional[str] = None
+    next_cursor: Optional[str] = None  # cursor of the next page (list responses)
 
     def with_raise(self, format=None) -> "ApiResponse":
         if not self.success:
@@ -1,65 +1,702 @@
+import asyncio
+import atexit
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
 from llmapps.controller.model import ChatSession
 
-from .schema import PipelineEvent
+from .config import get_object_from_dict, logger, session_store_shortcuts
+from .schema import Conversation, Message, PipelineEvent
+
+
+class SessionWriteConflict(ValueError):
+    """A session write was rejected by the database (e.g. the messages exist)."""
+
+
+class BaseSessionStore:
+    """Base class for session stores, read and save the chat session state and
+    conversation of pipeline events.
+
+    Only the conversation messages which were not summarized yet (or the last
+    history_window messages when summarization is disabled) are loaded.
+    """
+
+    def __init__(self, config=None):
+        self.summarize = config.history_summarize if config else False
+        self.history_window = config.history_window if config else None
+
+    def read_state(self, event: PipelineEvent, db_session=None):
+        raise NotImplementedError()
+
+    def save(self, event: PipelineEvent, db_session=None):
+        raise NotImplementedError()
+
+    async def aread_state(self, event: PipelineEvent, executor=None):
+        """Async read_state, by default runs read_state in the executor."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(executor, self.read_state, event)
 
+    async def asave(self, event: PipelineEvent, executor=None):
+        """Async save, by default runs save in the executor."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(executor, self.save, event)
 
-class SessionStore:
-    def __init__(self, client):
-        self.db_session = None
+    def close(self):
+        pass
+
+    def _load_start(self, conversation: Conversation, total: int) -> int:
+        # index of the first message needed by the prompts (see Conversation.to_prompt)
+        if self.summarize:
+            return conversation.summarized
+        if self.history_window:
+            return max(total - self.history_window, 0)
+        return 0
+
+    @staticmethod
+    def _make_write(event: PipelineEvent) -> dict:
+        """Take the new messages and state of the session as a (json) write record."""
+        conversation = event.conversation
+        new_messages = conversation.new_messages()
+        write = {
+            "session_id": event.session_id,
+            "start_index": conversation.saved_index,
+            "messages": [message.dict(exclude_none=True) for message in new_messages],
+            "state": event.state,
+            "memory": conversation.memory_state(),
+        }
+        conversation.saved_index += len(new_messages)
+        return write
+
+
+class SessionStore(BaseSessionStore):
+    """Read and save the chat session state and conversation in the SQL database.
+
+    The conversation messages are saved in an append only table. The db session is
+    taken from the event (request scoped) when set, with an async db session the
+    async methods (aread_state, asave) run on the async engine.
+    """
+
+    def __init__(self, client=None, config=None):
+        super().__init__(config)
+        if client is None:
+            from llmapps.controller.sqlclient import client
         self.client = client
 
-    def get_db_session(self):
-        if self.db_session is None:
-            self.db_session = self.client.get_db_session()
-        return self.db_session
+    def _db_session(self, event: PipelineEvent, db_session=None):
+        """Return the request db session (from the event) or a new session, and
+        whether it should be closed by the caller."""
+        db_session = db_session or event.db_session
+        if db_session is not None:
+            return db_session, False
+        return self.client.get_db_session(), True
 
     def read_state(self, event: PipelineEvent, db_session=None):
-        close_session = True if db_session is None else False
-        db_session = db_session or self.get_db_session()
-        event.username = event.username or "guest"
-        event.user = self.client.get_user(event.username, session=db_session)
-        if event.session_id:
-            chat_session = self.client.get_session(
-                event.session_id, session=db_session
-            ).data
-            if chat_session:
-                event.session = chat_session
-                event.state = chat_session.state
-                event.conversation = chat_session.to_conversation()
-            else:
-                self.client.create_session(
-                    ChatSession(
-                        name=event.session_id, username=event.username or "guest"
-                    ),
+        db_session, close_session = self._db_session(event, db_session)
+        try:
+            event.username = event.username or "guest"
+            event.user = self._get_user(event.username, db_session)
+            if event.session_id:
+                loaded = self._get_session(event.session_id, event.username, db_session)
+                if loaded:
+                    event.session, event.conversation = loaded
+                    event.state = event.session.state
+        finally:
+            if close_session:
+                db_session.close()
+
+    async def aread_state(self, event: PipelineEvent, executor=None):
+        if isinstance(event.db_session, AsyncSession):
+            # run on the async engine (non blocking db calls)
+            await event.db_session.run_sync(
+                lambda db_session: self.read_state(event, db_session)
+            )
+        else:
+            await super().aread_state(event, executor)
+
+    async def asave(self, event: PipelineEvent, executor=None):
+        if isinstance(event.db_session, AsyncSession):
+            await event.db_session.run_sync(
+                lambda db_session: self.save(event, db_session)
+            )
+        else:
+            await super().asave(event, executor)
+
+    def _get_user(self, username: str, db_session):
+        return self.client.get_user(username, session=db_session)
+
+    def _get_session(self, session_id: str, username: str, db_session):
+        """Return the (chat session, conversation), or None for a new session."""
+        chat_session = self.client.get_session(
+            session_id, session=db_session, with_history=False
+        ).data
+        if not chat_session:
+            self.client.create_session(
+                ChatSession(name=session_id, username=username), session=db_session
+            )
+            return None
+        return chat_session, self._load_conversation(chat_session, db_session)
+
+    def _load_conversation(self, chat_session: ChatSession, db_session):
+        if chat_session.history:
+            # history saved in the session spec, moved to the messages table on save
+            conversation = chat_session.to_conversation()
+            conversation.saved_index = len(conversation.messages)
+            return conversation
+
+        total = self.client.count_messages(chat_session.name, session=db_session)
+        conversation = Conversation.from_list([], chat_session.memory)
+        start = self._load_start(conversation, total)
+        conversation.messages = self.client.get_messages(
+            chat_session.name, start=start, session=db_session
+        ).data
+        conversation.offset = start
+        conversation.saved_index = total
+        return conversation
+
+    def _write(self, write: dict, db_session, ignore_conflicts: bool = False):
+        """Append the write messages and update the session state.
+
+        With ignore_conflicts (journal replay), the messages which were already
+        written (before a crash) are skipped and only the rest are appended."""
+        session_id = write["session_id"]
+        messages = [Message.parse_obj(message) for message in write["messages"]]
+        resp = self.client.append_messages(
+            session_id, messages, start_index=write["start_index"], session=db_session
+        )
+        if not resp.success:
+            if not ignore_conflicts:
+                raise SessionWriteConflict(resp.error)
+            count = self.client.count_messages(session_id, session=db_session)
+            written = count - write["start_index"]
+            if 0 < written < len(messages):
+                logger.info(
+                    f"Skipped {written} written messages of session {session_id}"
+                )
+                resp = self.client.append_messages(
+                    session_id,
+                    messages[written:],
+                    start_index=count,
                     session=db_session,
                 )
-
-        if close_session:
-            db_session.close()
+                if not resp.success:
+                    raise SessionWriteConflict(resp.error)
+            elif written <= 0:
+                logger.warning(f"Skipped session messages write: {resp.error}")
+        self.client.update_session(
+            ChatSession(
+                name=write["session_id"],
+                state=write["state"],
+                history=None,
+                memory=write["memory"],
+            ),
+            session=db_session,
+        )
 
     def save(self, event: PipelineEvent, db_session=None):
         """Save the session and conversation to the database"""
         if event.session_id:
-            close_session = True if db_session is None else False
-            db_session = db_session or self.get_db_session()
-            self.client.update_session(
-                ChatSession(
-                    name=event.session_id,
-                    state=event.state,
-                    history=event.conversation.to_list(),
-                ),
-                session=db_session,
+            db_session, close_session = self._db_session(event, db_session)
+            try:
+                self._write(self._make_write(event), db_session)
+            finally:
+                if close_session:
+                    db_session.close()
+
+
+class CachedSessionStore(SessionStore):
+    """A session store with an in memory LRU cache and write-behind to the database.
+
+    Recently active sessions (state and conversation) and users are served from
+    memory. Saves update the cache and are queued, a background thread coalesces
+    the queued writes per session and flushes them to the database in batches.
+    Queued writes are first appended to a journal file which is replayed on
+    startup, so writes which were not flushed before a crash are not lost. The
+    queue is flushed on close() (called at exit).
+
+    Each session is flushed independently, a failed write (e.g. the database is
+    unavailable) is retried in the next flush and does not block the writes of
+    other sessions. Writes rejected by the database (conflicts) are dropped, and
+    appended to a dead letter file ({journal_path}.failed) with the journal.
+
+    The cache is per process, use a single API worker (or route each session to the
+    same worker) to avoid reading stale sessions.
+
+    Args:
+        client: The SQL client.
+        config: The app config (history settings).
+        cache_size: Max number of cached sessions (and users).
+        flush_interval: Max seconds between flushes of the queued writes.
+        max_pending: Max number of sessions with queued writes, when reached the
+            writes are flushed synchronously.
+        journal_path: Path of the write-behind journal file (None to disable).
+    """
+
+    def __init__(
+        self,
+        client=None,
+        config=None,
+        cache_size: int = 1000,
+        flush_interval: float = 1.0,
+        max_pending: int = 1000,
+        journal_path: str = None,
+    ):
+        super().__init__(client, config)
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.journal_path = journal_path
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.dropped = 0
+
+        self._sessions = OrderedDict()  # session_id -> (ChatSession, Conversation)
+        self._users = OrderedDict()
+        self._pending = {}  # session_id -> coalesced write
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._journal_lock = threading.Lock()  # taken before self._lock
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._journal = None
+        if journal_path:
+            Path(journal_path).parent.mkdir(parents=True, exist_ok=True)
+            self._load_journal()
+            self._journal = open(journal_path, "a")
+            if self._pending:
+                logger.info(f"Replaying {len(self._pending)} journaled session writes")
+                # messages which were written before the crash are skipped, the
+                # rest of the (coalesced) write is appended
+                self.flush(ignore_conflicts=True)
+        self._thread = threading.Thread(
+            target=self._flush_loop, daemon=True, name="session-writer"
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _cache_get(self, cache: OrderedDict, key):
+        with self._lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+            return value
+
+    def _cache_put(self, cache: OrderedDict, key, value):
+        with self._lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+
+    def _get_user(self, username: str, db_session):
+        user = self._cache_get(self._users, username)
+        if user is None:
+            user = super()._get_user(username, db_session)
+            if user.success:
+                self._cache_put(self._users, username, user)
+        return user
+
+    def _get_session(self, session_id: str, username: str, db_session):
+        cached = self._cache_get(self._sessions, session_id)
+        if cached is not None:
+            self.hits += 1
+            chat_session, conversation = cached
+            if chat_session is None:
+                return None  # new session (created in the database)
+            return chat_session.copy(deep=True), conversation.copy(deep=True)
+
+        self.misses += 1
+        loaded = super()._get_session(session_id, username, db_session)
+        if loaded is None:
+            self._cache_put(self._sessions, session_id, (None, None))
+        else:
+            chat_session, conversation = loaded
+            self._cache_put(
+                self._sessions,
+                session_id,
+                (chat_session.copy(deep=True), self._trim(conversation)),
             )
+        return loaded
 
-            if close_session:
+    def _trim(self, conversation: Conversation) -> Conversation:
+        # keep only the messages which are needed for the next turns
+        conversation = conversation.copy(deep=True)
+        start = self._load_start(conversation, conversation.saved_index)
+        if start > conversation.offset:
+            conversation.messages = conversation.messages[start - conversation.offset :]
+            conversation.offset = start
+        return conversation
+
+    def save(self, event: PipelineEvent, db_session=None):
+        """Update the cached session and queue the database write"""
+        if not event.session_id:
+            return
+        write = self._make_write(event)
+        chat_session = event.session or ChatSession(
+            name=event.session_id, username=event.username
+        )
+        chat_session = chat_session.copy(deep=True)
+        chat_session.state = event.state
+        chat_session.memory = write["memory"]
+        self._cache_put(
+            self._sessions,
+            event.session_id,
+            (chat_session, self._trim(event.conversation)),
+        )
+        if self._enqueue(write):
+            self.flush()
+
+    def _run_sync(self, method, event: PipelineEvent):
+        # the async (request) db session can't be used from the executor thread
+        db_session = None
+        if isinstance(event.db_session, AsyncSession):
+            db_session = self.client.get_db_session()
+        try:
+            method(event, db_session)
+        finally:
+            if db_session is not None:
                 db_session.close()
 
+    async def aread_state(self, event: PipelineEvent, executor=None):
+        """Async read_state, runs in the executor (cache misses read the database)."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(executor, self._run_sync, self.read_state, event)
 
-def get_session_store(config):
-    # todo: support different session stores
-    if config.use_local_db:
-        from llmapps.controller.sqlclient import client
+    async def asave(self, event: PipelineEvent, executor=None):
+        """Async save, runs in the executor (the journal write and a full queue
+        flush are blocking)."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(executor, self._run_sync, self.save, event)
+
+    def _enqueue(self, write: dict) -> bool:
+        """Queue the write, returns True if the queue is full."""
+        # the cache (self._lock) is not blocked by the journal fsync
+        with self._journal_lock:
+            if self._journal:
+                self._journal.write(json.dumps(write) + "\n")
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+            with self._lock:
+                _coalesce(self._pending, write)
+                return len(self._pending) >= self.max_pending
+
+    def _rewrite_journal(self):
+        # the journal holds the (coalesced) writes which were not flushed yet
+        with self._journal_lock:
+            if not self._journal:
+                return
+            with self._lock:
+                lines = [json.dumps(write) + "\n" for write in self._pending.values()]
+            self._journal.seek(0)
+            self._journal.truncate()
+            self._journal.writelines(lines)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+
+    def _drop(self, write: dict, error: Exception):
+        logger.error(
+            f"Dropped the session {write['session_id']} write "
+            f"({len(write['messages'])} messages): {error}"
+        )
+        self.dropped += 1
+        if self.journal_path:
+            with open(f"{self.journal_path}.failed", "a") as fp:
+                fp.write(json.dumps({**write, "error": str(error)}) + "\n")
+
+    def _load_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path) as fp:
+            for line in fp:
+                if line.strip():
+                    _coalesce(self._pending, json.loads(line))
+
+    def flush(self, ignore_conflicts: bool = False):
+        """Write the queued session writes to the database (per session)."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return
+            db_session = self.client.get_db_session()
+            failed = []
+            try:
+                for session_id, write in batch.items():
+                    try:
+                        self._write(write, db_session, ignore_conflicts)
+                    except SessionWriteConflict as exc:
+                        db_session.rollback()
+                        self._drop(write, exc)
+                    except Exception as exc:
+                        db_session.rollback()
+                        logger.error(
+                            f"Failed to flush the session {session_id} write, "
+                            f"will retry: {exc!r}"
+                        )
+                        failed.append(write)
+            finally:
+                db_session.close()
+            self.flushes += 1
+            logger.debug(
+                f"Flushed {len(batch) - len(failed)} of {len(batch)} session writes"
+            )
+            if failed:
+                with self._lock:
+                    # re-queue the failed writes before the writes queued since
+                    pending, self._pending = self._pending, {}
+                    for write in failed:
+                        _coalesce(self._pending, write)
+                    for write in pending.values():
+                        _coalesce(self._pending, write)
+            self._rewrite_journal()
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._pending:
+                self.flush()
+
+    def invalidate(self, session_id: str = None, username: str = None):
+        """Drop a session or user (or all if none specified) from the cache."""
+        with self._lock:
+            if session_id:
+                self._sessions.pop(session_id, None)
+            if username:
+                self._users.pop(username, None)
+            if not session_id and not username:
+                self._sessions.clear()
+                self._users.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "sessions": len(self._sessions),
+            "users": len(self._users),
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "dropped": self.dropped,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        """Stop the background writer and flush the queued writes."""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+        atexit.unregister(self.close)
+
+
+def _coalesce(pending: dict, write: dict):
+    """Merge a session write into the pending writes (per session)."""
+    old = pending.get(write["session_id"])
+    if old is None:
+        pending[write["session_id"]] = {**write, "messages": list(write["messages"])}
+        return
+    old["messages"].extend(write["messages"])
+    old["state"] = write["state"]
+    old["memory"] = write["memory"]
+
+
+class KeyValueSessionStore(BaseSessionStore):
+    """Base class for key-value session stores (no SQL database).
+
+    The session state is saved as a record (username, state, memory) and the
+    conversation as an append only list of messages. The users are not loaded
+    (event.user is None) and the sessions are not listed in the SQL sessions table.
+    """
+
+    def _read(self, session_id: str, start_fn):
+        """Return (record, number of messages, messages from start_fn(record, total))
+        or None if the session does not exist."""
+        raise NotImplementedError()
+
+    def _create(self, session_id: str, record: dict):
+        raise NotImplementedError()
+
+    def _append(self, write: dict):
+        raise NotImplementedError()
+
+    def read_state(self, event: PipelineEvent, db_session=None):
+        event.username = event.username or "guest"
+        if not event.session_id:
+            return
+
+        def start_fn(record, total):
+            memory = Conversation.from_list([], record.get("memory") or {})
+            return self._load_start(memory, total)
 
-        return SessionStore(client)
+        loaded = self._read(event.session_id, start_fn)
+        if loaded is None:
+            self._create(event.session_id, {"username": event.username})
+            return
+        record, total, messages = loaded
+        conversation = Conversation.from_list([], record.get("memory") or {})
+        conversation.messages = [Message.parse_obj(message) for message in messages]
+        conversation.offset = total - len(messages)
+        conversation.saved_index = total
+        event.session = ChatSession(
+            name=event.session_id,
+            username=record.get("username"),
+            state=record.get("state"),
+            memory=record.get("memory"),
+        )
+        event.state = event.session.state
+        event.conversation = conversation
 
-    raise NotImplementedError("Only local db is supported for now")
+    def save(self, event: PipelineEvent, db_session=None):
+        if event.session_id:
+            self._append(self._make_write(event))
+
+
+class MemorySessionStore(KeyValueSessionStore):
+    """Keep the chat sessions in memory (for a single process server or tests).
+
+    Args:
+        config: The app config (history settings).
+        max_sessions: Max number of sessions, the least recently used are dropped.
+    """
+
+    def __init__(self, config=None, max_sessions: int = 10000):
+        super().__init__(config)
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # session_id -> (record, messages)
+        self._lock = threading.Lock()
+
+    def _read(self, session_id: str, start_fn):
+        with self._lock:
+            if session_id not in self._sessions:
+                return None
+            self._sessions.move_to_end(session_id)
+            record, messages = self._sessions[session_id]
+            start = start_fn(record, len(messages))
+            return dict(record), len(messages), list(messages[start:])
+
+    def _create(self, session_id: str, record: dict):
+        with self._lock:
+            self._sessions[session_id] = (dict(record), [])
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def _append(self, write: dict):
+        session_id = write["session_id"]
+        with self._lock:
+            record, messages = self._sessions.setdefault(session_id, ({}, []))
+            messages.extend(write["messages"])
+            record["state"] = write["state"]
+            record["memory"] = write["memory"]
+
+
+class RedisSessionStore(KeyValueSessionStore):
+    """Keep the chat sessions in a Redis (protocol compatible) key-value database.
+
+    Each session is a hash ({prefix}session:{id}) with the username and json
+    encoded state and memory, and a list ({prefix}session:{id}:messages) of json
+    encoded messages, so saving a turn only appends its new messages. Requires
+    the redis package.
+
+    Args:
+        config: The app config (history settings).
+        url: The redis url, e.g. redis://localhost:6379/0.
+        prefix: The keys prefix.
+        ttl: Expire idle sessions after ttl seconds (0 to keep forever).
+        client: A redis client object (instead of the url).
+    """
+
+    def __init__(
+        self,
+        config=None,
+        url: str = "redis://localhost:6379/0",
+        prefix: str = "llmapps:",
+        ttl: int = 0,
+        client=None,
+    ):
+        super().__init__(config)
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImportError(
+                    "redis package is required for RedisSessionStore, "
+                    "install it with: pip install redis"
+                )
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.prefix}session:{session_id}"
+
+    def _read(self, session_id: str, start_fn):
+        key = self._key(session_id)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hgetall(key)
+        pipe.llen(f"{key}:messages")
+        record, total = pipe.execute()
+        if not record:
+            return None
+        record = {
+            "username": record.get("username"),
+            "state": json.loads(record.get("state") or "null"),
+            "memory": json.loads(record.get("memory") or "null"),
+        }
+        start = start_fn(record, total)
+        messages = self.client.lrange(f"{key}:messages", start, -1) if total else []
+        return record, total, [json.loads(message) for message in messages]
+
+    def _create(self, session_id: str, record: dict):
+        pipe = self.client.pipeline()
+        pipe.hset(self._key(session_id), mapping=record)
+        if self.ttl:
+            pipe.expire(self._key(session_id), self.ttl)
+        pipe.execute()
+
+    def _append(self, write: dict):
+        key = self._key(write["session_id"])
+        pipe = self.client.pipeline()
+        if write["messages"]:
+            pipe.rpush(
+                f"{key}:messages",
+                *[json.dumps(message) for message in write["messages"]],
+            )
+        pipe.hset(
+            key,
+            mapping={
+                "state": json.dumps(write["state"]),
+                "memory": json.dumps(write["memory"]),
+            },
+        )
+        if self.ttl:
+            pipe.expire(key, self.ttl)
+            pipe.expire(f"{key}:messages", self.ttl)
+        pipe.execute()
+
+
+def get_session_store(config):
+    """Create the session store from config.session_store (class_name and args)."""
+    store_args = dict(config.session_store)
+    if store_args.get("class_name") == "sql":
+        if not config.use_local_db:
+            raise NotImplementedError("SQL session store requires use_local_db")
+        if config.session_cache_size:
+            return CachedSessionStore(
+                config=config,
+                cache_size=config.session_cache_size,
+                flush_interval=config.session_flush_interval,
+                max_pending=config.session_max_pending,
+                journal_path=config.session_journal_path,
+            )
+    store_args["config"] = config
+    return get_object_from_dict(store_args, session_store_shortcuts)
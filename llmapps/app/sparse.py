@@ -0,0 +1,437 @@
+import json
+import re
+import threading
+import uuid
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain.schema import BaseRetriever, Document
+from langchain.schema.vectorstore import VectorStore
+
+from .config import logger
+from .filters import MetadataIndex, vector_search_kwargs
+from .vectorstore import file_lock
+
+# words and numbers, and codes, e.g. "err-1042" or "v2.3.1" (also indexed by parts)
+_word_pattern = re.compile(r"[a-z0-9]+")
+_compound_pattern = re.compile(r"[a-z0-9]+(?:[-_.:/][a-z0-9]+)+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower case word tokens, and the compound tokens (codes) as a whole."""
+    text = text.lower()
+    return _word_pattern.findall(text) + _compound_pattern.findall(text)
+
+
+class BM25Index:
+    """Persistent BM25 (sparse) index of a collection chunks.
+
+    The postings (term -> rows and term frequencies) are kept in numpy arrays sorted
+    by term, so a query is scored with a few vectorized operations per query term.
+    New chunks are appended to a delta segment (merged into the main segment on
+    snapshot). Added and deleted chunks are appended to a log file, the index is
+    loaded from the last snapshot and the log records written after it, and is
+    refreshed when the log was extended by another process (e.g. a CLI ingestion).
+
+    Example:
+        index = BM25Index("data/bm25/default")
+        index.add_documents(chunks, ids=ids)
+        docs = index.search("error E-1042", k=5)
+
+    Args:
+        path: The index directory.
+        k1: BM25 term frequency saturation.
+        b: BM25 document length normalization.
+        snapshot_postings: Number of new postings which triggers a snapshot save.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        k1: float = 1.5,
+        b: float = 0.75,
+        snapshot_postings: int = 2_000_000,
+    ):
+        self.path = Path(path)
+        self.k1 = k1
+        self.b = b
+        self.snapshot_postings = snapshot_postings
+        self._lock = threading.RLock()
+        self._num_rows = 0
+        self._ids = []  # id per row
+        self._id_rows = {}  # id -> row (live rows)
+        self._offsets = np.zeros(1024, dtype=np.int64)  # row -> log offset
+        self._lengths = np.zeros(1024, dtype=np.float32)  # row -> number of tokens
+        self._valid = np.zeros(1024, dtype=bool)
+        self._metadatas = []
+        self._metadata_index = MetadataIndex()
+        self._total_length = 0.0  # of the live rows
+        self._vocab = {}  # term -> term id
+        # main segment, the postings of term i are rows/tfs[bounds[i]:bounds[i+1]]
+        self._bounds = np.zeros(1, dtype=np.int64)
+        self._rows = np.zeros(0, dtype=np.int32)
+        self._tfs = np.zeros(0, dtype=np.float32)
+        # delta segment (postings added after the snapshot) and its sorted arrays
+        self._delta = array("i"), array("i"), array("f")  # term ids, rows, tfs
+        self._sorted_delta = None
+        self._log_size = 0  # log bytes loaded
+        self._load_snapshot()
+        self._refresh()
+
+    @property
+    def _log_path(self):
+        return self.path / "postings.jsonl"
+
+    @property
+    def _snapshot_path(self):
+        return self.path / "snapshot.npz"
+
+    @property
+    def _snapshot_rows_path(self):
+        return self.path / "snapshot.json"
+
+    def __len__(self):
+        return len(self._id_rows)
+
+    def _load_snapshot(self):
+        if not self._snapshot_rows_path.exists():
+            return
+        with open(self._snapshot_rows_path) as fp:
+            meta = json.load(fp)
+        data = np.load(self._snapshot_path)
+        self._num_rows = num_rows = meta["num_rows"]
+        self._ids = meta["ids"]
+        self._metadatas = meta["metadatas"]
+        for row, metadata in enumerate(self._metadatas):
+            self._metadata_index.add(row, metadata)
+        self._log_size = meta["log_size"]
+        self._vocab = {term: i for i, term in enumerate(meta["terms"])}
+        self._grow(num_rows)
+        self._offsets[:num_rows] = data["offsets"]
+        self._lengths[:num_rows] = data["lengths"]
+        self._valid[:num_rows] = data["valid"]
+        self._id_rows = {
+            self._ids[row]: row for row in np.flatnonzero(data["valid"]).tolist()
+        }
+        self._total_length = float(self._lengths[:num_rows][data["valid"]].sum())
+        self._bounds, self._rows, self._tfs = data["bounds"], data["rows"], data["tfs"]
+
+    def save(self):
+        """Merge the delta segment and save a snapshot (speeds up the load)."""
+        with self._write_lock():
+            self._save()
+
+    def _save(self):
+        terms, rows, tfs = self._delta
+        main_terms = np.repeat(
+            np.arange(len(self._bounds) - 1, dtype=np.int32), np.diff(self._bounds)
+        )
+        all_terms = np.concatenate([main_terms, np.frombuffer(terms, np.int32)])
+        order = np.argsort(all_terms, kind="stable")
+        self._bounds = np.searchsorted(
+            all_terms[order], np.arange(len(self._vocab) + 1)
+        ).astype(np.int64)
+        self._rows = np.concatenate([self._rows, np.frombuffer(rows, np.int32)])
+        self._rows = self._rows[order]
+        self._tfs = np.concatenate([self._tfs, np.frombuffer(tfs, np.float32)])
+        self._tfs = self._tfs[order]
+        self._delta = array("i"), array("i"), array("f")
+        self._sorted_delta = None
+
+        num_rows = self._num_rows
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path / "snapshot.tmp.npz"
+        np.savez(
+            tmp_path,
+            offsets=self._offsets[:num_rows],
+            lengths=self._lengths[:num_rows],
+            valid=self._valid[:num_rows],
+            bounds=self._bounds,
+            rows=self._rows,
+            tfs=self._tfs,
+        )
+        tmp_path.replace(self._snapshot_path)
+        # the rows file commits the snapshot (it was written before the arrays)
+        meta = {
+            "num_rows": num_rows,
+            "log_size": self._log_size,
+            "terms": list(self._vocab),
+            "ids": self._ids,
+            "metadatas": self._metadatas,
+        }
+        tmp_path = self._snapshot_rows_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as fp:
+            json.dump(meta, fp)
+        tmp_path.replace(self._snapshot_rows_path)
+        logger.debug(f"Saved BM25 index snapshot {self.path}, {len(self)} rows")
+
+    def _refresh(self):
+        """Load the log records added since the last load (or by other processes)."""
+        with self._lock:
+            try:
+                size = self._log_path.stat().st_size
+            except FileNotFoundError:
+                return
+            if size <= self._log_size:
+                return
+            with open(self._log_path, "rb") as fp:
+                fp.seek(self._log_size)
+                offset = self._log_size
+                for line in fp:
+                    if not line.endswith(b"\n"):
+                        break  # partially written record
+                    self._apply(json.loads(line), offset)
+                    offset += len(line)
+            if self._log_size:
+                logger.debug(f"Refreshed BM25 index {self.path}, {len(self)} rows")
+            self._log_size = offset
+
+    def _apply(self, record: dict, offset: int):
+        if "delete" in record:
+            for id in record["delete"]:
+                self._delete_row(id)
+            return
+        self._delete_row(record["id"])
+        row = self._num_rows
+        if row >= len(self._valid):
+            self._grow(row + 1)
+        terms = record["terms"]
+        length = sum(terms.values())
+        self._ids.append(record["id"])
+        self._id_rows[record["id"]] = row
+        self._offsets[row] = offset
+        self._lengths[row] = length
+        self._valid[row] = True
+        self._metadatas.append(record["metadata"])
+        self._metadata_index.add(row, record["metadata"])
+        self._total_length += length
+        vocab = self._vocab
+        term_ids, rows, tfs = self._delta
+        term_ids.extend([vocab.setdefault(term, len(vocab)) for term in terms])
+        rows.extend([row] * len(terms))
+        tfs.extend(terms.values())
+        self._sorted_delta = None
+        self._num_rows += 1
+
+    def _delete_row(self, id: str):
+        row = self._id_rows.pop(id, None)
+        if row is not None:
+            self._valid[row] = False
+            self._total_length -= self._lengths[row]
+
+    def _grow(self, num_rows: int):
+        capacity = max(len(self._valid) * 2, num_rows)
+        pad = capacity - len(self._valid)
+        self._valid = np.concatenate([self._valid, np.zeros(pad, dtype=bool)])
+        self._offsets = np.concatenate([self._offsets, np.zeros(pad, np.int64)])
+        self._lengths = np.concatenate([self._lengths, np.zeros(pad, np.float32)])
+
+    @contextmanager
+    def _write_lock(self):
+        """Lock the index (also between processes) and load the log tail."""
+        with self._lock, file_lock(self.path):
+            self._refresh()
+            yield
+
+    def _write(self, records: List[dict]):
+        # called with the write lock, the log is appended by one process at a time
+        with open(self._log_path, "ab") as fp:
+            if fp.tell() > self._log_size:
+                # a partial record of an interrupted write (not loaded by _refresh)
+                fp.truncate(self._log_size)
+                fp.seek(self._log_size)
+            offset = fp.tell()
+            for record in records:
+                line = (json.dumps(record) + "\n").encode()
+                fp.write(line)
+                self._apply(record, offset)
+                offset += len(line)
+        self._log_size = offset
+        if len(self._delta[0]) >= self.snapshot_postings:
+            self._save()
+
+    def add_documents(self, documents: List[Document], ids: List[str] = None):
+        """Index the documents (chunks), existing ids are replaced."""
+        ids = ids or [uuid.uuid4().hex for _ in documents]
+        records = [
+            {
+                "id": id,
+                "text": doc.page_content,
+                "metadata": doc.metadata,
+                "terms": Counter(tokenize(doc.page_content)),
+            }
+            for doc, id in zip(documents, ids)
+        ]
+        with self._write_lock():
+            self._write(records)
+        return ids
+
+    def delete(self, ids: List[str]):
+        with self._write_lock():
+            ids = [id for id in ids if id in self._id_rows]
+            if ids:
+                self._write([{"delete": ids}])
+
+    def _postings(self, term_id: int):
+        """The (rows, term frequencies) arrays of a term (main and delta segments)."""
+        rows, tfs = [], []
+        if term_id < len(self._bounds) - 1:
+            start, end = self._bounds[term_id], self._bounds[term_id + 1]
+            rows.append(self._rows[start:end])
+            tfs.append(self._tfs[start:end])
+        if len(self._delta[0]):
+            if self._sorted_delta is None:
+                term_ids, delta_rows, delta_tfs = self._delta
+                term_ids = np.frombuffer(term_ids, np.int32)
+                order = np.argsort(term_ids, kind="stable")
+                self._sorted_delta = (
+                    term_ids[order],
+                    np.frombuffer(delta_rows, np.int32)[order],
+                    np.frombuffer(delta_tfs, np.float32)[order],
+                )
+            term_ids, delta_rows, delta_tfs = self._sorted_delta
+            start, end = np.searchsorted(term_ids, [term_id, term_id + 1])
+            rows.append(delta_rows[start:end])
+            tfs.append(delta_tfs[start:end])
+        return np.concatenate(rows), np.concatenate(tfs)
+
+    def scores(self, query: str, filter=None) -> np.ndarray:
+        """The BM25 score per row (0 for rows without query terms, deleted or not
+        matching the filter)."""
+        self._refresh()
+        with self._lock:
+            num_rows, num_docs = self._num_rows, len(self._id_rows)
+            scores = np.zeros(num_rows, dtype=np.float32)
+            if not num_docs:
+                return scores
+            valid = self._valid[:num_rows]
+            filter_mask = self._metadata_index.mask(filter, num_rows)
+            lengths = self._lengths[:num_rows]
+            avg_length = max(self._total_length / num_docs, 1.0)
+            for term in set(tokenize(query)):
+                if term not in self._vocab:
+                    continue
+                rows, tfs = self._postings(self._vocab[term])
+                live = valid[rows]
+                rows, tfs = rows[live], tfs[live]
+                doc_freq = len(rows)
+                if filter_mask is not None:
+                    # pre-filter, only the matching rows are scored
+                    matches = filter_mask[rows]
+                    rows, tfs = rows[matches], tfs[matches]
+                if not len(rows):
+                    continue
+                idf = np.log1p((num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * lengths[rows] / avg_length)
+                scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+        return scores
+
+    def search_rows(self, query: str, k: int = 4, filter=None):
+        """Return the top k (row, score) with a positive score."""
+        scores = self.scores(query, filter)
+        rows = np.flatnonzero(scores)
+        if len(rows) > k:
+            rows = rows[np.argpartition(-scores[rows], k - 1)[:k]]
+        rows = rows[np.argsort(-scores[rows])]
+        return list(zip(rows.tolist(), scores[rows].tolist()))
+
+    def search(self, query: str, k: int = 4, filter=None) -> List[Document]:
+        """Return the top k documents for the query."""
+        results = self.search_rows(query, k, filter)
+        documents = []
+        if not results:
+            return documents
+        with open(self._log_path, "rb") as fp:
+            for row, _ in results:
+                fp.seek(self._offsets[row])
+                record = json.loads(fp.readline())
+                documents.append(
+                    Document(page_content=record["text"], metadata=record["metadata"])
+                )
+        return documents
+
+
+def _document_key(doc: Document):
+    # the same chunk returned by the vector and BM25 searches
+    metadata = doc.metadata
+    if "chunk_id" in metadata:
+        return metadata["chunk_id"]
+    # ingested without a chunk id, the chunk index is per page (not unique)
+    return metadata.get("doc_uid"), doc.page_content
+
+
+def reciprocal_rank_fusion(
+    results: Sequence[List[Document]],
+    weights: Sequence[float] = None,
+    rrf_k: int = 60,
+) -> List[Document]:
+    """Merge ranked document lists, score = sum(weight / (rrf_k + rank)).
+
+    Args:
+        results: Ranked document lists (e.g. vector and BM25 search results).
+        weights: Weight per list (default to 1).
+        rrf_k: Rank smoothing constant, larger values flatten the rank differences.
+    """
+    weights = weights or [1.0] * len(results)
+    scores: Dict[Any, float] = {}
+    documents = {}
+    for documents_list, weight in zip(results, weights):
+        for rank, doc in enumerate(documents_list, start=1):
+            key = _document_key(doc)
+            scores[key] = scores.get(key, 0.0) + weight / (rrf_k + rank)
+            documents.setdefault(key, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [documents[key] for key in ranked]
+
+
+class HybridRetriever(BaseRetriever):
+    """Retrieve with vector and BM25 search and fuse the results (RRF).
+
+    Args:
+        vector_store: The vector store.
+        sparse_index: The collection BM25 index.
+        k: Number of returned documents.
+        fetch_k: Number of candidates fetched from each search.
+        rrf_k: The reciprocal rank fusion constant.
+        weights: The (vector, BM25) weights.
+        search_kwargs: Extra vector search args.
+        filter: A metadata filter (see filters.parse_filter).
+    """
+
+    vector_store: VectorStore
+    sparse_index: BM25Index
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+    weights: List[float] = [1.0, 1.0]
+    search_kwargs: dict = {}
+    filter: Any = None
+
+    def _vector_search_kwargs(self) -> dict:
+        return {
+            **self.search_kwargs,
+            **vector_search_kwargs(self.vector_store, self.filter),
+        }
+
+    def _fuse(self, query: str, dense: List[Document]) -> List[Document]:
+        sparse = self.sparse_index.search(query, self.fetch_k, filter=self.filter)
+        fused = reciprocal_rank_fusion([dense, sparse], self.weights, self.rrf_k)
+        return fused[: self.k]
+
+    def _get_relevant_documents(self, query: str, *, run_manager) -> List[Document]:
+        dense = self.vector_store.similarity_search(
+            query, k=self.fetch_k, **self._vector_search_kwargs()
+        )
+        return self._fuse(query, dense)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager
+    ) -> List[Document]:
+        dense = await self.vector_store.asimilarity_search(
+            query, k=self.fetch_k, **self._vector_search_kwargs()
+        )
+        return self._fuse(query, dense)
@@ -0,0 +1,95 @@
+import asyncio
+import json
+import re
+import time
+
+from langchain.schema.callbacks.base import BaseCallbackHandler
+
+from .config import logger
+
+_end_of_stream = object()
+
+
+class TokenStreamHandler(BaseCallbackHandler):
+    """A callback handler which streams the LLM answer tokens into an asyncio queue.
+
+    The handler must be created in the event loop thread, tokens can be added from
+    any thread. The trailing sources list of the answer (e.g. "SOURCES: 1, 2") is not
+    streamed. If the LLM is not in streaming mode the whole answer is sent as one token.
+
+    Example:
+        handler = TokenStreamHandler()
+        async for token in handler.atokens():
+            print(token, end="")
+
+    Args:
+        stop_pattern: Regex which marks the end of the streamed answer text.
+    """
+
+    def __init__(self, stop_pattern: str = r"SOURCES?:"):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._stop_re = (
+            re.compile(stop_pattern, re.IGNORECASE) if stop_pattern else None
+        )
+        self._holdback = len(stop_pattern) if stop_pattern else 0
+        self._buffer = ""
+        self._streamed = False
+        self._stopped = False
+        self._start = time.monotonic()
+        self.time_to_first_token = None
+
+    def _put(self, item):
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+
+    def _send(self, text: str):
+        if not text:
+            return
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.monotonic() - self._start
+            logger.debug(f"Time to first token: {self.time_to_first_token:.3f}s")
+        self._put(text)
+
+    def _add_text(self, text: str, final: bool = False):
+        if self._stopped:
+            return
+        self._buffer += text
+        match = self._stop_re.search(self._buffer) if self._stop_re else None
+        if match:
+            self._send(self._buffer[: match.start()].rstrip())
+            self._stopped = True
+            self._buffer = ""
+        elif final:
+            self._send(self._buffer)
+            self._buffer = ""
+        elif len(self._buffer) > self._holdback:
+            # hold back a possible partial stop pattern
+            self._send(self._buffer[: -self._holdback])
+            self._buffer = self._buffer[-self._holdback :]
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        self._streamed = True
+        self._add_text(token)
+
+    def on_llm_end(self, response, **kwargs):
+        if not self._streamed:
+            self._add_text(response.generations[0][0].text, final=True)
+        else:
+            self._add_text("", final=True)
+
+    def close(self):
+        """Mark the end of the token stream."""
+        self._put(_end_of_stream)
+
+    async def atokens(self):
+        """Iterate over the answer tokens until the stream is closed."""
+        while True:
+            token = await self._queue.get()
+            if token is _end_of_stream:
+                return
+            yield token
+
+
+def sse_frame(frame: dict) -> str:
+    """Format a stream frame as a server sent event."""
+    return f"data: {json.dumps(frame)}\n\n"
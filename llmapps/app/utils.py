@@ -1,3 +1,6 @@
+from functools import lru_cache
+
+
 def sources_to_text(sources):
     """Convert a list of sources to a string."""
     if not sources:
@@ -27,3 +30,35 @@ def get_title(metadata):
     if "page" in metadata:
         return f"{metadata.get('title', '')} - page {metadata['page']}"
     return metadata.get("title", "")
+
+
+@lru_cache(maxsize=1)
+def _get_token_encoder():
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Count the (LLM) tokens in a text, approximated if tiktoken is not installed."""
+    if not text:
+        return 0
+    encoder = _get_token_encoder()
+    if encoder is None:
+        return len(text) // 4 + 1
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Return the beginning of the text, up to max_tokens (LLM) tokens."""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoder = _get_token_encoder()
+    if encoder is None:
+        return text[: (max_tokens - 1) * 4]
+    return encoder.decode(encoder.encode(text, disallowed_special=())[:max_tokens])
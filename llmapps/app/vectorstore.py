@@ -0,0 +1,962 @@
+import json
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+import numpy as np
+from langchain.schema import Document
+from langchain.schema.embeddings import Embeddings
+from langchain.schema.vectorstore import VectorStore
+from langchain.vectorstores.utils import maximal_marginal_relevance
+
+from .config import default_data_path, logger
+from .filters import MetadataIndex
+
+_search_chunk_rows = 65536  # rows scored per matrix product (bounds the memory)
+_code_chunk_rows = 4096  # rows of codes scored per step (cache friendly)
+_train_sample_rows = 20_000  # max rows sampled to train a quantizer
+_quantization_min_rows = 10_000  # default min rows to quantize
+
+
+@contextmanager
+def file_lock(path: Path):
+    """Exclusive lock of the files in a directory, between processes (not reentrant,
+    also within a process)."""
+    if fcntl is None:
+        yield
+        return
+    path.mkdir(parents=True, exist_ok=True)
+    with open(path / "write.lock", "a") as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+class VectorFile:
+    """A growable, memory mapped matrix (one row per vector or vector code)."""
+
+    def __init__(
+        self, path: Path, dim: int = None, capacity: int = 0, dtype=np.float32
+    ):
+        self.path = path
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.capacity = 0
+        self.array = None
+        if dim and capacity:
+            self._map(capacity)
+
+    def _map(self, capacity: int):
+        if self.array is not None:
+            self.array.flush()
+        size = capacity * self.dim * self.dtype.itemsize
+        with open(self.path, "ab") as fp:
+            if fp.tell() < size:  # never shrink, the file may be shared
+                fp.truncate(size)
+        self.array = np.memmap(
+            self.path, dtype=self.dtype, mode="r+", shape=(capacity, self.dim)
+        )
+        self.capacity = capacity
+
+    def write(self, start: int, vectors: np.ndarray):
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        end = start + len(vectors)
+        if end > self.capacity:
+            self._map(max(1024, self.capacity * 2, end))
+        self.array[start:end] = vectors
+
+    def flush(self):
+        if self.array is not None:
+            self.array.flush()
+
+
+class IVFIndex:
+    """Inverted file index, the vectors are clustered (k-means) into lists and a
+    search only scores the rows of the lists nearest to the query.
+
+    Args:
+        num_lists: Number of clusters (default to sqrt of the number of rows).
+        num_probes: Number of nearest lists scored per query.
+    """
+
+    def __init__(self, num_lists: int = None, num_probes: int = 8):
+        self.num_lists = num_lists
+        self.num_probes = num_probes
+        self.centroids = None
+        self.list_rows = []  # rows of each list
+        self.num_rows = 0  # rows included in the index (the rest are scanned)
+
+    def build(self, vectors: np.ndarray, iterations: int = 10, seed: int = 0):
+        num_rows = len(vectors)
+        num_lists = self.num_lists or max(1, int(np.sqrt(num_rows)))
+        rng = np.random.default_rng(seed)
+        sample_size = min(num_rows, num_lists * 64)
+        sample = np.asarray(vectors[np.sort(rng.choice(num_rows, sample_size, False))])
+        centroids = sample[rng.choice(sample_size, num_lists, replace=False)]
+        for _ in range(iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # keep the old centroid for empty clusters (spherical k-means)
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+
+        assign = np.empty(num_rows, dtype=np.int32)
+        for start in range(0, num_rows, _search_chunk_rows):
+            chunk = np.asarray(vectors[start : start + _search_chunk_rows])
+            assign[start : start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(num_lists + 1))
+        self.centroids = centroids.astype(np.float32)
+        self.list_rows = [order[bounds[i] : bounds[i + 1]] for i in range(num_lists)]
+        self.num_rows = num_rows
+
+    def candidates(self, query: np.ndarray, total_rows: int) -> np.ndarray:
+        """The rows to score: the rows of the nearest lists and the new rows."""
+        probes = min(self.num_probes, len(self.list_rows))
+        nearest = np.argpartition(-(self.centroids @ query), probes - 1)[:probes]
+        rows = [self.list_rows[i] for i in nearest]
+        rows.append(np.arange(self.num_rows, total_rows))
+        return np.sort(np.concatenate(rows))
+
+    def save(self, path: Path):
+        lengths = np.array([len(rows) for rows in self.list_rows])
+        np.savez(
+            path,
+            centroids=self.centroids,
+            rows=np.concatenate(self.list_rows),
+            lengths=lengths,
+            num_rows=self.num_rows,
+        )
+
+    def load(self, path: Path):
+        data = np.load(path)
+        self.centroids = data["centroids"]
+        bounds = np.concatenate([[0], np.cumsum(data["lengths"])])
+        self.list_rows = [
+            data["rows"][bounds[i] : bounds[i + 1]] for i in range(len(bounds) - 1)
+        ]
+        self.num_rows = int(data["num_rows"])
+
+
+class Quantizer:
+    """Compressed (uint8) vector codes, scored in the first search pass.
+
+    The codes scores are approximate, the top candidates are re-scored with the
+    float32 vectors (read from disk), so only the codes are scanned per query.
+    """
+
+    kind = ""
+    rescore_factor = 4  # candidates re-scored per requested result
+
+    def __init__(self):
+        self.num_rows = 0  # rows when trained (re-trained as the collection grows)
+
+    def code_size(self, dim: int) -> int:
+        raise NotImplementedError()
+
+    def train(self, sample: np.ndarray):
+        raise NotImplementedError()
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """The codes (uint8 matrix) of the vectors."""
+        raise NotImplementedError()
+
+    def scorer(self, query: np.ndarray) -> Callable[[np.ndarray], np.ndarray]:
+        """A function which returns the approximate scores of a codes matrix."""
+        raise NotImplementedError()
+
+    def state(self) -> dict:
+        raise NotImplementedError()
+
+    def load_state(self, state):
+        raise NotImplementedError()
+
+    def save(self, path: Path):
+        np.savez(path, kind=self.kind, num_rows=self.num_rows, **self.state())
+
+    def load(self, path: Path) -> bool:
+        """Load the trained state, False if it was trained for another kind."""
+        data = np.load(path)
+        if str(data["kind"]) != self.kind:
+            return False
+        self.num_rows = int(data["num_rows"])
+        self.load_state(data)
+        return True
+
+
+class ScalarQuantizer(Quantizer):
+    """int8 scalar quantization, each dimension is mapped to 256 levels of its
+    value range (4x smaller than float32)."""
+
+    kind = "int8"
+    rescore_factor = 2
+
+    def __init__(self):
+        super().__init__()
+        self.low = None
+        self.scale = None
+
+    def code_size(self, dim: int) -> int:
+        return dim
+
+    def train(self, sample: np.ndarray):
+        # trim the outliers, they are clipped to the range edges
+        low, high = np.quantile(sample, [0.001, 0.999], axis=0)
+        self.low = low.astype(np.float32)
+        self.scale = (np.maximum(high - low, 1e-6) / 255).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint((vectors - self.low) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def scorer(self, query: np.ndarray):
+        # query . (low + codes * scale) = query . low + codes . (query * scale)
+        weights = (query * self.scale).astype(np.float32)
+        offset = float(query @ self.low)
+        return lambda codes: np.einsum("ij,j->i", codes, weights) + offset
+
+    def state(self) -> dict:
+        return {"low": self.low, "scale": self.scale}
+
+    def load_state(self, state):
+        self.low = state["low"]
+        self.scale = state["scale"]
+
+
+_popcount = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class BinaryQuantizer(Quantizer):
+    """Binary quantization, one bit per dimension (above the mean value or not),
+    scored by the hamming distance (32x smaller than float32)."""
+
+    kind = "binary"
+    rescore_factor = 10
+
+    def __init__(self):
+        super().__init__()
+        self.mean = None
+
+    def code_size(self, dim: int) -> int:
+        return (dim + 7) // 8
+
+    def train(self, sample: np.ndarray):
+        self.mean = sample.mean(axis=0).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.packbits(vectors > self.mean, axis=1)
+
+    def scorer(self, query: np.ndarray):
+        bits = np.packbits(query > self.mean)
+
+        def score(codes):
+            distance = _popcount[codes ^ bits].sum(axis=1, dtype=np.int32)
+            return -distance.astype(np.float32)
+
+        return score
+
+    def state(self) -> dict:
+        return {"mean": self.mean}
+
+    def load_state(self, state):
+        self.mean = state["mean"]
+
+
+class ProductQuantizer(Quantizer):
+    """Product quantization, the vectors are split into sub vectors and each sub
+    vector is encoded by its nearest of 256 centroids (k-means), one byte each.
+
+    Args:
+        num_subvectors: Number of sub vectors (code bytes), must divide the dim,
+            default to dim / 4 (16x smaller than float32).
+        iterations: Number of k-means iterations.
+    """
+
+    kind = "pq"
+    rescore_factor = 8
+
+    def __init__(self, num_subvectors: int = None, iterations: int = 10):
+        super().__init__()
+        self.num_subvectors = num_subvectors
+        self.iterations = iterations
+        self.codebooks = None  # (sub vectors, centroids, sub vector dim)
+
+    def code_size(self, dim: int) -> int:
+        if self.codebooks is not None:
+            return len(self.codebooks)
+        num_subvectors = self.num_subvectors or max(1, dim // 4)
+        if dim % num_subvectors:
+            raise ValueError(
+                f"The vectors dim {dim} is not divisible by {num_subvectors} "
+                "PQ sub vectors"
+            )
+        return num_subvectors
+
+    def train(self, sample: np.ndarray, seed: int = 0):
+        num_subvectors = self.code_size(sample.shape[1])
+        sub_dim = sample.shape[1] // num_subvectors
+        num_centroids = min(256, len(sample))
+        rng = np.random.default_rng(seed)
+        codebooks = np.empty((num_subvectors, num_centroids, sub_dim), np.float32)
+        for i in range(num_subvectors):
+            subvectors = np.ascontiguousarray(
+                sample[:, i * sub_dim : (i + 1) * sub_dim]
+            )
+            centroids = subvectors[rng.choice(len(sample), num_centroids, False)]
+            for _ in range(self.iterations):
+                assign = _nearest(subvectors, centroids)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assign, subvectors)
+                counts = np.bincount(assign, minlength=num_centroids)[:, None]
+                # keep the old centroid for empty clusters
+                centroids = np.where(
+                    counts > 0, sums / np.maximum(counts, 1), centroids
+                )
+            codebooks[i] = centroids
+        self.codebooks = codebooks
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        num_subvectors, _, sub_dim = self.codebooks.shape
+        codes = np.empty((len(vectors), num_subvectors), dtype=np.uint8)
+        for i in range(num_subvectors):
+            subvectors = vectors[:, i * sub_dim : (i + 1) * sub_dim]
+            codes[:, i] = _nearest(subvectors, self.codebooks[i])
+        return codes
+
+    def scorer(self, query: np.ndarray):
+        # the query dot product with each sub vector centroid (lookup tables)
+        subqueries = query.reshape(len(self.codebooks), -1)
+        tables = np.einsum("icd,id->ic", self.codebooks, subqueries)
+
+        def score(codes):
+            scores = np.zeros(len(codes), dtype=np.float32)
+            for i, table in enumerate(tables):
+                scores += table.take(codes[:, i])
+            return scores
+
+        return score
+
+    def state(self) -> dict:
+        return {"codebooks": self.codebooks}
+
+    def load_state(self, state):
+        self.codebooks = state["codebooks"]
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """The nearest (euclidean) centroid of each vector."""
+    distances = (centroids**2).sum(axis=1) - 2 * (vectors @ centroids.T)
+    return np.argmin(distances, axis=1)
+
+
+def _get_quantizer(quantization: str, pq_subvectors: int = None) -> Quantizer:
+    if quantization == "int8":
+        return ScalarQuantizer()
+    if quantization == "binary":
+        return BinaryQuantizer()
+    if quantization == "pq":
+        return ProductQuantizer(pq_subvectors)
+    raise ValueError(
+        f"Unsupported quantization {quantization}, use int8, binary, pq or none"
+    )
+
+
+class LocalVectorStore(VectorStore):
+    """Embedded (serverless) vector store, one directory per collection.
+
+    The normalized embeddings are kept in a memory mapped float32 matrix, the chunk
+    texts and metadata in an append only rows log (read only for the results) and
+    the metadata values in a MetadataIndex, filters (see filters.parse_filter) are
+    evaluated on it and only the matching rows are scored. Search is a vectorized
+    brute force cosine similarity, with index_type="ivf" collections larger than
+    ivf_min_rows use an IVF (clustered) index. With quantization, the first pass
+    scans compact vector codes (int8, binary or PQ) and only the top candidates are
+    re-scored with the float32 vectors.
+
+    The meta file commits the written vectors and rows log records (the log size),
+    records after it (an interrupted write) are truncated on open. Writes take a
+    file lock, and the rows committed by other instances or processes (e.g. a CLI
+    ingestion) are loaded before each write and search.
+
+    Example:
+        store = LocalVectorStore(embeddings, "docs", persist_directory="data/vectors")
+        store.add_texts(["some text"], metadatas=[{"source": "a.txt"}])
+        docs = store.similarity_search("text", k=4, filter={"source": "a.txt"})
+
+    Args:
+        embedding_function: The embeddings model.
+        collection_name: The collection name (sub directory).
+        persist_directory: The root directory of the collections.
+        index_type: "flat" (exact) or "ivf" (approximate, for large collections).
+        ivf_min_rows: Min number of rows to use the IVF index (flat below).
+        ivf_lists: Number of IVF lists (default to sqrt of the number of rows).
+        ivf_probes: Number of IVF lists scored per query.
+        quantization: Keep compressed vector codes ("int8", "binary" or "pq") in a
+            first search pass, only the top candidates are re-scored with the
+            float32 vectors. None uses the collection saved mode, "none" disables it.
+        quantization_min_rows: Min number of rows to quantize (exact search below),
+            None uses the collection saved value (default 10000).
+        pq_subvectors: Number of PQ sub vectors (code bytes per vector).
+        rescore_factor: Candidates re-scored per result, None uses the collection
+            saved value (default per quantization).
+    """
+
+    def __init__(
+        self,
+        embedding_function: Embeddings,
+        collection_name: str = "default",
+        persist_directory: str = None,
+        index_type: str = "flat",
+        ivf_min_rows: int = 50_000,
+        ivf_lists: int = None,
+        ivf_probes: int = 8,
+        quantization: str = None,
+        quantization_min_rows: int = None,
+        pq_subvectors: int = None,
+        rescore_factor: int = None,
+    ):
+        if index_type not in ("flat", "ivf"):
+            raise ValueError(f"Unsupported index type {index_type}, use flat or ivf")
+        # the collection db_args values may be strings
+        ivf_min_rows, ivf_lists, ivf_probes, quantization_min_rows = map(
+            _optional_int, (ivf_min_rows, ivf_lists, ivf_probes, quantization_min_rows)
+        )
+        if quantization not in (None, "none"):
+            _get_quantizer(quantization)  # validate the name
+        self._embedding_function = embedding_function
+        self.collection_name = collection_name
+        self.path = Path(persist_directory or Path(default_data_path) / "vectors")
+        self.path = self.path / collection_name
+        self.index_type = index_type
+        self.ivf_min_rows = ivf_min_rows
+        self._ivf = IVFIndex(ivf_lists, ivf_probes) if index_type == "ivf" else None
+        self.quantization = quantization
+        self.quantization_min_rows = quantization_min_rows
+        self.rescore_factor = _optional_int(rescore_factor)
+        self._quantizer = None
+        self._codes = None  # the quantized codes matrix (VectorFile)
+        self._coded_rows = 0
+
+        self._num_rows = 0
+        self._ids = []  # id per row
+        self._id_rows = {}  # id -> row (live rows)
+        self._offsets = np.zeros(1024, dtype=np.int64)  # row -> rows log offset
+        self._valid = np.zeros(1024, dtype=bool)
+        self._metadata_index = MetadataIndex()
+        self._vectors = VectorFile(self.path / "vectors.f32")
+        self._log_size = 0  # rows log bytes loaded
+        self._meta_version = None  # the meta file (inode, mtime) when loaded
+        self._lock = threading.RLock()
+        self._open()
+        if self.quantization_min_rows is None:
+            self.quantization_min_rows = _quantization_min_rows
+        if self.quantization == "none":
+            self.quantization = None
+        if self.quantization:
+            self._open_codes(_optional_int(pq_subvectors))
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self._embedding_function
+
+    @property
+    def _rows_path(self):
+        return self.path / "rows.jsonl"
+
+    @property
+    def _meta_path(self):
+        return self.path / "meta.json"
+
+    @property
+    def _ivf_path(self):
+        return self.path / "ivf.npz"
+
+    @property
+    def _quantizer_path(self):
+        return self.path / "quantizer.npz"
+
+    @property
+    def _codes_path(self):
+        return self.path / "codes.u8"
+
+    def _file_lock(self):
+        """Exclusive lock of the collection files, between processes."""
+        return file_lock(self.path)
+
+    def _read_meta(self) -> dict:
+        with open(self._meta_path) as fp:
+            return json.load(fp)
+
+    def _open(self):
+        if not self._meta_path.exists():
+            return
+        with self._file_lock():
+            meta = self._read_meta()
+            if "log_size" not in meta:
+                # saved by an older version, commit the log size of its rows
+                meta["log_size"] = _committed_log_size(self._rows_path, meta["rows"])
+                self._write_meta(meta)
+            if self._rows_path.stat().st_size > meta["log_size"]:
+                logger.warning(
+                    f"Truncating the uncommitted records (interrupted write) of "
+                    f"{self._rows_path}"
+                )
+                with open(self._rows_path, "ab") as fp:
+                    fp.truncate(meta["log_size"])
+        # the quantization settings are saved with the collection
+        if self.quantization is None:
+            self.quantization = meta.get("quantization")
+        if self.quantization_min_rows is None:
+            self.quantization_min_rows = meta.get("quantization_min_rows")
+        if self.rescore_factor is None:
+            self.rescore_factor = meta.get("rescore_factor")
+        self._refresh()
+        if self._ivf and self._ivf_path.exists():
+            self._ivf.load(self._ivf_path)
+        logger.debug(
+            f"Opened local vector collection {self.path} with {len(self)} rows"
+        )
+
+    def _refresh(self):
+        """Load the rows committed since the last load (e.g. by other processes)."""
+        with self._lock:
+            try:
+                stat = self._meta_path.stat()
+            except FileNotFoundError:
+                return
+            if (stat.st_ino, stat.st_mtime_ns) == self._meta_version:
+                return
+            meta = self._read_meta()
+            self._meta_version = (stat.st_ino, stat.st_mtime_ns)
+            if meta["capacity"] > self._vectors.capacity:
+                self._vectors = VectorFile(
+                    self.path / "vectors.f32", meta["dim"], meta["capacity"]
+                )
+            if meta["log_size"] > self._log_size:
+                with open(self._rows_path, "rb") as fp:
+                    fp.seek(self._log_size)
+                    data = fp.read(meta["log_size"] - self._log_size)
+                offset = self._log_size
+                for line in data.splitlines(keepends=True):
+                    record = json.loads(line)
+                    if "delete" in record:
+                        self._delete_rows(record["delete"])
+                    else:
+                        self._add_row(record, offset)
+                    offset += len(line)
+                if self._log_size:
+                    logger.debug(f"Refreshed local vector collection {self.path}")
+                self._log_size = offset
+            self._refresh_codes(meta)
+
+    def _refresh_codes(self, meta: dict):
+        """Load the codes (and quantizer) state committed by the meta file."""
+        if self._quantizer is None:
+            # not opened yet, the codes are loaded by _open_codes
+            if self.quantization == meta.get("quantization"):
+                self._coded_rows = meta.get("coded_rows", 0)
+            return
+        coded_rows = 0
+        if self.quantization == meta.get("quantization"):
+            coded_rows = meta.get("coded_rows", 0)
+        if coded_rows and meta.get("trained_rows") != self._quantizer.num_rows:
+            # (re-)trained by another instance
+            if not self._quantizer_path.exists() or not self._quantizer.load(
+                self._quantizer_path
+            ):
+                coded_rows = 0
+        if coded_rows:
+            code_size = self._quantizer.code_size(self._vectors.dim)
+            capacity = self._codes_path.stat().st_size // code_size
+            if capacity > self._codes.capacity:
+                self._codes = VectorFile(
+                    self._codes_path, code_size, capacity, np.uint8
+                )
+        self._coded_rows = coded_rows
+
+    def _open_codes(self, pq_subvectors: int = None):
+        self._quantizer = _get_quantizer(self.quantization, pq_subvectors)
+        self._codes = VectorFile(self._codes_path, dtype=np.uint8)
+        if self._coded_rows:
+            self._refresh_codes(self._read_meta())
+
+    def __len__(self):
+        return len(self._id_rows)
+
+    def _grow(self, num_rows: int):
+        capacity = max(len(self._valid) * 2, num_rows)
+        self._valid = np.concatenate(
+            [self._valid, np.zeros(capacity - len(self._valid), dtype=bool)]
+        )
+        self._offsets = np.concatenate(
+            [self._offsets, np.zeros(capacity - len(self._offsets), dtype=np.int64)]
+        )
+
+    def _add_row(self, record: dict, offset: int):
+        row = self._num_rows
+        if row >= len(self._valid):
+            self._grow(row + 1)
+        old_row = self._id_rows.get(record["id"])
+        if old_row is not None:
+            self._valid[old_row] = False
+        self._ids.append(record["id"])
+        self._id_rows[record["id"]] = row
+        self._offsets[row] = offset
+        self._valid[row] = True
+        self._metadata_index.add(row, record["metadata"])
+        self._num_rows += 1
+
+    def _delete_rows(self, rows: list):
+        for row in rows:
+            self._valid[row] = False
+            if self._id_rows.get(self._ids[row]) == row:
+                del self._id_rows[self._ids[row]]
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        embeddings = self._embedding_function.embed_documents(texts)
+        return self.add_embeddings(list(zip(texts, embeddings)), metadatas, ids)
+
+    def add_embeddings(
+        self,
+        text_embeddings: Iterable[Tuple[str, List[float]]],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        """Add texts with pre-computed embeddings (existing ids are replaced)."""
+        text_embeddings = list(text_embeddings)
+        if not text_embeddings:
+            return []
+        metadatas = metadatas or [{} for _ in text_embeddings]
+        ids = ids or [uuid.uuid4().hex for _ in text_embeddings]
+        vectors = np.asarray([vector for _, vector in text_embeddings], np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+        with self._lock, self._file_lock():
+            self._refresh()
+            if self._vectors.dim and vectors.shape[1] != self._vectors.dim:
+                raise ValueError(
+                    f"Embedding dim {vectors.shape[1]} does not match the "
+                    f"collection dim {self._vectors.dim}"
+                )
+            self.path.mkdir(parents=True, exist_ok=True)
+            # the vectors are saved before the rows, the meta file commits both
+            self._vectors.write(self._num_rows, vectors)
+            self._vectors.flush()
+            if self._quantizer and self._coded_rows == self._num_rows > 0:
+                # encode the new rows with the trained quantizer
+                self._codes.write(self._num_rows, self._quantizer.encode(vectors))
+                self._codes.flush()
+                self._coded_rows += len(vectors)
+            with open(self._rows_path, "ab") as fp:
+                offset = fp.tell()
+                for (text, _), metadata, id in zip(text_embeddings, metadatas, ids):
+                    record = {"id": id, "text": text, "metadata": metadata or {}}
+                    line = (json.dumps(record) + "\n").encode()
+                    fp.write(line)
+                    self._add_row(record, offset)
+                    offset += len(line)
+            self._log_size = offset
+            self._save_meta()
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return False
+        with self._lock, self._file_lock():
+            self._refresh()
+            rows = [self._id_rows[id] for id in ids if id in self._id_rows]
+            if not rows:
+                return False
+            with open(self._rows_path, "ab") as fp:
+                fp.write((json.dumps({"delete": rows}) + "\n").encode())
+                self._log_size = fp.tell()
+            self._delete_rows(rows)
+            self._save_meta()
+        return True
+
+    def _save_meta(self):
+        """Commit the written vectors, codes and log records (under the file lock)."""
+        meta = {
+            "dim": self._vectors.dim,
+            "capacity": self._vectors.capacity,
+            "rows": self._num_rows,
+            "log_size": self._log_size,
+            "quantization": self.quantization,
+            "quantization_min_rows": self.quantization_min_rows,
+            "rescore_factor": self.rescore_factor,
+            "coded_rows": self._coded_rows,
+            "trained_rows": self._quantizer.num_rows if self._quantizer else 0,
+        }
+        self._write_meta(meta)
+        stat = self._meta_path.stat()
+        self._meta_version = (stat.st_ino, stat.st_mtime_ns)
+
+    def _write_meta(self, meta: dict):
+        tmp_path = self._meta_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as fp:
+            json.dump(meta, fp)
+        tmp_path.replace(self._meta_path)
+
+    def _filter_mask(self, filter, num_rows: int) -> np.ndarray:
+        mask = self._valid[:num_rows].copy()
+        filter_mask = self._metadata_index.mask(filter, num_rows)
+        if filter_mask is not None:
+            mask &= filter_mask
+        return mask
+
+    def _candidate_rows(self, query: np.ndarray, num_rows: int, num_matches: int):
+        """The rows to score, None for all the (filter matching) rows."""
+        if self._ivf is None or num_rows < self.ivf_min_rows:
+            return None
+        if self._ivf.num_rows == 0 or num_rows > self._ivf.num_rows * 1.5:
+            with self._lock:
+                logger.info(f"Building the IVF index of {self.path} ({num_rows} rows)")
+                self._ivf.build(self._vectors.array[:num_rows])
+                self._ivf.save(self._ivf_path)
+        probed_rows = num_rows * self._ivf.num_probes / len(self._ivf.list_rows)
+        if num_matches <= probed_rows:
+            # a selective filter, an exact search of the matches is cheaper
+            return None
+        return self._ivf.candidates(query, num_rows)
+
+    def _quantized_codes(self, num_rows: int) -> Optional[np.ndarray]:
+        """The rows codes for a first search pass, None for an exact search."""
+        if self._quantizer is None or num_rows < self.quantization_min_rows:
+            return None
+        if self._codes_outdated(num_rows):
+            with self._lock, self._file_lock():
+                self._refresh()
+                # re-check, updated by another thread (or process) meanwhile
+                if self._codes_outdated(num_rows):
+                    self._update_codes(num_rows)
+        return self._codes.array
+
+    def _codes_outdated(self, num_rows: int) -> bool:
+        # rows without codes, or the collection grew 4x since the quantizer training
+        trained_rows = self._quantizer.num_rows
+        return self._coded_rows < num_rows or num_rows > trained_rows * 4
+
+    def _update_codes(self, num_rows: int):
+        vectors = self._vectors.array
+        trained_rows = self._quantizer.num_rows
+        if trained_rows == 0 or num_rows > trained_rows * 4:
+            logger.info(
+                f"Training the {self.quantization} quantizer of {self.path} "
+                f"({num_rows} rows)"
+            )
+            rng = np.random.default_rng(0)
+            sample_size = min(num_rows, _train_sample_rows)
+            sample_rows = np.sort(rng.choice(num_rows, sample_size, replace=False))
+            self._quantizer.train(np.asarray(vectors[sample_rows]))
+            self._quantizer.num_rows = num_rows
+            tmp_path = self.path / "quantizer.tmp.npz"
+            self._quantizer.save(tmp_path)
+            tmp_path.replace(self._quantizer_path)
+            self._coded_rows = 0
+        for start in range(self._coded_rows, num_rows, _search_chunk_rows):
+            chunk = np.asarray(
+                vectors[start : min(start + _search_chunk_rows, num_rows)]
+            )
+            self._codes.write(start, self._quantizer.encode(chunk))
+        self._codes.flush()
+        self._coded_rows = max(self._coded_rows, num_rows)
+        self._save_meta()
+
+    def _search(
+        self, embedding: List[float], k: int, filter=None
+    ) -> List[Tuple[int, float]]:
+        """Return the top k (row, cosine similarity) for the query embedding."""
+        self._refresh()
+        num_rows = self._num_rows
+        if num_rows == 0 or k <= 0:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= max(np.linalg.norm(query), 1e-12)
+        mask = self._filter_mask(filter, num_rows)
+        num_matches = int(mask.sum())
+        rows = self._candidate_rows(query, num_rows, num_matches)
+        if rows is not None:
+            rows = rows[mask[rows]]
+        if rows is None and num_matches < num_rows:
+            # pre-filtered, only the matching rows are scored (exact search)
+            rows = np.flatnonzero(mask)
+        if rows is not None and len(rows) == 0:
+            return []
+
+        codes = self._quantized_codes(num_rows)
+        total = num_rows if rows is None else len(rows)
+        if codes is not None:
+            rescore_factor = self.rescore_factor or self._quantizer.rescore_factor
+            num_candidates = k * rescore_factor
+            if num_candidates < total:
+                # first pass over the codes, the top candidates are re-scored
+                rows = self._quantized_candidates(
+                    query, codes, rows, total, num_candidates
+                )
+                total = len(rows)
+
+        vectors = self._vectors.array
+        scores = np.empty(total, dtype=np.float32)
+        for start in range(0, total, _search_chunk_rows):
+            end = min(start + _search_chunk_rows, total)
+            if rows is None:
+                chunk = vectors[start:end]
+            else:
+                chunk = vectors[rows[start:end]]
+            scores[start:end] = chunk @ query
+        k = min(k, total)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        result_rows = top if rows is None else rows[top]
+        return list(zip(result_rows.tolist(), scores[top].tolist()))
+
+    def _quantized_candidates(
+        self, query: np.ndarray, codes, rows, total: int, num_candidates: int
+    ) -> np.ndarray:
+        score = self._quantizer.scorer(query)
+        scores = np.empty(total, dtype=np.float32)
+        for start in range(0, total, _code_chunk_rows):
+            end = min(start + _code_chunk_rows, total)
+            if rows is None:
+                chunk = codes[start:end]
+            else:
+                chunk = codes[rows[start:end]]
+            scores[start:end] = score(np.asarray(chunk))
+        top = np.argpartition(-scores, num_candidates - 1)[:num_candidates]
+        return np.sort(top if rows is None else rows[top])
+
+    def _read_documents(self, rows: List[int]) -> List[Document]:
+        documents = []
+        with open(self._rows_path, "rb") as fp:
+            for row in rows:
+                fp.seek(self._offsets[row])
+                record = json.loads(fp.readline())
+                documents.append(
+                    Document(page_content=record["text"], metadata=record["metadata"])
+                )
+        return documents
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter=None,
+        **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        results = self._search(embedding, k, filter)
+        documents = self._read_documents([row for row, _ in results])
+        return [(doc, score) for doc, (_, score) in zip(documents, results)]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, filter=None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        embedding = self._embedding_function.embed_query(query)
+        return self.similarity_search_with_score_by_vector(embedding, k, filter)
+
+    def similarity_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter=None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        results = self.similarity_search_with_score_by_vector(embedding, k, filter)
+        return [doc for doc, _ in results]
+
+    def similarity_search(
+        self, query: str, k: int = 4, filter=None, **kwargs: Any
+    ) -> List[Document]:
+        results = self.similarity_search_with_score(query, k, filter)
+        return [doc for doc, _ in results]
+
+    def _select_relevance_score_fn(self):
+        # the scores are cosine similarities
+        return lambda score: score
+
+    def max_marginal_relevance_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        filter=None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        results = self._search(embedding, fetch_k, filter)
+        if not results:
+            return []
+        rows = [row for row, _ in results]
+        selected = maximal_marginal_relevance(
+            np.asarray(embedding, dtype=np.float32),
+            self._vectors.array[rows],
+            lambda_mult=lambda_mult,
+            k=k,
+        )
+        return self._read_documents([rows[i] for i in selected])
+
+    def max_marginal_relevance_search(
+        self,
+        query: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        filter=None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        embedding = self._embedding_function.embed_query(query)
+        return self.max_marginal_relevance_search_by_vector(
+            embedding, k, fetch_k, lambda_mult, filter
+        )
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        collection_name: str = "default",
+        persist_directory: str = None,
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        store = cls(embedding, collection_name, persist_directory, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+        return store
+
+
+def _optional_int(value) -> Optional[int]:
+    return None if value is None else int(value)
+
+
+def _committed_log_size(rows_path: Path, num_rows: int) -> int:
+    """The size of the rows log records up to the num_rows row (older meta files)."""
+    offset = 0
+    with open(rows_path, "rb") as fp:
+        for line in fp:
+            if not line.endswith(b"\n"):
+                break  # partially written record
+            if "delete" not in json.loads(line):
+                if num_rows == 0:
+                    break  # a row without a saved vector (interrupted write)
+                num_rows -= 1
+            offset += len(line)
+    return offset
@@ -1,13 +1,27 @@
-from typing import List, Optional, Tuple, Union
-
-from fastapi import APIRouter, Depends, FastAPI, File, Header, Request, UploadFile
+from typing import List, Optional, Union
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    FastAPI,
+    File,
+    Header,
+    Query,
+    Request,
+    UploadFile,
+)
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
 import llmapps.app.actions as actions
-from llmapps.app.schema import QueryItem
+from llmapps.app.answer_cache import get_answer_cache
+from llmapps.app.config import config
+from llmapps.app.schema import ApiResponse, QueryItem
+from llmapps.app.streaming import sse_frame
 
 from . import model
+from .asyncsqlclient import async_client
 from .config import logger
 from .sqlclient import client
 
@@ -37,6 +51,11 @@ def get_db():
             db_session.close()
 
 
+async def get_async_db():
+    async with async_client.get_db_session() as db_session:
+        yield db_session
+
+
 class AuthInfo(BaseModel):
     username: str
     token: str
@@ -57,7 +76,11 @@ async def get_auth_user(
 
 @router.post("/pipeline/{name}/run")
 async def run_pipeline(
-    request: Request, name: str, item: QueryItem, auth=Depends(get_auth_user)
+    request: Request,
+    name: str,
+    item: QueryItem,
+    session=Depends(get_async_db),
+    auth=Depends(get_auth_user),
 ):
     """This is the query command"""
     app_server = request.app.extra.get("app_server")
@@ -68,28 +91,77 @@ async def run_pipeline(
         "session_id": item.session_id,
         "query": item.question,
         "collection_name": item.collection,
+        "filter": item.filter,
+        "db_session": session,
     }
-    logger.debug(f"running pipeline {name}: {event}")
-    resp = app_server.run_pipeline(name, event)
+    logger.debug(f"running pipeline {name}: {item}")
+    resp = await app_server.arun_pipeline(name, event)
     print(f"resp: {resp}")
     return resp
 
 
+@router.post("/pipeline/{name}/stream")
+async def stream_pipeline(
+    request: Request,
+    name: str,
+    item: QueryItem,
+    session=Depends(get_async_db),
+    auth=Depends(get_auth_user),
+):
+    """Run the query and stream the answer tokens (server sent events)"""
+    app_server = request.app.extra.get("app_server")
+    if not app_server:
+        raise ValueError("app_server not found in app")
+    event = {
+        "username": auth.username,
+        "session_id": item.session_id,
+        "query": item.question,
+        "collection_name": item.collection,
+        "filter": item.filter,
+        "db_session": session,
+    }
+    logger.debug(f"streaming pipeline {name}: {item}")
+
+    async def event_stream():
+        try:
+            async for frame in app_server.astream_pipeline(name, event):
+                yield sse_frame(frame)
+        except Exception as exc:
+            logger.error(f"pipeline {name} failed: {exc!r}")
+            yield sse_frame({"type": "error", "error": str(exc)})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+@router.get("/answer_cache")
+async def answer_cache_stats():
+    """Get the semantic answer cache statistics (hit rate, size, ..)"""
+    return ApiResponse(success=True, data=get_answer_cache(config).stats())
+
+
 @router.get("/collections")
 async def list_collections(
     owner: str = None,
-    labels: Optional[List[Tuple[str, str]]] = None,
+    labels: Optional[List[str]] = Query(None),
     mode: model.OutputMode = model.OutputMode.Details,
-    session=Depends(get_db),
+    limit: int = None,
+    cursor: str = None,
+    session=Depends(get_async_db),
 ):
-    return client.list_collections(
-        owner=owner, labels_match=labels, output_mode=mode, session=session
+    """List collections, labels filter: name=value or name (any value)"""
+    return await async_client.list_collections(
+        owner=owner,
+        labels_match=labels,
+        output_mode=mode,
+        limit=limit,
+        cursor=cursor,
+        session=session,
     )
 
 
 @router.get("/collection/{name}")
-async def get_collection(name: str, session=Depends(get_db)):
-    return client.get_collection(name, session=session)
+async def get_collection(name: str, session=Depends(get_async_db)):
+    return await async_client.get_collection(name, session=session)
 
 
 @router.post("/collection/{name}")
@@ -97,15 +169,16 @@ async def create_collection(
     request: Request,
     name: str,
     collection: model.DocCollection,
-    session=Depends(get_db),
+    session=Depends(get_async_db),
     auth: AuthInfo = Depends(get_auth_user),
 ):
     collection.owner_name = auth.username
-    return client.create_collection(collection, session=session)
+    return await async_client.create_collection(collection, session=session)
 
 
 @router.post("/collection/{name}/ingest")
-async def ingest(name, item: actions.IngestItem, session=Depends(get_db)):
+def ingest(name, item: actions.IngestItem, session=Depends(get_db)):
+    # blocking (parsing, embedding), runs in the FastAPI threadpool
     return actions.ingest(session, name, item)
 
 
@@ -113,32 +186,41 @@ async def ingest(name, item: actions.IngestItem, session=Depends(get_db)):
 async def list_users(
     email: str = None,
     username: str = None,
+    labels: Optional[List[str]] = Query(None),
     mode: model.OutputMode = model.OutputMode.Details,
-    session=Depends(get_db),
+    limit: int = None,
+    cursor: str = None,
+    session=Depends(get_async_db),
 ):
-    return client.list_users(
-        email=email, full_name=username, output_mode=mode, session=session
+    return await async_client.list_users(
+        email=email,
+        full_name=username,
+        labels_match=labels,
+        output_mode=mode,
+        limit=limit,
+        cursor=cursor,
+        session=session,
     )
 
 
 @router.get("/user/{username}")
-async def get_user(username: str, session=Depends(get_db)):
-    return client.get_user(username, session=session)
+async def get_user(username: str, session=Depends(get_async_db)):
+    return await async_client.get_user(username, session=session)
 
 
 @router.post("/user/{username}")
 async def create_user(
     user: model.User,
     username: str,
-    session=Depends(get_db),
+    session=Depends(get_async_db),
 ):
     """This is the user command"""
-    return client.create_user(user, session=session)
+    return await async_client.create_user(user, session=session)
 
 
 @router.delete("/user/{username}")
-async def delete_user(username: str, session=Depends(get_db)):
-    return client.delete_user(username, session=session)
+async def delete_user(username: str, session=Depends(get_async_db)):
+    return await async_client.delete_user(username, session=session)
 
 
 # get last user sessions, specify user and last
@@ -147,11 +229,19 @@ async def list_user_sessions(
     username: str,
     last: int = 0,
     created: str = None,
+    labels: Optional[List[str]] = Query(None),
     mode: model.OutputMode = model.OutputMode.Details,
-    session=Depends(get_db),
+    cursor: str = None,
+    session=Depends(get_async_db),
 ):
-    return client.list_sessions(
-        username, created_after=created, last=last, output_mode=mode, session=session
+    return await async_client.list_sessions(
+        username,
+        created_after=created,
+        last=last,
+        output_mode=mode,
+        labels_match=labels,
+        cursor=cursor,
+        session=session,
     )
 
 
@@ -161,25 +251,36 @@ async def list_sessions(
     username: str = None,
     last: int = 0,
     created: str = None,
+    labels: Optional[List[str]] = Query(None),
     mode: model.OutputMode = model.OutputMode.Details,
-    session=Depends(get_db),
+    limit: int = None,
+    cursor: str = None,
+    session=Depends(get_async_db),
     auth=Depends(get_auth_user),
 ):
+    """List chat sessions, paginate with limit and the response next_cursor"""
     user = None if username and username == "all" else (username or auth.username)
-    return client.list_sessions(
-        user, created_after=created, last=last, output_mode=mode, session=session
+    return await async_client.list_sessions(
+        user,
+        created_after=created,
+        last=last,
+        output_mode=mode,
+        labels_match=labels,
+        limit=limit,
+        cursor=cursor,
+        session=session,
     )
 
 
 @router.get("/session/{session_id}")
 async def get_session(
-    session_id: str, session=Depends(get_db), auth=Depends(get_auth_user)
+    session_id: str, session=Depends(get_async_db), auth=Depends(get_auth_user)
 ):
     user = None
     if session_id == "$last":
         user = auth.username
         session_id = None
-    return client.get_session(session_id, user, session=session)
+    return await async_client.get_session(session_id, user, session=session)
 
 
 @router.post("/transcribe")
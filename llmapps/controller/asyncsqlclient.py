@@ -0,0 +1,144 @@
+import functools
+
+import sqlalchemy
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from .config import config
+from .sqlclient import SqlClient, engine_options, set_sqlite_wal
+from .sqldb import Base
+
+# async drivers for the sync database urls
+_async_drivers = {
+    "sqlite": "aiosqlite",
+    "mysql": "asyncmy",
+    "postgresql": "asyncpg",
+}
+
+
+def to_async_url(db_url: str) -> str:
+    """Convert a (sync) database url to use the async driver of the database."""
+    url = sqlalchemy.engine.make_url(db_url)
+    backend = url.get_backend_name()
+    if url.get_driver_name() in _async_drivers.values():
+        return db_url
+    if backend not in _async_drivers:
+        raise ValueError(f"No async driver for database type {backend}")
+    return url.set(drivername=f"{backend}+{_async_drivers[backend]}").render_as_string(
+        hide_password=False
+    )
+
+
+def _async_method(name: str):
+    method = getattr(SqlClient, name)
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, session: AsyncSession = None, **kwargs):
+        return await self.run_sync(method, *args, session=session, **kwargs)
+
+    return wrapper
+
+
+class AsyncSqlClient:
+    """Async SQL database client, same CRUD methods as SqlClient (awaitable).
+
+    The database calls run on the SQLAlchemy asyncio engine (aiosqlite, asyncmy,
+    asyncpg drivers), so they do not block the event loop. The CRUD logic is shared
+    with SqlClient (run with AsyncSession.run_sync).
+
+    Example:
+        client = AsyncSqlClient("sqlite:///data/sql.db")
+        async with client.get_db_session() as session:
+            resp = await client.get_user("guest", session=session)
+
+    Args:
+        db_url: The database url (sync or async driver), see SqlClient for the
+            pool args.
+    """
+
+    def __init__(
+        self,
+        db_url: str,
+        verbose: bool = False,
+        pool_size: int = None,
+        max_overflow: int = None,
+        pool_recycle: int = None,
+        pool_pre_ping: bool = False,
+        sqlite_wal: bool = False,
+    ):
+        self.db_url = to_async_url(db_url)
+        engine_args, use_wal = engine_options(
+            self.db_url, verbose, pool_size, max_overflow, pool_recycle, pool_pre_ping
+        )
+        self.engine = create_async_engine(self.db_url, **engine_args)
+        if sqlite_wal and use_wal:
+            sqlalchemy.event.listen(self.engine.sync_engine, "connect", set_sqlite_wal)
+        self._session_maker = async_sessionmaker(bind=self.engine)
+        # the sync client CRUD methods run with the sync view of the async sessions
+        self._sync_client = SqlClient(self.db_url, engine=self.engine.sync_engine)
+
+    def get_db_session(self, session: AsyncSession = None) -> AsyncSession:
+        return session or self._session_maker()
+
+    async def create_tables(self, drop_old: bool = False, names: list = None):
+        tables = None
+        if names:
+            tables = [Base.metadata.tables[name] for name in names]
+        async with self.engine.begin() as conn:
+            if drop_old:
+                await conn.run_sync(Base.metadata.drop_all, tables=tables)
+            await conn.run_sync(
+                Base.metadata.create_all, tables=tables, checkfirst=True
+            )
+
+    async def run_sync(self, method, *args, session: AsyncSession = None, **kwargs):
+        """Run a SqlClient method with the (sync view of the) async session."""
+
+        def run(sync_session):
+            return method(self._sync_client, *args, session=sync_session, **kwargs)
+
+        if session is not None:
+            return await session.run_sync(run)
+        async with self._session_maker() as session:
+            return await session.run_sync(run)
+
+    async def close(self):
+        await self.engine.dispose()
+
+    get_user = _async_method("get_user")
+    create_user = _async_method("create_user")
+    update_user = _async_method("update_user")
+    delete_user = _async_method("delete_user")
+    list_users = _async_method("list_users")
+
+    get_collection = _async_method("get_collection")
+    create_collection = _async_method("create_collection")
+    update_collection = _async_method("update_collection")
+    delete_collection = _async_method("delete_collection")
+    list_collections = _async_method("list_collections")
+
+    get_document = _async_method("get_document")
+    create_document = _async_method("create_document")
+    update_document = _async_method("update_document")
+    delete_document = _async_method("delete_document")
+    list_documents = _async_method("list_documents")
+
+    get_session = _async_method("get_session")
+    create_session = _async_method("create_session")
+    update_session = _async_method("update_session")
+    delete_session = _async_method("delete_session")
+    list_sessions = _async_method("list_sessions")
+    append_messages = _async_method("append_messages")
+    get_messages = _async_method("get_messages")
+    count_messages = _async_method("count_messages")
+    migrate_sessions_history = _async_method("migrate_sessions_history")
+
+
+async_client = AsyncSqlClient(
+    config.sql_connection_str,
+    verbose=config.verbose,
+    pool_size=config.db_pool_size,
+    max_overflow=config.db_max_overflow,
+    pool_recycle=config.db_pool_recycle,
+    pool_pre_ping=config.db_pool_pre_ping,
+    sqlite_wal=config.db_sqlite_wal,
+)
@@ -22,6 +22,13 @@ class CtrlConfig(BaseModel):
     log_level: str = "DEBUG"
     # SQL Database
     sql_connection_str: str = default_db_path
+    # SQL engine connection pool (size, overflow, recycle seconds, check connections
+    # before use), and SQLite write-ahead logging (concurrent readers and writer)
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_recycle: int = 3600
+    db_pool_pre_ping: bool = True
+    db_sqlite_wal: bool = True
 
     def print(self):
         print(yaml.dump(self.dict()))
@@ -0,0 +1,185 @@
+"""Controller database schema migrations.
+
+The migrations are applied in order and recorded in the schema_migrations table, so
+new tables and indexes can be rolled out to an existing (production) database
+without recreating it. To change the schema, update the sqldb tables and append a
+migration with the next revision number (never edit an applied migration).
+
+Example:
+    python -m llmapps.main migrate
+"""
+
+import datetime
+from typing import Callable, List
+
+import sqlalchemy
+
+from .config import logger
+from .sqldb import Base, Document, SchemaMigration
+
+
+class Migration:
+    """A schema migration step.
+
+    Args:
+        revision: The (ordered) revision id, e.g. "0003".
+        description: Short description of the change.
+        upgrade: A function which applies the change, called with a connection.
+    """
+
+    def __init__(self, revision: str, description: str, upgrade: Callable):
+        self.revision = revision
+        self.description = description
+        self.upgrade = upgrade
+
+    def __repr__(self):
+        return f"Migration({self.revision}: {self.description})"
+
+
+def create_tables(*names: str):
+    """Migration step which creates the tables (and their indexes) if missing."""
+
+    def upgrade(conn):
+        tables = [Base.metadata.tables[name] for name in names]
+        Base.metadata.create_all(conn, tables=tables, checkfirst=True)
+
+    return upgrade
+
+
+def create_indexes(*names: str):
+    """Migration step which creates the (sqldb defined) indexes if missing."""
+
+    def upgrade(conn):
+        indexes = {
+            index.name: index
+            for table in Base.metadata.tables.values()
+            for index in table.indexes
+        }
+        for name in names:
+            indexes[name].create(conn, checkfirst=True)
+
+    return upgrade
+
+
+def convert_documents_table(conn):
+    """Convert a documents table of the original schema (doc_uid + version keys,
+    collection_name, title, doc_origin, num_chunks and meta columns) to the current
+    layout, the latest version of each document is kept."""
+    inspector = sqlalchemy.inspect(conn)
+    if not inspector.has_table("documents"):
+        return
+    columns = {column["name"] for column in inspector.get_columns("documents")}
+    if "doc_uid" not in columns:
+        return  # created with the current layout
+
+    rows = conn.exec_driver_sql("SELECT * FROM documents").mappings().all()
+    latest = {}
+    for row in sorted(rows, key=lambda row: row["last_update"] or ""):
+        latest[row["doc_uid"]] = row
+    # the labels table (if created) references the new layout, it has no rows
+    if inspector.has_table("documents_labels"):
+        conn.exec_driver_sql("DROP TABLE documents_labels")
+    conn.exec_driver_sql("DROP TABLE documents")
+    tables = [Document.__table__, Base.metadata.tables["documents_labels"]]
+    Base.metadata.create_all(conn, tables=tables)
+
+    values = [
+        {
+            "name": row["doc_uid"],
+            "description": row["title"],
+            "version": row["version"],
+            "collection": row["collection_name"],
+            "source": row["source"],
+            "created": _to_datetime(row["created_time"]),
+            "updated": _to_datetime(row["last_update"]),
+            "spec": {"origin": row["doc_origin"], "num_chunks": row["num_chunks"]},
+        }
+        for row in latest.values()
+    ]
+    if values:
+        conn.execute(sqlalchemy.insert(Document), values)
+    logger.info(f"Converted {len(values)} rows of the documents table")
+
+
+def _to_datetime(value):
+    # sqlite returns the raw (iso format) strings of the reflected columns
+    if isinstance(value, str):
+        return datetime.datetime.fromisoformat(value)
+    return value or datetime.datetime.utcnow()
+
+
+migrations = [
+    # runs first, the other tables (e.g. the documents labels) depend on the layout
+    Migration(
+        "0000",
+        "convert the original documents table",
+        convert_documents_table,
+    ),
+    Migration(
+        "0001",
+        "initial tables",
+        create_tables(
+            "users",
+            "users_labels",
+            "document_collections",
+            "document_collections_labels",
+            "session_context",
+            "session_context_labels",
+            "documents",
+            "documents_labels",
+            "prompts",
+        ),
+    ),
+    Migration("0002", "chat messages table", create_tables("session_messages")),
+    Migration(
+        "0003",
+        "indexes for the list, last session and documents queries",
+        create_indexes(
+            "idx_users_updated_name",
+            "idx_document_collections_updated_name",
+            "idx_session_context_username_updated",
+            "idx_session_context_updated_name",
+            "idx_documents_collection_source",
+        ),
+    ),
+]
+
+
+def applied_revisions(engine: sqlalchemy.engine.Engine) -> List[str]:
+    """The revisions already applied to the database."""
+    with engine.connect() as conn:
+        if not sqlalchemy.inspect(conn).has_table(SchemaMigration.__tablename__):
+            return []
+        rows = conn.execute(sqlalchemy.select(SchemaMigration.revision)).all()
+    return sorted(row[0] for row in rows)
+
+
+def pending_migrations(engine: sqlalchemy.engine.Engine) -> List[Migration]:
+    applied = set(applied_revisions(engine))
+    return [m for m in migrations if m.revision not in applied]
+
+
+def upgrade(engine: sqlalchemy.engine.Engine) -> List[Migration]:
+    """Apply the pending migrations (each in its own transaction)."""
+    pending = pending_migrations(engine)
+    if pending:
+        SchemaMigration.__table__.create(engine, checkfirst=True)
+    for migration in pending:
+        logger.info(f"Applying schema migration {migration}")
+        with engine.begin() as conn:
+            migration.upgrade(conn)
+            _record(conn, [migration])
+    return pending
+
+
+def _record(conn, applied: List[Migration]):
+    if not applied:
+        return
+    now = datetime.datetime.utcnow()
+    conn.execute(
+        sqlalchemy.insert(SchemaMigration),
+        [
+            {"revision": m.revision, "description": m.description, "applied": now}
+            for m in applied
+        ],
+    )
@@ -159,7 +159,7 @@ class DocCollection(BaseWithMetadata):
 
 
 class ChatSession(BaseWithMetadata):
-    _extra_fields = ["history", "features", "state", "agent_name"]
+    _extra_fields = ["history", "features", "state", "agent_name", "memory"]
     _top_level_fields = ["username"]
 
     username: Optional[str] = None
@@ -167,16 +167,21 @@ class ChatSession(BaseWithMetadata):
     history: Optional[List[Message]] = []
     features: Optional[dict[str, str]] = None
     state: Optional[dict[str, str]] = None
+    # conversation memory (rolling summary and token counts)
+    memory: Optional[dict] = None
 
     def to_conversation(self):
-        return Conversation.from_list(self.history)
+        return Conversation.from_list(self.history, self.memory)
 
 
 class Document(BaseWithVerMetadata):
+    _top_level_fields = ["collection", "source"]
+
     collection: str
     source: str
     origin: Optional[str] = None
     num_chunks: Optional[int] = None
+    content_hash: Optional[str] = None
 
 
 class OutputMode(str, Enum):
@@ -1,20 +1,62 @@
+import base64
 import datetime
+import json
 from typing import Union
 
 import sqlalchemy
 from sqlalchemy.orm import sessionmaker
 
-from llmapps.app.schema import ApiResponse
+from llmapps.app.schema import ApiResponse, Message
 
-from . import model
+from . import migrations, model
 from .config import config, logger
-from .sqldb import Base, ChatSessionContext, DocumentCollection, User
+from .model import metadata_fields
+from .sqldb import (
+    Base,
+    ChatMessage,
+    ChatSessionContext,
+    Document,
+    DocumentCollection,
+    User,
+)
+
+_labels_chunk_size = 500
 
 
 class SqlClient:
-    def __init__(self, db_url: str, verbose: bool = False):
+    """SQL database client (CRUD operations on the controller tables).
+
+    Args:
+        db_url: The SQLAlchemy database url.
+        verbose: Log the SQL statements.
+        pool_size: Number of connections kept in the pool (not for in-memory SQLite).
+        max_overflow: Max number of connections above pool_size.
+        pool_recycle: Replace pooled connections older than pool_recycle seconds.
+        pool_pre_ping: Check pooled connections are alive before use.
+        sqlite_wal: Use write-ahead logging in SQLite file databases.
+        engine: An existing engine (instead of creating one from the url).
+    """
+
+    def __init__(
+        self,
+        db_url: str,
+        verbose: bool = False,
+        pool_size: int = None,
+        max_overflow: int = None,
+        pool_recycle: int = None,
+        pool_pre_ping: bool = False,
+        sqlite_wal: bool = False,
+        engine: sqlalchemy.engine.Engine = None,
+    ):
         self.db_url = db_url
-        self.engine = sqlalchemy.create_engine(db_url, echo=verbose)
+        if engine is None:
+            engine_args, use_wal = engine_options(
+                db_url, verbose, pool_size, max_overflow, pool_recycle, pool_pre_ping
+            )
+            engine = sqlalchemy.create_engine(db_url, **engine_args)
+            if sqlite_wal and use_wal:
+                sqlalchemy.event.listen(engine, "connect", set_sqlite_wal)
+        self.engine = engine
         self._session_maker = sessionmaker(bind=self.engine)
         self._local_maker = sessionmaker(
             autocommit=False, autoflush=False, bind=self.engine
@@ -32,8 +74,22 @@ class SqlClient:
             tables = [Base.metadata.tables[name] for name in names]
         if drop_old:
             Base.metadata.drop_all(self.engine, tables=tables)
+        if not names:
+            # convert the old tables, add their missing indexes and record the
+            # migrations (before creating the tables which depend on them)
+            migrations.upgrade(self.engine)
         Base.metadata.create_all(self.engine, tables=tables, checkfirst=True)
 
+    def migrate(self, dry_run: bool = False):
+        """Apply the pending schema migrations (keeps the existing data)."""
+        if dry_run:
+            pending = migrations.pending_migrations(self.engine)
+        else:
+            pending = migrations.upgrade(self.engine)
+        return ApiResponse(
+            success=True, data=[f"{m.revision}: {m.description}" for m in pending]
+        )
+
     def _update(self, session: sqlalchemy.orm.Session, db_class, api_object, **kwargs):
         session = self.get_db_session(session)
         obj = session.query(db_class).filter_by(**kwargs).one_or_none()
@@ -101,12 +157,14 @@ class SqlClient:
         self,
         email: str = None,
         full_name: str = None,
-        labels_match: Union[list, str] = None,
+        labels_match: Union[list, dict, str] = None,
         output_mode: model.OutputMode = model.OutputMode.Details,
         session: sqlalchemy.orm.Session = None,
+        limit: int = None,
+        cursor: str = None,
     ):
         logger.debug(
-            f"Getting users: full_name~={full_name}, email={email}, mode={output_mode}"
+            f"Getting users: full_name~={full_name}, email={email}, labels_match={labels_match}, mode={output_mode}"
         )
         session = self.get_db_session(session)
         query = session.query(User)
@@ -114,8 +172,10 @@ class SqlClient:
             query = query.filter(User.email == email)
         if full_name:
             query = query.filter(User.full_name.like(f"%{full_name}%"))
-        data = _process_output(query.all(), model.User, output_mode)
-        return ApiResponse(success=True, data=data)
+        query = _filter_labels(query, User, labels_match)
+        return _list_output(
+            session, query, User, model.User, output_mode, limit, cursor
+        )
 
     def get_collection(self, name: str, session: sqlalchemy.orm.Session = None):
         logger.debug(f"Getting collection: name={name}")
@@ -143,9 +203,11 @@ class SqlClient:
     def list_collections(
         self,
         owner: str = None,
-        labels_match: Union[list, str] = None,
+        labels_match: Union[list, dict, str] = None,
         output_mode: model.OutputMode = model.OutputMode.Details,
         session: sqlalchemy.orm.Session = None,
+        limit: int = None,
+        cursor: str = None,
     ):
         logger.debug(
             f"Getting collections: owner={owner}, labels_match={labels_match}, mode={output_mode}"
@@ -154,29 +216,80 @@ class SqlClient:
         query = session.query(DocumentCollection)
         if owner:
             query = query.filter(DocumentCollection.owner_name == owner)
-        if labels_match:
-            pass
-        data = _process_output(query.all(), model.DocCollection, output_mode)
-        return ApiResponse(success=True, data=data)
+        query = _filter_labels(query, DocumentCollection, labels_match)
+        return _list_output(
+            session,
+            query,
+            DocumentCollection,
+            model.DocCollection,
+            output_mode,
+            limit,
+            cursor,
+        )
+
+    def get_document(self, doc_uid: str, session: sqlalchemy.orm.Session = None):
+        logger.debug(f"Getting document: doc_uid={doc_uid}")
+        return self._get(session, Document, model.Document, name=doc_uid)
+
+    def create_document(
+        self, document: model.Document, session: sqlalchemy.orm.Session = None
+    ):
+        logger.debug(f"Creating document: {document}")
+        return self._create(session, Document, document)
+
+    def update_document(
+        self, document: model.Document, session: sqlalchemy.orm.Session = None
+    ):
+        logger.debug(f"Updating document: {document}")
+        return self._update(session, Document, document, name=document.name)
+
+    def delete_document(self, doc_uid: str, session: sqlalchemy.orm.Session = None):
+        logger.debug(f"Deleting document: doc_uid={doc_uid}")
+        return self._delete(session, Document, name=doc_uid)
+
+    def list_documents(
+        self,
+        collection: str = None,
+        source: str = None,
+        output_mode: model.OutputMode = model.OutputMode.Details,
+        session: sqlalchemy.orm.Session = None,
+    ):
+        logger.debug(
+            f"Getting documents: collection={collection}, source={source}, mode={output_mode}"
+        )
+        session = self.get_db_session(session)
+        query = session.query(Document)
+        if collection:
+            query = query.filter(Document.collection == collection)
+        if source:
+            query = query.filter(Document.source == source)
+        return _list_output(session, query, Document, model.Document, output_mode)
 
     def get_session(
         self,
         session_id: str,
         username: str = None,
         session: sqlalchemy.orm.Session = None,
+        with_history: bool = True,
     ):
         logger.debug(
             f"Getting chat session: session_id={session_id}, username={username}"
         )
+        session = self.get_db_session(session)
         if session_id:
-            return self._get(
+            resp = self._get(
                 session, ChatSessionContext, model.ChatSession, name=session_id
             )
+            if resp.success and with_history:
+                self._add_history(resp.data, session)
+            return resp
         elif username:
             # get the last session for the user
             resp = self.list_sessions(username=username, last=1, session=session)
             if resp.success:
                 data = resp.data[0] if resp.data else None
+                if data and with_history:
+                    self._add_history(data, session)
                 return ApiResponse(success=True, data=data)
             return resp
         else:
@@ -202,6 +315,103 @@ class SqlClient:
         logger.debug(f"Deleting chat session: session_id={session_id}")
         return self._delete(session, ChatSessionContext, name=session_id)
 
+    def _add_history(
+        self, chat_session: model.ChatSession, session: sqlalchemy.orm.Session
+    ):
+        # messages saved in the session spec (before the messages table) come first
+        messages = self.get_messages(chat_session.name, session=session).data
+        chat_session.history = (chat_session.history or []) + messages
+
+    def append_messages(
+        self,
+        session_id: str,
+        messages: list,
+        start_index: int = None,
+        session: sqlalchemy.orm.Session = None,
+    ):
+        """Append messages to the chat session history (without rewriting it).
+
+        Args:
+            session_id: The chat session id.
+            messages: A list of Message objects.
+            start_index: The conversation index of the first message (default to the
+                current number of messages).
+            session: The SQL db session.
+        """
+        logger.debug(f"Appending {len(messages)} messages to session: {session_id}")
+        session = self.get_db_session(session)
+        obj = session.query(ChatSessionContext).filter_by(name=session_id).one_or_none()
+        if obj is None:
+            return ApiResponse(
+                success=False, error=f"chat session {session_id} not found"
+            )
+        self._migrate_history(obj, session)
+        if start_index is None:
+            start_index = obj.messages.count()
+        for i, message in enumerate(messages):
+            session.add(_message_to_row(session_id, start_index + i, message))
+        obj.updated = datetime.datetime.utcnow()
+        try:
+            session.commit()
+        except sqlalchemy.exc.IntegrityError:
+            session.rollback()
+            return ApiResponse(
+                success=False,
+                error=f"messages from index {start_index} already exist in session {session_id}",
+            )
+        return ApiResponse(success=True)
+
+    def get_messages(
+        self,
+        session_id: str,
+        start: int = 0,
+        limit: int = None,
+        last: int = None,
+        session: sqlalchemy.orm.Session = None,
+    ):
+        """Get a page (start, limit) or the tail (last n) of the session messages."""
+        session = self.get_db_session(session)
+        query = session.query(ChatMessage).filter(ChatMessage.session == session_id)
+        if last:
+            rows = query.order_by(ChatMessage.index.desc()).limit(last).all()[::-1]
+        else:
+            if start:
+                query = query.filter(ChatMessage.index >= start)
+            query = query.order_by(ChatMessage.index)
+            if limit:
+                query = query.limit(limit)
+            rows = query.all()
+        return ApiResponse(success=True, data=[_row_to_message(row) for row in rows])
+
+    def count_messages(self, session_id: str, session: sqlalchemy.orm.Session = None):
+        session = self.get_db_session(session)
+        return (
+            session.query(ChatMessage).filter(ChatMessage.session == session_id).count()
+        )
+
+    def _migrate_history(self, obj: ChatSessionContext, session):
+        # move the history saved in the session spec into the messages table
+        history = (obj.spec or {}).get("history")
+        if not history:
+            return 0
+        offset = obj.messages.count()
+        for i, message in enumerate(history):
+            message = Message.parse_obj(message)
+            session.add(_message_to_row(obj.name, offset + i, message))
+        del obj.spec["history"]
+        return len(history)
+
+    def migrate_sessions_history(self, session: sqlalchemy.orm.Session = None):
+        """Move the history of all the sessions into the messages table."""
+        session = self.get_db_session(session)
+        migrated = 0
+        for obj in session.query(ChatSessionContext):
+            if self._migrate_history(obj, session):
+                migrated += 1
+                session.commit()
+        logger.info(f"Migrated the history of {migrated} chat sessions")
+        return ApiResponse(success=True, data={"migrated_sessions": migrated})
+
     def list_sessions(
         self,
         username: str = None,
@@ -209,9 +419,12 @@ class SqlClient:
         last=0,
         output_mode: model.OutputMode = model.OutputMode.Details,
         session: sqlalchemy.orm.Session = None,
+        labels_match: Union[list, dict, str] = None,
+        limit: int = None,
+        cursor: str = None,
     ):
         logger.debug(
-            f"Getting chat sessions: username={username}, created>{created_after}, last={last}, mode={output_mode}"
+            f"Getting chat sessions: username={username}, created>{created_after}, last={last}, labels_match={labels_match}, mode={output_mode}"
         )
         session = self.get_db_session(session)
         query = session.query(ChatSessionContext)
@@ -223,11 +436,81 @@ class SqlClient:
                     created_after, "%Y-%m-%d %H:%M"
                 )
             query = query.filter(ChatSessionContext.created >= created_after)
-        query = query.order_by(ChatSessionContext.updated.desc())
-        if last > 0:
-            query = query.limit(last)
-        data = _process_output(query.all(), model.ChatSession, output_mode)
-        return ApiResponse(success=True, data=data)
+        query = _filter_labels(query, ChatSessionContext, labels_match)
+        return _list_output(
+            session,
+            query,
+            ChatSessionContext,
+            model.ChatSession,
+            output_mode,
+            limit or last or None,
+            cursor,
+        )
+
+    def iter_pages(self, list_method, page_size: int = 100, **kwargs):
+        """Iterate over the pages of a list method (e.g. list_sessions).
+
+        The pages are fetched with the keyset cursor, so the memory use does not
+        depend on the table size.
+
+        Example:
+            for page in client.iter_pages(client.list_sessions, username="yh"):
+                print(page)
+        """
+        cursor = None
+        while True:
+            resp = list_method(limit=page_size, cursor=cursor, **kwargs).with_raise()
+            if resp.data:
+                yield resp.data
+            cursor = resp.next_cursor
+            if not cursor:
+                break
+
+
+def engine_options(
+    db_url: str,
+    verbose: bool = False,
+    pool_size: int = None,
+    max_overflow: int = None,
+    pool_recycle: int = None,
+    pool_pre_ping: bool = False,
+):
+    """Return the engine kwargs and whether the db supports WAL (SQLite file)."""
+    url = sqlalchemy.engine.make_url(db_url)
+    is_sqlite = url.get_backend_name() == "sqlite"
+    in_memory = is_sqlite and url.database in (None, "", ":memory:")
+    engine_args = {"echo": verbose, "pool_pre_ping": pool_pre_ping}
+    if not in_memory:
+        # in-memory SQLite uses a single connection per thread
+        if pool_size is not None:
+            engine_args["pool_size"] = pool_size
+        if max_overflow is not None:
+            engine_args["max_overflow"] = max_overflow
+    if pool_recycle is not None:
+        engine_args["pool_recycle"] = pool_recycle
+    return engine_args, is_sqlite and not in_memory
+
+
+def set_sqlite_wal(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+def _message_to_row(session_id: str, index: int, message: Message) -> ChatMessage:
+    spec = message.dict(exclude={"role", "content"}, exclude_none=True)
+    return ChatMessage(
+        session=session_id,
+        index=index,
+        role=message.role.value,
+        content=message.content,
+        spec=spec,
+    )
+
+
+def _row_to_message(row: ChatMessage) -> Message:
+    return Message(role=row.role, content=row.content, **(row.spec or {}))
 
 
 def _dict_to_object(cls, d):
@@ -236,16 +519,163 @@ def _dict_to_object(cls, d):
     return d
 
 
-def _process_output(
-    items, obj_class, mode: model.OutputMode = model.OutputMode.Details
-):
-    if mode == model.OutputMode.Names:
-        return [item.name for item in items]
-    items = [obj_class.from_orm_object(item) for item in items]
-    if mode == model.OutputMode.Details:
-        return items
-    short = mode == model.OutputMode.Short
-    return [item.to_dict(short=short) for item in items]
+def _list_output(
+    session: sqlalchemy.orm.Session,
+    query,
+    db_class,
+    obj_class,
+    mode: model.OutputMode = model.OutputMode.Details,
+    limit: int = None,
+    cursor: str = None,
+) -> ApiResponse:
+    """Run a list query and return the output (page) in the requested mode.
+
+    The items are ordered by (updated, name) descending. With a limit, the response
+    next_cursor is set when there are more items, pass it as the cursor to get the
+    next page (keyset pagination, no offset scans).
+
+    Only the columns needed for the output mode are selected (no ORM objects), the
+    labels are loaded in bulk (one query per 500 rows) and the output dicts are
+    built directly from the rows (no pydantic round trip for the dict modes).
+    """
+    mode = model.OutputMode(mode)
+    if cursor:
+        try:
+            updated, name = decode_cursor(cursor)
+        except ValueError as exc:
+            return ApiResponse(success=False, error=str(exc))
+        query = query.filter(
+            sqlalchemy.or_(
+                db_class.updated < updated,
+                sqlalchemy.and_(db_class.updated == updated, db_class.name < name),
+            )
+        )
+    query = query.order_by(db_class.updated.desc(), db_class.name.desc())
+    if limit:
+        # fetch one more row to know if there is a next page
+        query = query.limit(limit + 1)
 
+    short = mode == model.OutputMode.Short
+    if mode == model.OutputMode.Names:
+        columns = [db_class.name, db_class.updated]
+    else:
+        columns = list(db_class.__table__.columns)
+        if short and _short_without_spec(obj_class):
+            # e.g. the session history, state, etc. are not needed for a short list
+            columns = [column for column in columns if column.name != "spec"]
+    rows = [dict(row._mapping) for row in query.with_entities(*columns)]
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["updated"], rows[-1]["name"])
+    if mode == model.OutputMode.Names:
+        return ApiResponse(
+            success=True, data=[row["name"] for row in rows], next_cursor=next_cursor
+        )
 
-client = SqlClient(config.sql_connection_str, verbose=config.verbose)
+    labels = _get_labels(session, db_class, [row["name"] for row in rows])
+    items = []
+    for row in rows:
+        row.update(row.pop("spec", None) or {})
+        if row["name"] in labels:
+            row["labels"] = labels[row["name"]]
+        if mode == model.OutputMode.Details:
+            items.append(obj_class.from_dict(row))
+        else:
+            items.append(_row_to_dict(row, obj_class, short))
+    return ApiResponse(success=True, data=items, next_cursor=next_cursor)
+
+
+def encode_cursor(updated: datetime.datetime, name: str) -> str:
+    """Encode the last item (updated, name) as an opaque page cursor."""
+    value = json.dumps([updated.isoformat(), name])
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        updated, name = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.datetime.fromisoformat(updated), name
+    except (ValueError, TypeError) as exc:
+        raise ValueError(f"Invalid page cursor: {cursor}") from exc
+
+
+def _parse_labels_match(labels_match) -> list:
+    # {"name": "value"}, [("name", "value")], ["name=value", "name"] or "name=value"
+    if isinstance(labels_match, dict):
+        return list(labels_match.items())
+    if isinstance(labels_match, str):
+        labels_match = [labels_match]
+    labels = []
+    for label in labels_match:
+        if isinstance(label, str):
+            name, _, value = label.partition("=")
+            labels.append((name.strip(), value.strip() if value else None))
+        else:
+            name, value = label
+            labels.append((name, value))
+    return labels
+
+
+def _filter_labels(query, db_class, labels_match):
+    """Filter by labels (all must match), a None value matches any label value."""
+    if not labels_match:
+        return query
+    label_class = db_class.Label
+    for name, value in _parse_labels_match(labels_match):
+        # EXISTS sub-queries, use the labels (name, value) index
+        if value is None:
+            query = query.filter(db_class.labels.any(label_class.name == name))
+        else:
+            query = query.filter(
+                db_class.labels.any(
+                    sqlalchemy.and_(
+                        label_class.name == name, label_class.value == value
+                    )
+                )
+            )
+    return query
+
+
+def _short_without_spec(obj_class) -> bool:
+    # the fields saved in the spec are all omitted from the short output
+    spec_fields = set(obj_class.__fields__) - set(
+        metadata_fields + obj_class._top_level_fields
+    )
+    return spec_fields.issubset(obj_class._extra_fields)
+
+
+def _get_labels(session: sqlalchemy.orm.Session, db_class, names: list) -> dict:
+    label_class = db_class.Label
+    labels = {}
+    for i in range(0, len(names), _labels_chunk_size):
+        query = session.query(
+            label_class.parent, label_class.name, label_class.value
+        ).filter(label_class.parent.in_(names[i : i + _labels_chunk_size]))
+        for parent, name, value in query:
+            labels.setdefault(parent, {})[name] = value
+    return labels
+
+
+def _row_to_dict(row: dict, obj_class, short: bool = False) -> dict:
+    # same as obj_class.from_dict(row).to_dict(short=short), without the model
+    struct = {}
+    for name, field in obj_class.__fields__.items():
+        value = row[name] if name in row else field.get_default()
+        if value is None or (short and name in obj_class._extra_fields):
+            continue
+        if short and isinstance(value, datetime.datetime):
+            value = value.strftime("%Y-%m-%d %H:%M")
+        struct[name] = value
+    return struct
+
+
+client = SqlClient(
+    config.sql_connection_str,
+    verbose=config.verbose,
+    pool_size=config.db_pool_size,
+    max_overflow=config.db_max_overflow,
+    pool_recycle=config.db_pool_recycle,
+    pool_pre_ping=config.db_pool_pre_ping,
+    sqlite_wal=config.db_sqlite_wal,
+)
@@ -9,6 +9,7 @@ from sqlalchemy import (
     Index,
     Integer,
     String,
+    Text,
     UniqueConstraint,
 )
 from sqlalchemy.ext.mutable import MutableDict
@@ -47,6 +48,7 @@ def update_labels(obj, labels: dict):
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (Index("idx_users_updated_name", "updated", "name"),)
 
     name = Column(String(255), primary_key=True, nullable=False)
     email = Column(String(255), nullable=False, unique=True)
@@ -68,6 +70,11 @@ class ChatSessionContext(Base):
     """Chat session context table CRUD"""
 
     __tablename__ = "session_context"
+    __table_args__ = (
+        # list (keyset pagination) and get the last sessions of a user
+        Index("idx_session_context_username_updated", "username", "updated", "name"),
+        Index("idx_session_context_updated_name", "updated", "name"),
+    )
 
     name = Column(String(255), primary_key=True, nullable=False)
     description = Column(String(255), nullable=True, default="")
@@ -85,10 +92,33 @@ class ChatSessionContext(Base):
 
     # Define the relationship with the 'Users' table
     user = relationship(User)
+    messages = relationship("ChatMessage", cascade="all, delete-orphan", lazy="dynamic")
+
+
+class ChatMessage(Base):
+    """Chat session messages table (append only, one row per message)"""
+
+    __tablename__ = "session_messages"
+    __table_args__ = (
+        UniqueConstraint("session", "index", name="_session_messages_uc"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    session = Column(
+        String(255), ForeignKey("session_context.name"), nullable=False, index=True
+    )
+    index = Column(Integer, nullable=False)  # position in the conversation
+    role = Column(String(255), nullable=False)
+    content = Column(Text, nullable=True)
+    created = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+    spec = Column(JSON, nullable=True)  # sources, rating, token count, ..
 
 
 class DocumentCollection(Base):
     __tablename__ = "document_collections"
+    __table_args__ = (
+        Index("idx_document_collections_updated_name", "updated", "name"),
+    )
 
     name = Column(String(255), primary_key=True, nullable=False)
     description = Column(String(255), nullable=True, default="")
@@ -108,48 +138,38 @@ class DocumentCollection(Base):
 
 
 class Document(Base):
+    """Ingested documents (sources) table, used for incremental ingestion"""
+
     __tablename__ = "documents"
-    _details_fields = ["doc_origin", "meta"]
+    __table_args__ = (Index("idx_documents_collection_source", "collection", "source"),)
 
-    doc_uid = Column(String(255), primary_key=True, nullable=False)
-    version = Column(String(255), primary_key=True, nullable=False)
-    collection_name = Column(
+    name = Column(String(255), primary_key=True, nullable=False)  # doc_uid
+    description = Column(String(255), nullable=True, default="")
+    version = Column(String(255), nullable=True)
+    collection = Column(
         String(255), sqlalchemy.ForeignKey("document_collections.name"), nullable=False
     )
-    title = Column(String(255), nullable=True)
     source = Column(String(255), nullable=True)
-    doc_origin = Column(String(255), nullable=True)
-    num_chunks = Column(Integer, nullable=True)
-    created_time = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
-    last_update = Column(
+    created = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+    updated = Column(
         DateTime,
         default=datetime.datetime.utcnow,
         onupdate=datetime.datetime.utcnow,
         nullable=False,
     )
-    meta = Column(JSON, nullable=True)
+    spec = Column(MutableDict.as_mutable(JSON), nullable=True)
+    Label = make_label(__tablename__)
+    labels = relationship(Label, cascade="all, delete-orphan")
 
-    collection = relationship(DocumentCollection)
 
-    def __init__(
-        self,
-        doc_uid,
-        version,
-        collection_name,
-        title,
-        source,
-        doc_origin=None,
-        num_chunks=None,
-        meta=None,
-    ):
-        self.doc_uid = doc_uid
-        self.version = version
-        self.collection_name = collection_name
-        self.title = title
-        self.source = source
-        self.doc_origin = doc_origin
-        self.num_chunks = num_chunks
-        self.meta = meta
+class SchemaMigration(Base):
+    """Applied schema migrations (see migrations.py)"""
+
+    __tablename__ = "schema_migrations"
+
+    revision = Column(String(255), primary_key=True, nullable=False)
+    description = Column(String(255), nullable=True)
+    applied = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
 
 
 class Prompt(Base):
@@ -7,7 +7,8 @@ from tabulate import tabulate
 
 import llmapps.controller.model as model
 from llmapps.app.config import config
-from llmapps.app.data.doc_loader import get_data_loader, get_loader_obj
+from llmapps.app.data.doc_loader import WEB_LOADERS, get_data_loader, get_loader_obj
+from llmapps.app.filters import parse_literal
 from llmapps.app.pipelines import app_server
 from llmapps.controller.sqlclient import client
 
@@ -22,10 +23,14 @@ def cli():
 
 # click command for initializing the database tables
 @click.command()
-def initdb():
-    """Initialize the database (delete old tables)"""
+@click.option("--drop", is_flag=True, help="delete the old tables (and data)")
+def initdb(drop):
+    """Initialize the database (create or migrate the tables)"""
     click.echo("Running Init DB")
-    client.create_tables(True)
+    if drop:
+        client.create_tables(True)
+    else:
+        client.migrate().with_raise()
     session = client.get_db_session()
     # create a guest user, and the defualt document collection
     client.create_user(
@@ -44,6 +49,28 @@ def initdb():
     session.close()
 
 
+@click.command("migrate")
+@click.option("--dry-run", is_flag=True, help="only print the pending migrations")
+def migrate(dry_run):
+    """Apply the pending database schema migrations"""
+    resp = client.migrate(dry_run=dry_run).with_raise()
+    action = "Pending" if dry_run else "Applied"
+    click.echo(f"{action} {len(resp.data)} migrations")
+    for migration in resp.data:
+        click.echo(f"  {migration}")
+
+
+@click.command("migrate-history")
+def migrate_history():
+    """Move the chat sessions history into the messages table"""
+    click.echo("Migrating chat sessions history")
+    client.migrate().with_raise()
+    session = client.get_db_session()
+    resp = client.migrate_sessions_history(session=session).with_raise()
+    session.close()
+    click.echo(f"Migrated {resp.data['migrated_sessions']} sessions")
+
+
 @click.command("config")
 def print_config():
     """Print the config as a yaml file"""
@@ -62,24 +89,91 @@ def print_config():
 @click.option(
     "-f", "--from-file", is_flag=True, help="Take the document paths from the file"
 )
-def ingest(path, loader, metadata, version, collection, from_file):
+@click.option(
+    "-b", "--bulk", is_flag=True, help="Use the batched (bulk) ingestion pipeline"
+)
+@click.option("--batch-size", type=int, help="Chunks per batch in bulk mode")
+@click.option(
+    "-w",
+    "--workers",
+    type=int,
+    help="Parse the files (from file) in parallel using N processes",
+)
+@click.option(
+    "--validators-path",
+    type=str,
+    help="Web pages ETag/Last-Modified file, unchanged pages are skipped",
+)
+def ingest(
+    path,
+    loader,
+    metadata,
+    version,
+    collection,
+    from_file,
+    bulk,
+    batch_size,
+    workers,
+    validators_path,
+):
     """Ingest documents into the vector database"""
     data_loader = get_data_loader(config, collection_name=collection)
+    validators_path = validators_path or config.web_validators_path
     if from_file:
         with open(path, "r") as fp:
             lines = fp.readlines()
-        for line in lines:
-            path = line.strip()
-            click.echo(f"Using loader: {loader}")
-            if path and not path.startswith("#"):
-                click.echo(f"Loading from path: {path}")
-                loader_obj = get_loader_obj(path, loader_type=loader)
+        click.echo(f"Using loader: {loader}")
+        paths = [line.strip() for line in lines]
+        paths = [path for path in paths if path and not path.startswith("#")]
+        if workers and loader not in WEB_LOADERS:
+            click.echo(f"Parsing {len(paths)} files using {workers} processes")
+            stats = data_loader.load_files(
+                paths,
+                loader_type=loader,
+                metadata=metadata,
+                version=version,
+                workers=workers,
+                batch_size=batch_size,
+            )
+            for failed_path, error in stats.failures.items():
+                click.echo(f"Failed to ingest {failed_path}: {error}")
+            click.echo(f"Parallel ingestion: {stats}")
+            return
+        if loader in WEB_LOADERS:
+            # web loaders fetch all the urls concurrently
+            click.echo(f"Loading {len(paths)} urls")
+            paths = [paths]
+        loader_objs = []
+        for path in paths:
+            click.echo(f"Loading from path: {path}")
+            loader_obj = get_loader_obj(
+                path, loader_type=loader, validators_path=validators_path
+            )
+            if bulk:
+                loader_objs.append(loader_obj)
+            else:
                 data_loader.load(loader_obj, metadata=metadata, version=version)
-
+        if bulk:
+            stats = data_loader.load_bulk(
+                loader_objs, metadata=metadata, version=version, batch_size=batch_size
+            )
+            click.echo(f"Bulk ingestion: {stats}")
+
+    elif bulk:
+        loader_obj = get_loader_obj(
+            path, loader_type=loader, validators_path=validators_path
+        )
+        stats = data_loader.load_bulk(
+            loader_obj, metadata=metadata, version=version, batch_size=batch_size
+        )
+        click.echo(f"Bulk ingestion: {stats}")
     else:
-        loader_obj = get_loader_obj(path, loader_type=loader)
-        data_loader.load(loader_obj, metadata=metadata, version=version)
+        loader_obj = get_loader_obj(
+            path, loader_type=loader, validators_path=validators_path
+        )
         click.echo(f"Running Data Ingestion from: {path} with loader: {loader}")
+        stats = data_loader.load(loader_obj, metadata=metadata, version=version)
+        click.echo(f"Ingestion: {stats}")
 
 
 @click.command()
@@ -89,7 +183,8 @@ def ingest(path, loader, metadata, version, collection, from_file):
     "--filter",
     type=(str, str),
     multiple=True,
-    help="Search filter Key value pair",
+    help="Search filter key value pair, numbers and true/false values are typed "
+    "(repeat a key to match any of its values)",
 )
 @click.option("-c", "--collection", type=str, help="Vector DB collection name")
 @click.option("-u", "--user", type=str, help="Username")
@@ -102,7 +197,6 @@ def query(question, filter, collection, user, verbose, session, pipeline_name):
     """Run a chat quary on the vector database collection"""
     click.echo(f"Running Query for: {question}")
 
-    search_args = {"filter": dict(filter)} if filter else {}
     app_server.verbose = verbose or config.verbose
     app_server.add_pipeline("default", pipe_graph)
 
@@ -111,6 +205,7 @@ def query(question, filter, collection, user, verbose, session, pipeline_name):
         "session_id": session,
         "query": question,
         "collection_name": collection,
+        "filter": [(key, parse_literal(value)) for key, value in filter] or None,
     }
     result = app_server.run_pipeline(pipeline_name, event)
     click.echo(result["answer"])
@@ -132,13 +227,23 @@ def update():
 @click.command("users")
 @click.option("-u", "--user", type=str, help="user name filter")
 @click.option("-e", "--email", type=str, help="email filter")
-def list_users(user, email):
+@click.option(
+    "-l", "--labels", multiple=True, help="labels filter (name=value or name)"
+)
+@click.option("-p", "--page-size", type=int, default=100, help="rows per page")
+def list_users(user, email, labels, page_size):
     """List users"""
     click.echo("Running List Users")
 
-    data = client.list_users(email, user, output_mode="short").with_raise()
-    table = format_table_results(data.data)
-    click.echo(table)
+    pages = client.iter_pages(
+        client.list_users,
+        page_size,
+        email=email,
+        full_name=user,
+        labels_match=labels,
+        output_mode="short",
+    )
+    echo_pages(pages)
 
 
 # add a command to list document collections, similar to the list users command
@@ -147,13 +252,19 @@ def list_users(user, email):
 @click.option(
     "-m", "--metadata", type=(str, str), multiple=True, help="metadata filter"
 )
-def list_collections(owner, metadata):
+@click.option("-p", "--page-size", type=int, default=100, help="rows per page")
+def list_collections(owner, metadata, page_size):
     """List document collections"""
     click.echo("Running List Collections")
 
-    data = client.list_collections(owner, metadata, output_mode="short").with_raise()
-    table = format_table_results(data.data)
-    click.echo(table)
+    pages = client.iter_pages(
+        client.list_collections,
+        page_size,
+        owner=owner,
+        labels_match=metadata,
+        output_mode="short",
+    )
+    echo_pages(pages)
 
 
 @click.command("collection")
@@ -164,31 +275,44 @@ def list_collections(owner, metadata):
 @click.option(
     "-l", "--labels", multiple=True, default=[], help="metadata labels filter"
 )
-def update_collection(name, owner, description, category, labels):
+@click.option(
+    "-a",
+    "--db-args",
+    multiple=True,
+    default=[],
+    help="vector store args (name=value), e.g. quantization=int8",
+)
+def update_collection(name, owner, description, category, labels, db_args):
     """Create or update a document collection"""
     click.echo("Running Create or Update Collection")
     labels = fill_params(labels)
+    db_args = fill_params(db_args)
 
     session = client.get_db_session()
     # check if the collection exists, if it does, update it, otherwise create it
     collection_exists = client.get_collection(name, session=session).success
     if collection_exists:
         client.update_collection(
-            session,
             model.DocCollection(
-                name=name, description=description, category=category, labels=labels
+                name=name,
+                description=description,
+                category=category,
+                labels=labels,
+                db_args=db_args,
             ),
+            session=session,
         ).with_raise()
     else:
         client.create_collection(
-            session,
             model.DocCollection(
                 name=name,
                 description=description,
                 owner_name=owner,
                 category=category,
                 labels=labels,
+                db_args=db_args,
             ),
+            session=session,
         ).with_raise()
 
 
@@ -197,19 +321,39 @@ def update_collection(name, owner, description, category, labels):
 @click.option("-u", "--user", type=str, help="user name filter")
 @click.option("-l", "--last", type=int, default=0, help="last n sessions")
 @click.option("-c", "--created", type=str, help="created after date")
-def list_sessions(user, last, created):
+@click.option("--labels", multiple=True, help="labels filter (name=value or name)")
+@click.option("-p", "--page-size", type=int, default=100, help="rows per page")
+def list_sessions(user, last, created, labels, page_size):
     """List chat sessions"""
     click.echo("Running List Sessions")
 
-    data = client.list_sessions(user, created, last, output_mode="short").with_raise()
-    table = format_table_results(data.data)
-    click.echo(table)
+    if last:
+        data = client.list_sessions(
+            user, created, last, output_mode="short", labels_match=labels
+        ).with_raise()
+        click.echo(format_table_results(data.data))
+        return
+    pages = client.iter_pages(
+        client.list_sessions,
+        page_size,
+        username=user,
+        created_after=created,
+        labels_match=labels,
+        output_mode="short",
+    )
+    echo_pages(pages)
 
 
 def format_table_results(table_results, short=True):
     return tabulate(table_results, headers="keys", tablefmt="fancy_grid")
 
 
+def echo_pages(pages):
+    # print every page when fetched, the memory does not grow with the table size
+    for page in pages:
+        click.echo(format_table_results(page))
+
+
 def fill_params(params, params_dict=None):
     params_dict = params_dict or {}
     for param in params:
@@ -228,6 +372,8 @@ def fill_params(params, params_dict=None):
 cli.add_command(ingest)
 cli.add_command(query)
 cli.add_command(initdb)
+cli.add_command(migrate)
+cli.add_command(migrate_history)
 cli.add_command(print_config)
 
 cli.add_command(list)
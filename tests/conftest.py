@@ -0,0 +1,20 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+
+class HashEmbeddings:
+    """Deterministic (hash seeded) random vectors per text."""
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        seed = int(hashlib.md5(text.encode()).hexdigest()[:8], 16)
+        return np.random.default_rng(seed).normal(size=16).tolist()
+
+
+@pytest.fixture
+def embeddings():
+    return HashEmbeddings()
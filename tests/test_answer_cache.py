@@ -0,0 +1,70 @@
+import time
+
+from llmapps.app.answer_cache import AnswerCache, invalidate_answers
+
+
+def test_answer_cache():
+    cache = AnswerCache(max_size=2, ttl=0, threshold=0.9)
+    assert cache.get("docs", [1.0, 0.0]) is None, "expected a miss on empty cache"
+
+    cache.put("docs", [1.0, 0.0], "what is x?", "x is y", ["src1"])
+    assert cache.get("docs", [0.99, 0.05]) == ("x is y", ["src1"]), "expected hit"
+    assert cache.get("docs", [0.0, 1.0]) is None, "expected miss on different query"
+    assert cache.get("other", [1.0, 0.0]) is None, "expected miss on other collection"
+    assert cache.get("docs", [1.0, 0.0], {"a": 1}) is None, "expected filter miss"
+
+    cache.put("docs", [0.0, 1.0], "q2", "a2", [])
+    cache.get("docs", [1.0, 0.0])  # make the first entry the most recently used
+    cache.put("docs", [0.7, 0.7], "q3", "a3", [])
+    assert cache.evictions == 1, "expected an LRU eviction"
+    assert cache.get("docs", [0.0, 1.0]) is None, "expected q2 to be evicted"
+    assert cache.get("docs", [1.0, 0.0]) is not None, "expected q1 to be kept"
+
+    stats = cache.stats()
+    assert stats["hits"] == 3 and stats["misses"] == 5, f"unexpected stats {stats}"
+
+    cache.invalidate("docs")
+    assert len(cache) == 0, "expected an empty cache after invalidation"
+
+
+def test_answer_cache_ttl():
+    cache = AnswerCache(max_size=4, ttl=0.05)
+    cache.put("docs", [1.0, 0.0], "q", "a", [])
+    assert cache.get("docs", [1.0, 0.0]) is not None, "expected a hit"
+    time.sleep(0.06)
+    assert cache.get("docs", [1.0, 0.0]) is None, "expected the entry to expire"
+    assert len(cache) == 0, "expected no valid entries"
+
+
+def test_answer_cache_clear():
+    cache = AnswerCache(max_size=4, ttl=0)
+    cache.put("docs", [1.0, 0.0], "q", "a", [])
+    cache.put("other", [0.0, 1.0], "q2", "a2", [])
+    cache.invalidate("other")
+    assert len(cache) == 1 and cache.invalidations == 1, "expected one invalidated"
+
+    # a new embedding model (dimension), the old vectors are dropped
+    cache.put("docs", [1.0, 0.0, 0.0], "q3", "a3", [])
+    assert len(cache) == 1, "expected the old entries dropped"
+    assert cache.get("docs", [1.0, 0.0, 0.0]) == ("a3", [])
+
+    cache.clear()
+    assert len(cache) == 0 and cache.get("docs", [1.0, 0.0, 0.0]) is None
+    cache.put("docs", [1.0, 0.0], "q", "a", [])
+    assert cache.get("docs", [1.0, 0.0]) == ("a", []), "expected a hit after clear"
+
+
+def test_answer_cache_versions(tmp_path):
+    cache = AnswerCache(max_size=4, ttl=0, versions_path=str(tmp_path))
+    cache.put("docs", [1.0, 0.0], "q", "a", [])
+    cache.put("other", [1.0, 0.0], "q", "a2", [])
+
+    # re-ingested by another process (no answer cache in that process)
+    invalidate_answers("docs", str(tmp_path))
+    assert cache.get("docs", [1.0, 0.0]) is None, "expected the stale answer dropped"
+    assert cache.get("other", [1.0, 0.0]) == ("a2", []), "expected other kept"
+    cache.put("docs", [1.0, 0.0], "q", "a3", [])
+    assert cache.get("docs", [1.0, 0.0]) == ("a3", []), "expected the new answer"
+
+    invalidate_answers(None, str(tmp_path))
+    assert cache.get("other", [1.0, 0.0]) is None, "expected all answers dropped"
@@ -0,0 +1,87 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain.llms.fake import FakeListLLM
+
+from llmapps.app.chains.base import ChainRunner, run_blocking
+from llmapps.app.config import AppConfig
+from llmapps.app.schema import PipelineEvent
+
+
+class BlockingStep(ChainRunner):
+    """A sync step, records the thread it ran in."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.threads = []
+
+    def _run(self, event: PipelineEvent):
+        self.threads.append(threading.current_thread())
+        return {"blocking": event.query.upper()}
+
+
+class AnswerStep(ChainRunner):
+    """An async (native) step, answers with the LLM."""
+
+    def __init__(self, llm=None, **kwargs):
+        super().__init__(**kwargs)
+        self.llm = llm
+
+    async def _run(self, event: PipelineEvent):
+        answer = await self.llm.apredict(event.results["blocking"])
+        return {"answer": answer, "sources": []}
+
+
+class FakeContext:
+    _config = AppConfig()
+
+    def __init__(self, executor):
+        self.executor = executor
+
+
+def test_run_blocking():
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline")
+    step = BlockingStep()
+    step.context = FakeContext(executor)
+
+    async def run():
+        event = PipelineEvent(query="q")
+        resp = await step.arun(event)
+        value = await run_blocking(step.context, threading.current_thread)
+        return resp, value, threading.current_thread()
+
+    resp, thread, loop_thread = asyncio.run(run())
+    assert resp == step(PipelineEvent(query="q")) == {"blocking": "Q"}
+    assert step.threads[0] is not loop_thread, "expected the step off the loop"
+    assert thread.name.startswith("pipeline"), "expected the pipelines executor"
+    executor.shutdown()
+
+
+def test_arun_pipeline():
+    pytest.importorskip("mlrun")
+    from llmapps.app.pipelines import AppServer
+
+    config = AppConfig(session_store={"class_name": "memory"}, pipeline_workers=2)
+    server = AppServer(config)
+    blocking = BlockingStep()
+    llm = FakeListLLM(responses=["the answer"])
+    server.add_pipeline("default", [blocking, AnswerStep(llm=llm)])
+    event = {"query": "what is x?", "username": "yh", "session_id": "s1"}
+
+    async def run():
+        results = await asyncio.gather(
+            *[server.arun_pipeline("default", dict(event)) for _ in range(4)]
+        )
+        return results, threading.current_thread()
+
+    results, loop_thread = asyncio.run(run())
+    assert len(blocking.threads) == 4
+    assert loop_thread not in blocking.threads, "expected the blocking step off loop"
+    assert all(t.name.startswith("pipeline") for t in blocking.threads)
+
+    expected = server.run_pipeline("default", dict(event))
+    for resp in results:
+        assert resp.success and resp.data == expected.data, "expected sync results"
+    assert expected.data["answer"] == "the answer"
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llmapps.app.client import AsyncClient, Client
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """Fake API server, the first request to .../flaky returns 503."""
+
+    protocol_version = "HTTP/1.1"  # keep-alive
+    connections = set()
+    flaky_calls = 0
+
+    def do_GET(self):
+        ApiHandler.connections.add(self.client_address)
+        if self.path.endswith("/flaky"):
+            ApiHandler.flaky_calls += 1
+            if ApiHandler.flaky_calls == 1:
+                return self._reply(503, {})
+        self._reply(200, {"success": True, "data": [self.path]})
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        body = json.loads(self.rfile.read(length))
+        data = {"answer": body["question"], "sources": [], "returned_state": {}}
+        self._reply(200, {"success": True, "data": data})
+
+    def _reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ApiHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def test_client():
+    server, url = start_server()
+    ApiHandler.connections.clear()
+    with Client(url, backoff_factor=0.01) as client:
+        for _ in range(5):
+            data = client.list_sessions(username="yh", labels={"a": "b"})
+        assert data == ["/api/sessions?username=yh&labels=a%3Db"], data
+        assert len(ApiHandler.connections) == 1, "expected a keep-alive connection"
+
+        assert client.get_session("flaky") == ["/api/session/flaky"], "expected retry"
+        assert ApiHandler.flaky_calls == 2
+        answer, _, _ = client.run_pipeline(None, "hello", "default")
+        assert answer == "hello"
+    server.shutdown()
+
+
+def test_async_client():
+    server, url = start_server()
+
+    async def run():
+        async with AsyncClient(url, pool_maxsize=4) as client:
+            results = await asyncio.gather(
+                *[client.run_pipeline(None, f"q{i}", "default") for i in range(20)]
+            )
+            sessions = await client.list_sessions(username="yh", last=2)
+        return results, sessions
+
+    results, sessions = asyncio.run(run())
+    assert [answer for answer, _, _ in results] == [f"q{i}" for i in range(20)]
+    assert sessions == ["/api/sessions?username=yh&last=2"], sessions
+    server.shutdown()
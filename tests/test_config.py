@@ -0,0 +1,59 @@
+import threading
+
+from llmapps.app.config import ObjectCache
+
+
+def test_object_cache():
+    cache = ObjectCache(max_size=2)
+    created = []
+
+    def factory(name):
+        def create():
+            created.append(name)
+            return object()
+
+        return create
+
+    obj1 = cache.get_or_create("llm", {"a": 1, "b": 2}, factory("x"))
+    obj2 = cache.get_or_create("llm", {"b": 2, "a": 1}, factory("x"))
+    assert obj1 is obj2, "expected same object for the same (normalized) args"
+    assert len(created) == 1, "expected a single object creation"
+
+    cache.get_or_create("llm", {"a": 2}, factory("y"))
+    cache.get_or_create("embeddings", {"a": 2}, factory("z"))
+    assert len(cache) == 2, "expected LRU eviction down to max_size"
+    obj3 = cache.get_or_create("llm", {"a": 1, "b": 2}, factory("x"))
+    assert obj3 is not obj1, "expected the evicted object to be re-created"
+
+    cache.invalidate("embeddings")
+    assert len(cache) == 1, "expected one object left after invalidation"
+
+    # stateful objects are not evicted (and not counted)
+    store = cache.get_or_create("vector_store", {"a": 1}, factory("s"))
+    for i in range(3):
+        cache.get_or_create("llm", {"i": i}, factory("x"))
+    assert len(cache) == 3, "expected the vector store kept over max_size"
+    assert cache.get_or_create("vector_store", {"a": 1}, factory("s")) is store
+    cache.invalidate()
+    assert len(cache) == 0, "expected an empty cache"
+
+
+def test_object_cache_threads():
+    cache = ObjectCache()
+    created = []
+    results = []
+
+    def create():
+        created.append(1)
+        return object()
+
+    def worker():
+        results.append(cache.get_or_create("embeddings", {"m": "x"}, create))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(created) == 1, "expected the object to be created once"
+    assert all(r is results[0] for r in results), "expected a shared object"
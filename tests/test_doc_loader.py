@@ -0,0 +1,164 @@
+from langchain_core.documents import Document
+
+import llmapps.app.data.doc_loader as doc_loader
+from llmapps.app.config import AppConfig
+from llmapps.app.data.doc_loader import DataLoader
+from llmapps.controller.model import DocCollection
+from llmapps.controller.sqlclient import SqlClient
+
+
+class FakeEmbeddings:
+    def __init__(self):
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+class FakeVectorStore:
+    def __init__(self):
+        self.embeddings = FakeEmbeddings()
+        self.rows = []
+        self.inserts = 0
+
+    def add_embeddings(self, text_embeddings, metadatas=None, ids=None):
+        self.inserts += 1
+        ids = ids or [str(len(self.rows) + i) for i in range(len(metadatas))]
+        # like Milvus, existing ids are not replaced
+        for (text, embedding), metadata, id in zip(text_embeddings, metadatas, ids):
+            self.rows.append((text, embedding, metadata, id))
+
+    def add_documents(self, documents, ids=None):
+        self.add_embeddings(
+            [(doc.page_content, None) for doc in documents],
+            [doc.metadata for doc in documents],
+            ids,
+        )
+
+    def delete(self, ids):
+        ids = set(ids)
+        self.rows = [row for row in self.rows if row[3] not in ids]
+
+
+class FakeLoader:
+    def __init__(self, num_docs, text="document"):
+        self.num_docs = num_docs
+        self.text = text
+
+    def load(self):
+        return [
+            Document(page_content=f"{self.text} {i} " * 50, metadata={"source": str(i)})
+            for i in range(self.num_docs)
+        ]
+
+
+def test_load_bulk():
+    config = AppConfig(chunk_size=100, chunk_overlap=0, ingest_queue_size=2)
+    vector_store = FakeVectorStore()
+    data_loader = DataLoader(config, vector_store=vector_store)
+    stats = data_loader.load_bulk(
+        [FakeLoader(5), FakeLoader(3)], metadata=[("a", "b")], batch_size=16
+    )
+    assert stats.documents == stats.sources == 8, "expected 8 documents"
+    assert stats.skipped == 0 and stats.elapsed > 0
+    assert stats.chunks_per_second > 0
+    assert stats.chunks == len(vector_store.rows), "expected all chunks inserted"
+    assert stats.batches == vector_store.inserts == vector_store.embeddings.calls
+    assert stats.batches == -(-stats.chunks // 16), "expected full batches of 16"
+    assert vector_store.rows[0][2]["a"] == "b", "expected metadata on chunks"
+
+
+def test_load_bulk_error():
+    class BadLoader:
+        def load(self):
+            raise ValueError("bad document")
+
+    class CommitLoader(FakeLoader):
+        committed = False
+
+        def commit(self):
+            self.committed = True
+
+    data_loader = DataLoader(AppConfig(), vector_store=FakeVectorStore())
+    loader = CommitLoader(2)
+    try:
+        data_loader.load_bulk([loader, BadLoader()])
+    except ValueError as exc:
+        assert str(exc) == "bad document"
+    else:
+        assert False, "expected the parsing error to propagate"
+    assert not loader.committed, "expected no commit of a failed ingestion"
+    data_loader.load_bulk([loader])
+    assert loader.committed, "expected the loader committed after ingestion"
+
+
+def _tracking_loader(monkeypatch, db_url, vector_store, versions_path=None):
+    client = SqlClient(db_url)
+    client.create_tables(True)
+    client.create_collection(DocCollection(name="docs"))
+    monkeypatch.setattr(doc_loader, "client", client)
+    config = AppConfig(
+        chunk_size=100, chunk_overlap=0, answer_cache_versions_path=versions_path
+    )
+    return client, DataLoader(config, vector_store=vector_store, collection_name="docs")
+
+
+def test_incremental_load(monkeypatch, tmp_path):
+    vector_store = FakeVectorStore()
+    client, data_loader = _tracking_loader(
+        monkeypatch, f"sqlite:///{tmp_path}/sql.db", vector_store, str(tmp_path)
+    )
+    stats = data_loader.load(FakeLoader(3))
+    assert (tmp_path / "docs.version").exists(), "expected the answers invalidated"
+    num_rows = len(vector_store.rows)
+    assert stats.sources == 3 and stats.skipped == 0
+    documents = client.list_documents(collection="docs").data
+    assert len(documents) == 3, "expected a documents record per source"
+    assert sum(doc.num_chunks for doc in documents) == num_rows
+
+    stats = data_loader.load(FakeLoader(3))
+    assert stats.skipped == 3, "expected unchanged sources to be skipped"
+    assert len(vector_store.rows) == num_rows, "expected no duplicate chunks"
+
+    # change the content, old chunks should be replaced (also in bulk mode)
+    stats = data_loader.load_bulk(FakeLoader(3, text="changed document"))
+    assert stats.skipped == 0, "expected changed sources to be re-ingested"
+    assert all("changed" in row[0] for row in vector_store.rows)
+    assert len({row[3] for row in vector_store.rows}) == len(vector_store.rows)
+    documents = client.list_documents(collection="docs").data
+    assert sum(doc.num_chunks for doc in documents) == len(vector_store.rows)
+    assert {doc.version for doc in documents} == {"2"}, "expected a version bump"
+
+    # fewer chunks, the remaining old chunks are deleted after the insert
+    num_rows = len(vector_store.rows)
+    data_loader.load_bulk(FakeLoader(3, text="new"))
+    assert len(vector_store.rows) < num_rows, "expected the old chunks deleted"
+    assert not any("changed" in row[0] for row in vector_store.rows)
+
+    # a changed source (non bulk), the old chunks are deleted
+    data_loader.load(FakeLoader(3, text="other"))
+    assert all("other" in row[0] for row in vector_store.rows)
+    documents = client.list_documents(collection="docs").data
+    assert sum(doc.num_chunks for doc in documents) == len(vector_store.rows)
+    documents = client.list_documents(collection="docs").data
+    assert sum(doc.num_chunks for doc in documents) == len(vector_store.rows)
+
+
+def test_load_files(tmp_path):
+    paths = []
+    for i in range(4):
+        path = tmp_path / f"doc{i}.txt"
+        path.write_text(f"text file {i} " * 40)
+        paths.append(str(path))
+    paths.append(str(tmp_path / "doc.unknown"))
+
+    vector_store = FakeVectorStore()
+    config = AppConfig(chunk_size=100, chunk_overlap=0)
+    data_loader = DataLoader(config, vector_store=vector_store)
+    stats = data_loader.load_files(paths, workers=2)
+    assert stats.sources == 4, "expected the 4 text files to be ingested"
+    assert stats.documents == 4 and stats.batches >= 1
+    assert list(stats.failures.keys()) == [paths[-1]], "expected one failed file"
+    assert set(stats.file_timings.keys()) == set(paths[:-1])
+    assert stats.chunks == len(vector_store.rows)
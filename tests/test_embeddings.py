@@ -0,0 +1,50 @@
+from llmapps.app.embeddings import CachedEmbeddings
+
+
+class FakeEmbeddings:
+    def __init__(self):
+        self.embedded = 0
+
+    def embed_documents(self, texts):
+        self.embedded += len(texts)
+        return [[float(len(text)), 0.5, -1.0] for text in texts]
+
+    def embed_query(self, text):
+        return [0.0, 0.0, 0.0]
+
+
+def test_cached_embeddings(tmp_path):
+    fake = FakeEmbeddings()
+    embeddings = CachedEmbeddings(fake, str(tmp_path), "fake-model")
+    texts = [f"text {i}" for i in range(10)]
+    vectors = embeddings.embed_documents(texts)
+    assert fake.embedded == 10, "expected all texts to be embedded"
+    assert not list(tmp_path.glob("*/index.npz")), "expected no save per batch"
+    embeddings.flush()  # at the end of an ingestion
+
+    # re-open the cache from disk (as in a new ingestion process)
+    embeddings = CachedEmbeddings(fake, str(tmp_path), "fake-model")
+    cached = embeddings.embed_documents(texts[:5] + ["new text"])
+    assert fake.embedded == 11, "expected only the new text to be embedded"
+    assert cached[:5] == vectors[:5], "expected the cached vectors"
+    stats = embeddings.stats()
+    assert stats["hits"] == 5 and stats["misses"] == 1
+    assert stats["rows"] == 11 and stats["hit_rate"] == 5 / 6
+
+    other = CachedEmbeddings(fake, str(tmp_path), "other-model")
+    other.embed_documents(texts[:2])
+    assert fake.embedded == 13, "expected the cache to be keyed by model name"
+
+
+def test_cached_embeddings_eviction(tmp_path):
+    fake = FakeEmbeddings()
+    embeddings = CachedEmbeddings(fake, str(tmp_path), "fake-model", max_rows=10)
+    embeddings.embed_documents([f"text {i}" for i in range(10)])
+    embeddings.embed_documents(["text 0"])  # mark as recently used
+    embeddings.embed_documents(["text 10", "text 11"])
+    stats = embeddings.stats()
+    assert stats["rows"] <= 10, "expected the size cap to be enforced"
+    assert stats["evictions"] > 0, "expected evictions"
+    fake.embedded = 0
+    embeddings.embed_documents(["text 0"])
+    assert fake.embedded == 0, "expected the recently used vector to be kept"
@@ -0,0 +1,107 @@
+import numpy as np
+from langchain.llms.fake import FakeListLLM
+from langchain_community.vectorstores import Milvus
+
+from llmapps.app.chains.retrieval import DocumentRetriever
+from llmapps.app.filters import (
+    MetadataIndex,
+    parse_filter,
+    parse_literal,
+    vector_search_kwargs,
+)
+from llmapps.app.schema import PipelineEvent
+from llmapps.app.sparse import BM25Index
+from llmapps.app.vectorstore import LocalVectorStore
+
+rows = [
+    {"service": "billing", "topic": "refund", "version": 1},
+    {"service": "billing", "topic": "invoice", "version": 2},
+    {"service": "auth", "topic": "sso", "version": 2},
+    {"service": "auth", "topic": "password", "version": 3},
+    {"service": "search"},
+]
+
+
+def test_filter_translation():
+    expr = parse_filter([("service", "billing"), ("topic", "a"), ("topic", "b")])
+    assert expr.to_chroma() == {
+        "$and": [{"service": {"$eq": "billing"}}, {"topic": {"$in": ["a", "b"]}}]
+    }
+    assert expr.to_milvus() == '(service == "billing" and topic in ["a", "b"])'
+    assert parse_filter({"service": "auth"}).to_chroma() == {"service": {"$eq": "auth"}}
+
+    expr = parse_filter(
+        {"$or": [{"version": {"$gte": 2, "$lt": 3}}, {"topic": {"$nin": ["x"]}}]}
+    )
+    assert expr.to_milvus() == '((version >= 2 and version < 3) or topic not in ["x"])'
+    assert parse_filter(None) is None and parse_filter([]) is None
+
+    class FakeMilvus(Milvus):
+        def __init__(self):
+            pass  # no connection
+
+    assert vector_search_kwargs(FakeMilvus(), {"a": True}) == {"expr": "a == true"}
+    values = [parse_literal(v) for v in ["2", "2.5", "true", "v2", "null", "[1]"]]
+    assert values == [2, 2.5, True, "v2", "null", "[1]"], values
+    expr = parse_filter([("version", parse_literal("2"))])
+    assert expr.to_milvus() == "version == 2", "expected an integer literal"
+    assert vector_search_kwargs(object(), [("a", "b")]) == {
+        "filter": {"a": {"$eq": "b"}}
+    }
+    for bad in ["service == 'a'", {"$not": {}}, {"a": {"$like": "b"}}, [("a",)]]:
+        try:
+            parse_filter(bad)
+        except ValueError:
+            pass
+        else:
+            assert False, f"expected a ValueError for {bad}"
+
+
+def test_metadata_index():
+    index = MetadataIndex()
+    for row, metadata in enumerate(rows):
+        index.add(row, metadata)
+
+    def matches(filter):
+        return np.flatnonzero(index.mask(filter, len(rows))).tolist()
+
+    assert matches({"service": "billing"}) == [0, 1]
+    assert matches([("topic", "sso"), ("topic", "refund")]) == [0, 2]
+    assert matches({"version": {"$gte": 2}}) == [1, 2, 3]
+    assert matches({"service": {"$ne": "auth"}}) == [0, 1, 4]
+    assert matches({"version": {"$ne": 2}}) == [0, 3], "expected missing keys skipped"
+    assert matches({"$or": [{"topic": "sso"}, {"service": "search"}]}) == [2, 4]
+    assert matches({"service": "auth", "version": {"$lt": 3}}) == [2]
+    assert matches({"unknown": 1}) == []
+    assert index.mask(None, len(rows)) is None
+
+
+def test_filtered_search(tmp_path, embeddings):
+    store = LocalVectorStore(embeddings, "docs", str(tmp_path))
+    texts = [f"text {i}" for i in range(len(rows))]
+    store.add_texts(texts, rows)
+    docs = store.similarity_search("text 0", k=5, filter={"version": {"$gte": 2}})
+    assert sorted(doc.page_content for doc in docs) == texts[1:4]
+
+    index = BM25Index(str(tmp_path / "bm25"))
+    index.add_documents(store.similarity_search("text", k=10))
+    docs = index.search("text", k=5, filter=[("service", "auth")])
+    assert sorted(doc.page_content for doc in docs) == texts[2:4]
+
+
+def test_retriever_filter(tmp_path, embeddings):
+    store = LocalVectorStore(embeddings, "docs", str(tmp_path))
+    store.add_texts([f"text {i}" for i in range(len(rows))], rows)
+    llm = FakeListLLM(responses=["answer\nSOURCES: 0, 1, 2, 3"] * 2)
+    retriever = DocumentRetriever(llm, store, k=4)
+
+    event = PipelineEvent(query="text", filter=[("service", "billing")])
+    sources = retriever.run(event)["sources"]
+    assert {doc.metadata["service"] for doc in sources} == {"billing"}
+    assert len(sources) == 2
+
+    # the per query filter is and-ed with the retriever filter
+    retriever = DocumentRetriever(llm, store, k=4, filter={"version": 2})
+    event = PipelineEvent(query="text", filter={"service": "auth"})
+    sources = retriever.run(event)["sources"]
+    assert [doc.page_content for doc in sources] == ["text 2"]
@@ -0,0 +1,56 @@
+from langchain.llms.fake import FakeListLLM
+
+from llmapps.app.memory import ConversationSummarizer
+from llmapps.app.schema import Conversation
+from llmapps.app.utils import count_tokens
+
+
+def make_conversation(turns: int) -> Conversation:
+    conversation = Conversation()
+    for i in range(turns):
+        conversation.add_message("Human", f"question number {i} " * 10)
+        conversation.add_message("AI", f"answer number {i} " * 10)
+    return conversation
+
+
+def test_conversation_prompt():
+    conversation = make_conversation(50)
+    assert conversation.tokens == sum(m.tokens for m in conversation.messages)
+
+    prompt = conversation.to_prompt(max_messages=4)
+    assert prompt.count("\n") == 3, "expected the last 4 messages"
+    assert "number 49" in prompt and "number 47" not in prompt
+
+    prompt = conversation.to_prompt(max_messages=20, max_tokens=200)
+    assert count_tokens(prompt) <= 200, "expected the prompt within the budget"
+    assert "answer number 49" in prompt, "expected the newest messages to be kept"
+
+    conversation.add_message("Human", "a long question " * 500)
+    prompt = conversation.to_prompt(max_messages=20, max_tokens=200)
+    assert count_tokens(prompt) <= 200, "expected the newest message truncated"
+    assert "a long question" in prompt and "\n" not in prompt
+
+
+def test_conversation_summarizer():
+    llm = FakeListLLM(responses=["summary 1", "summary 2"])
+    summarizer = ConversationSummarizer(llm, window=4, batch=4)
+
+    conversation = make_conversation(3)
+    assert not summarizer.update(conversation), "not enough messages to summarize"
+
+    conversation = make_conversation(4)
+    assert summarizer.update(conversation), "expected a summary update"
+    assert conversation.summarized == 4 and conversation.summary == "summary 1"
+    prompt = conversation.to_prompt(max_messages=8)
+    assert prompt.startswith("Summary: summary 1"), "expected the summary first"
+    assert "number 1 " not in prompt, "expected the summarized messages to be omitted"
+
+    conversation.add_message("Human", "q")
+    conversation.add_message("AI", "a")
+    assert not summarizer.update(conversation), "expected to wait for a full batch"
+
+    restored = Conversation.from_list(
+        conversation.to_list(), conversation.memory_state()
+    )
+    assert restored.summary == "summary 1" and restored.summarized == 4
+    assert restored.tokens == conversation.tokens
@@ -0,0 +1,59 @@
+import asyncio
+
+from langchain.llms.fake import FakeListLLM
+
+from llmapps.app.chains.refine import RefineQuery, is_standalone_question
+from llmapps.app.config import AppConfig
+from llmapps.app.schema import PipelineEvent
+
+
+class FakeContext:
+    _config = AppConfig(refine_skip_standalone=True)
+    executor = None
+
+
+def test_is_standalone_question():
+    assert is_standalone_question("How do I install milvus on kubernetes?")
+    assert not is_standalone_question("why?"), "short questions are follow-ups"
+    assert not is_standalone_question("and what about the python sdk?")
+    assert not is_standalone_question("how do I install it on linux?")
+
+    # questions which share content words with the last turn are follow-ups
+    history = "Use a development cluster, or a production cluster with replicas."
+    question = "How do I configure the second one for production use"
+    assert is_standalone_question(question)
+    assert not is_standalone_question(question, history)
+    history = "Run pip install mypkg to install the package."
+    assert not is_standalone_question(
+        "How do I install the package on windows", history
+    )
+    assert is_standalone_question("How do I reset my account password?", history)
+
+
+def test_refine_query_paths():
+    step = RefineQuery(llm=FakeListLLM(responses=["refined question"]))
+    step.context = FakeContext()
+    step.post_init()
+
+    event = PipelineEvent(query="why?")
+    assert asyncio.run(step.arun(event)) is None, "expected no refinement"
+
+    event.conversation.add_message("Human", "what is milvus?")
+    event.conversation.add_message("AI", "a vector database")
+    resp = asyncio.run(step.arun(event))
+    assert resp == {"answer": "refined question"}, f"unexpected response {resp}"
+
+    event.query = "How do I reset my account password?"
+    assert step._run(event) is None, "expected standalone question to be skipped"
+    event.query = "How do I install milvus on kubernetes?"
+    assert step._run(event) == {"answer": "refined question"}, "expected a follow-up"
+
+    stats = step.stats()
+    assert stats == {"no_history": 1, "refined": 2, "standalone": 1}, stats
+
+    # the standalone check is opt-in
+    step = RefineQuery(llm=FakeListLLM(responses=["refined question"]))
+    step.context = FakeContext()
+    step.context._config = AppConfig()
+    step.post_init()
+    assert step._run(event) == {"answer": "refined question"}, "expected refinement"
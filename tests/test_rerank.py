@@ -0,0 +1,82 @@
+from typing import List
+
+from langchain.llms.fake import FakeListLLM
+from langchain.schema import BaseRetriever, Document
+
+from llmapps.app.chains.retrieval import DocumentRetriever
+from llmapps.app.config import AppConfig, get_reranker
+from llmapps.app.rerank import LexicalReranker, RerankRetriever, RerankStatsHandler
+from llmapps.app.schema import PipelineEvent
+from llmapps.app.vectorstore import LocalVectorStore
+
+
+class ListRetriever(BaseRetriever):
+    documents: List[Document]
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        return self.documents
+
+
+faq = [
+    "Billing questions are answered by the support team on weekdays.",
+    "Error ERR-1042 means the upload quota was exceeded, delete old files.",
+    "Error ERR-1042 means the upload quota was exceeded, delete old files!",
+    "The X200-PRO router supports dual band wifi and mesh networking.",
+    "To fix error ERR-1042 upgrade the storage plan " + "or archive data " * 200,
+]
+
+
+def test_lexical_reranker():
+    reranker = LexicalReranker(cache_size=3)
+    scores = reranker.score("what is ERR-1042", faq[:4])
+    assert scores[1] > scores[0] and scores[1] > scores[3]
+    assert scores[0] == 0, "expected the stop words ignored"
+
+    assert reranker.score("what is ERR-1042", faq[1:3]) == scores[1:3]
+    assert reranker.hits == 2 and reranker.misses == 4
+    assert reranker.stats()["cached"] == 3, "expected the LRU entries evicted"
+
+    assert get_reranker(AppConfig()) is None
+    config = AppConfig(rerank=True, reranker={"class_name": "lexical"})
+    assert isinstance(get_reranker(config), LexicalReranker)
+
+
+def test_rerank_retriever():
+    documents = [Document(page_content=text) for text in faq]
+    retriever = RerankRetriever(
+        base_retriever=ListRetriever(documents=documents),
+        reranker=LexicalReranker(),
+        k=3,
+        max_tokens=100,
+    )
+    handler = RerankStatsHandler()
+    docs = retriever.get_relevant_documents("ERR-1042 quota", callbacks=[handler])
+    assert docs[0].page_content == faq[1], "expected the best match first"
+    assert faq[2] not in [doc.page_content for doc in docs], "expected dedupe"
+    assert faq[4] not in [doc.page_content for doc in docs], "expected over budget"
+    assert len(docs) == 3
+    stats = handler.stats
+    assert stats["candidates"] == 5 and stats["duplicates"] == 1
+    assert stats["documents"] == 3 and stats["tokens"] <= 100
+    assert stats["saved_tokens"] == stats["baseline_tokens"] - stats["tokens"] > 0
+
+
+def test_document_retriever_rerank(tmp_path, embeddings):
+    store = LocalVectorStore(embeddings, "faq", str(tmp_path))
+    store.add_texts(faq, [{"source": f"faq{i}"} for i in range(len(faq))])
+    llm = FakeListLLM(responses=["answer\nSOURCES: 0"])
+    retriever = DocumentRetriever(
+        llm,
+        store,
+        k=2,
+        reranker=LexicalReranker(),
+        rerank_fetch_k=5,
+        rerank_max_tokens=200,
+    )
+    results = retriever.run(PipelineEvent(query="ERR-1042 quota"))
+    # one of the duplicates is dropped (the first retrieved is kept)
+    assert results["sources"][0].metadata["source"] in ("faq1", "faq2")
+    stats = results["rerank"]
+    assert stats["candidates"] == 5 and stats["duplicates"] == 1
+    assert stats["documents"] == 2 and stats["tokens"] <= 200
+    assert stats["saved_tokens"] > 0
@@ -0,0 +1,50 @@
+import pytest
+
+from llmapps.app.config import AppConfig
+from llmapps.app.schema import PipelineEvent
+from llmapps.app.sessions import (
+    MemorySessionStore,
+    RedisSessionStore,
+    get_session_store,
+)
+
+
+def run_session_turns(store, turns=3):
+    for i in range(turns):
+        event = PipelineEvent(query=f"q{i}", username="yh", session_id="123")
+        store.read_state(event)
+        assert len(event.conversation.messages) == min(2 * i, 4), "expected window"
+        event.conversation.add_message("Human", f"q{i}")
+        event.conversation.add_message("AI", f"a{i}")
+        event.state = {"turn": str(i)}
+        store.save(event)
+
+    event = PipelineEvent(query="q", username="yh", session_id="123")
+    store.read_state(event)
+    assert event.state == {"turn": str(turns - 1)}, "expected the last state"
+    assert event.conversation.saved_index == 2 * turns, "expected all messages"
+    assert event.conversation.messages[-1].content == f"a{turns - 1}"
+
+
+def test_memory_session_store():
+    config = AppConfig(history_summarize=False, history_window=4)
+    run_session_turns(MemorySessionStore(config))
+
+
+def test_redis_session_store():
+    fakeredis = pytest.importorskip("fakeredis")
+    config = AppConfig(history_summarize=False, history_window=4)
+    # a redis.Redis client with an in process server (redis protocol commands)
+    client = fakeredis.FakeRedis(decode_responses=True)
+    store = RedisSessionStore(config, client=client, ttl=60)
+    run_session_turns(store)
+    assert client.llen("llmapps:session:123:messages") == 6
+    assert 0 < client.ttl("llmapps:session:123") <= 60, "expected ttl"
+    assert 0 < client.ttl("llmapps:session:123:messages") <= 60
+
+
+def test_get_session_store():
+    config = AppConfig(session_store={"class_name": "memory", "max_sessions": 10})
+    store = get_session_store(config)
+    assert isinstance(store, MemorySessionStore), "expected a memory store"
+    assert store.max_sessions == 10
@@ -0,0 +1,120 @@
+from langchain.schema import Document
+
+from llmapps.app.config import AppConfig
+from llmapps.app.data.doc_loader import DataLoader
+from llmapps.app.sparse import (
+    BM25Index,
+    HybridRetriever,
+    reciprocal_rank_fusion,
+    tokenize,
+)
+from llmapps.app.vectorstore import LocalVectorStore
+
+faq = [
+    "How do I reset my password? Use the account settings page.",
+    "Error ERR-1042 means the upload quota was exceeded.",
+    "The X200-PRO router supports dual band wifi.",
+    "Billing questions are answered by the support team.",
+    "Error ERR-2001 is returned when the session token expired.",
+]
+
+
+def _docs():
+    return [
+        Document(page_content=text, metadata={"doc_uid": f"d{i}", "chunk": 0})
+        for i, text in enumerate(faq)
+    ]
+
+
+def test_tokenize():
+    tokens = tokenize("Error ERR-1042, v2.3!")
+    assert sorted(tokens) == sorted(
+        ["error", "err", "1042", "err-1042", "v2", "3", "v2.3"]
+    )
+
+
+def test_bm25_index(tmp_path):
+    index = BM25Index(str(tmp_path / "faq"))
+    index.add_documents(_docs(), ids=[f"id{i}" for i in range(len(faq))])
+    docs = index.search("what is ERR-1042", k=2)
+    assert docs[0].page_content == faq[1], "expected the exact code match first"
+    assert index.search("x200-pro")[0].page_content == faq[2]
+    assert index.search("unrelated words") == []
+    assert index.search("error", filter={"doc_uid": "d4"})[0].page_content == faq[4]
+
+    index.delete(["id1"])
+    index.add_documents([Document(page_content="ERR-1042 is obsolete")], ["id5"])
+    # re-open from the log, and refresh when another instance writes
+    reopened = BM25Index(str(tmp_path / "faq"))
+    assert len(reopened) == len(index) == 5
+    assert reopened.search("ERR-1042")[0].page_content == "ERR-1042 is obsolete"
+    index.add_documents([Document(page_content="new X300 router")], ["id6"])
+    assert reopened.search("X300")[0].page_content == "new X300 router"
+
+    # snapshot the postings, and load the snapshot with the newer log records
+    reopened.save()
+    reopened.add_documents([Document(page_content="ERR-3003 is new")], ["id7"])
+    reopened.delete(["id0"])
+    index = BM25Index(str(tmp_path / "faq"))
+    assert len(index) == 6
+    assert index.search("ERR-3003")[0].page_content == "ERR-3003 is new"
+    assert index.search("X200-PRO router", k=1)[0].page_content == faq[2]
+    assert index.search("reset password") == [], "expected the deleted row removed"
+
+
+def test_bm25_index_writers(tmp_path):
+    path = tmp_path / "faq"
+    index, other = BM25Index(str(path)), BM25Index(str(path))
+    other.add_documents([Document(page_content="ERR-1042 quota")], ["o1"])
+    index.delete(["o1"])  # written by the other instance, loaded under the lock
+    assert len(BM25Index(str(path))) == 0, "expected the other rows deleted"
+
+    # a partial record (interrupted write) is truncated by the next write
+    with open(path / "postings.jsonl", "ab") as fp:
+        fp.write(b'{"id": "x", "te')
+    index.add_documents([Document(page_content="X200-PRO router")], ["i1"])
+    reopened = BM25Index(str(path))
+    assert len(reopened) == 1
+    assert reopened.search("x200-pro")[0].page_content == "X200-PRO router"
+
+
+def test_reciprocal_rank_fusion():
+    a, b, c = [Document(page_content=t) for t in "abc"]
+    assert reciprocal_rank_fusion([[a, b, c], [b, c]]) == [b, c, a]
+    fused = reciprocal_rank_fusion([[a, b, c], [c]], weights=[1.0, 3.0])
+    assert fused == [c, a, b], "expected the weighted list to dominate"
+
+    # the first chunks of two pages of a source (the chunk index is per page)
+    pages = [
+        Document(
+            page_content=f"page {i}",
+            metadata={"doc_uid": "d", "chunk": 0, "chunk_id": f"d-{i}"},
+        )
+        for i in range(2)
+    ]
+    fused = reciprocal_rank_fusion([pages, pages[1:]])
+    assert fused == [pages[1], pages[0]], "expected the chunks not merged"
+
+
+def test_hybrid_retriever(tmp_path, embeddings):
+    vector_store = LocalVectorStore(embeddings, "faq", str(tmp_path))
+    sparse_index = BM25Index(str(tmp_path / "bm25"))
+    config = AppConfig(chunk_size=1000, chunk_overlap=0)
+    data_loader = DataLoader(config, vector_store, sparse_index=sparse_index)
+    data_loader.load_bulk(_FaqLoader())
+    assert len(sparse_index) == len(vector_store) == len(faq)
+
+    retriever = HybridRetriever(
+        vector_store=vector_store, sparse_index=sparse_index, k=2, weights=[1.0, 2.0]
+    )
+    docs = retriever.get_relevant_documents("ERR-2001")
+    assert docs[0].page_content == faq[4], "expected the BM25 match first"
+    assert len(docs) == 2
+
+
+class _FaqLoader:
+    def load(self):
+        return [
+            Document(page_content=text, metadata={"source": f"faq{i}"})
+            for i, text in enumerate(faq)
+        ]
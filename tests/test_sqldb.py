@@ -1,5 +1,11 @@
 from llmapps.controller.sqlclient import SqlClient
+from llmapps.controller.asyncsqlclient import AsyncSqlClient
 from llmapps.controller.model import User, DocCollection, ChatSession
+from llmapps.app.schema import Message, PipelineEvent
+from llmapps.app.sessions import CachedSessionStore, SessionStore
+import asyncio
+import sqlalchemy
+import threading
 import yaml
 
 
@@ -122,6 +128,357 @@ def test_new_sessions_crud():
     session.close()
 
 
+def test_session_messages():
+    client = SqlClient("sqlite:///:memory:")
+    client.create_tables(True)
+    session = client.get_db_session()
+    client.create_user(User(name="yh", full_name="Yaron", email="x@y.z"), session=session)
+    # a session with history saved in the spec (before the messages table)
+    client.create_session(ChatSession(
+        name="123",
+        username="yh",
+        history=[{"role": "Human", "content": "q0"}, {"role": "AI", "content": "a0"}]
+    ), session=session)
+
+    store = SessionStore(client)
+    event = PipelineEvent(query="q1", username="yh", session_id="123")
+    store.read_state(event, db_session=session)
+    assert len(event.conversation.messages) == 2, "expected the old history"
+    event.conversation.add_message("Human", "q1")
+    event.conversation.add_message("AI", "a1")
+    store.save(event, db_session=session)
+
+    resp = client.get_session("123", session=session)
+    assert [m.content for m in resp.data.history] == ["q0", "a0", "q1", "a1"]
+    assert client.count_messages("123", session=session) == 4, "expected migration"
+
+    event = PipelineEvent(query="q2", username="yh", session_id="123")
+    store.read_state(event, db_session=session)
+    assert event.conversation.saved_index == 4, "expected 4 saved messages"
+    event.conversation.add_message("Human", "q2")
+    store.save(event, db_session=session)
+
+    resp = client.get_messages("123", last=2, session=session)
+    assert [m.content for m in resp.data] == ["a1", "q2"], "expected the tail"
+    resp = client.get_messages("123", start=1, limit=2, session=session)
+    assert [m.content for m in resp.data] == ["a0", "q1"], "expected a page"
+
+    resp = client.append_messages("123", [Message(role="AI", content="x")], start_index=1, session=session)
+    assert not resp.success, "expected a conflict on existing message index"
+
+    client.delete_session("123", session=session)
+    assert client.count_messages("123", session=session) == 0, "expected no messages"
+    session.close()
+
+
+def test_request_db_sessions(tmp_path):
+    client = SqlClient(f"sqlite:///{tmp_path}/test.db", pool_size=4, pool_pre_ping=True, sqlite_wal=True)
+    client.create_tables(True)
+    session = client.get_db_session()
+    client.create_user(User(name="yh", full_name="Yaron", email="x@y.z"), session=session)
+    session.close()
+    store = SessionStore(client)
+
+    def chat(session_id):
+        # each request uses its own db session (passed in the event)
+        db_session = client.get_local_session()
+        for i in range(3):
+            event = PipelineEvent(query="q", username="yh", session_id=session_id, db_session=db_session)
+            store.read_state(event)
+            event.conversation.add_message("Human", f"q{i}")
+            store.save(event)
+        db_session.close()
+
+    threads = [threading.Thread(target=chat, args=(str(i),)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    session = client.get_db_session()
+    counts = [client.count_messages(str(i), session=session) for i in range(4)]
+    assert counts == [3, 3, 3, 3], f"unexpected message counts {counts}"
+    session.close()
+
+
+def test_async_sql_client(tmp_path):
+    client = AsyncSqlClient(f"sqlite:///{tmp_path}/test.db", sqlite_wal=True)
+    store = SessionStore()
+
+    async def chat(session_id):
+        async with client.get_db_session() as db_session:
+            for i in range(3):
+                event = PipelineEvent(query="q", username="yh", session_id=session_id, db_session=db_session)
+                await store.aread_state(event)
+                event.conversation.add_message("Human", f"q{i}")
+                await store.asave(event)
+
+    async def run():
+        await client.create_tables(True)
+        async with client.get_db_session() as session:
+            resp = await client.create_user(User(name="yh", full_name="Yaron", email="x@y.z"), session=session)
+            assert resp.success, resp.error
+        await asyncio.gather(*[chat(str(i)) for i in range(4)])
+        async with client.get_db_session() as session:
+            counts = [await client.count_messages(str(i), session=session) for i in range(4)]
+            resp = await client.list_sessions("yh", session=session)
+        await client.close()
+        return counts, resp
+
+    counts, resp = asyncio.run(run())
+    assert counts == [3, 3, 3, 3], f"unexpected message counts {counts}"
+    assert len(resp.data) == 4, "expected 4 sessions"
+
+
+def test_list_output_modes(tmp_path):
+    client = SqlClient(f"sqlite:///{tmp_path}/test.db")
+    client.create_tables(True)
+    session = client.get_db_session()
+    client.create_user(User(name="yh", full_name="Yaron", email="x@y.z"), session=session)
+    for i in range(3):
+        collection = DocCollection(name=f"docs{i}", owner_name="yh", category="web", labels={"n": str(i)})
+        client.create_collection(collection, session=session)
+    client.create_session(ChatSession(name="123", username="yh", state={"a": "b"}), session=session)
+
+    names = client.list_collections(output_mode="names", session=session).data
+    assert sorted(names) == ["docs0", "docs1", "docs2"], f"unexpected names {names}"
+    details = client.list_collections(session=session).data
+    assert details[1].labels == {"n": "1"} and details[1].category == "web"
+    for mode in ["short", "dict"]:
+        expected = [item.to_dict(short=mode == "short") for item in details]
+        data = client.list_collections(output_mode=mode, session=session).data
+        assert data == expected, f"unexpected {mode} output {data}"
+
+    details = client.list_sessions("yh", session=session).data
+    short = client.list_sessions("yh", output_mode="short", session=session).data
+    assert short == [details[0].to_dict(short=True)], f"unexpected short output {short}"
+    assert "state" not in short[0], "expected the spec fields to be omitted"
+    session.close()
+
+
+def test_list_pagination(tmp_path):
+    client = SqlClient(f"sqlite:///{tmp_path}/test.db")
+    client.create_tables(True)
+    session = client.get_db_session()
+    client.create_user(User(name="yh", full_name="Yaron", email="x@y.z"), session=session)
+    for i in range(25):
+        labels = {"kind": "even" if i % 2 == 0 else "odd", "n": str(i)}
+        client.create_session(ChatSession(name=f"s{i:02}", username="yh", labels=labels), session=session)
+
+    resp = client.list_sessions("yh", output_mode="names", limit=10, session=session)
+    assert len(resp.data) == 10 and resp.next_cursor, "expected a page and a cursor"
+    pages = list(client.iter_pages(client.list_sessions, page_size=10, username="yh", output_mode="names", session=session))
+    assert [len(page) for page in pages] == [10, 10, 5], "expected 3 pages"
+    names = [name for page in pages for name in page]
+    assert names == client.list_sessions("yh", output_mode="names", session=session).data
+    assert sorted(names) == [f"s{i:02}" for i in range(25)], "expected all the sessions"
+
+    resp = client.list_sessions(labels_match=["kind=odd"], output_mode="names", session=session)
+    assert len(resp.data) == 12, f"expected 12 odd sessions, got {resp.data}"
+    resp = client.list_sessions(labels_match={"kind": "odd", "n": "3"}, output_mode="short", session=session)
+    assert [item["name"] for item in resp.data] == ["s03"], "expected all labels to match"
+    resp = client.list_sessions(labels_match="n", output_mode="names", session=session)
+    assert len(resp.data) == 25, "expected any value to match"
+    assert not client.list_sessions(cursor="bad", session=session).success, "expected bad cursor"
+    session.close()
+
+
+def test_schema_migrations(tmp_path):
+    client = SqlClient(f"sqlite:///{tmp_path}/test.db")
+    client.create_tables(True)
+    assert client.migrate(dry_run=True).data == [], "expected an up to date schema"
+
+    # simulate an old database (without the indexes and the migrations table)
+    session = client.get_db_session()
+    client.create_user(User(name="yh", full_name="Yaron", email="x@y.z"), session=session)
+    session.close()
+    with client.engine.begin() as conn:
+        conn.exec_driver_sql("DROP TABLE schema_migrations")
+        conn.exec_driver_sql("DROP TABLE session_messages")
+        conn.exec_driver_sql("DROP INDEX idx_session_context_username_updated")
+
+    assert len(client.migrate(dry_run=True).data) == 4, "expected 4 pending migrations"
+    client.migrate().with_raise()
+    inspector = sqlalchemy.inspect(client.engine)
+    indexes = [index["name"] for index in inspector.get_indexes("session_context")]
+    assert "idx_session_context_username_updated" in indexes, "expected the index"
+    assert inspector.has_table("session_messages"), "expected the messages table"
+    assert client.get_user("yh").success, "expected the data to be kept"
+    assert client.migrate().data == [], "expected no pending migrations"
+
+
+def test_migrate_original_documents_table(tmp_path):
+    client = SqlClient(f"sqlite:///{tmp_path}/test.db")
+    client.create_tables(True)
+    session = client.get_db_session()
+    client.create_collection(DocCollection(name="docs"), session=session)
+    session.close()
+    # the original schema: documents keyed by (doc_uid, version), no migrations table
+    with client.engine.begin() as conn:
+        for table in ["schema_migrations", "session_messages", "documents_labels", "documents"]:
+            conn.exec_driver_sql(f"DROP TABLE {table}")
+        conn.exec_driver_sql(
+            "CREATE TABLE documents (doc_uid VARCHAR(255) NOT NULL, version VARCHAR(255) NOT NULL, "
+            "collection_name VARCHAR(255) NOT NULL REFERENCES document_collections (name), "
+            "title VARCHAR(255), source VARCHAR(255), doc_origin VARCHAR(255), num_chunks INTEGER, "
+            "created_time DATETIME NOT NULL, last_update DATETIME NOT NULL, meta JSON, "
+            "PRIMARY KEY (doc_uid, version))"
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO documents VALUES "
+            "('d1', '1', 'docs', 'Doc', 'a.txt', 'file', 3, '2024-01-01 00:00:00', '2024-01-01 00:00:00', NULL), "
+            "('d1', '2', 'docs', 'Doc', 'a.txt', 'file', 4, '2024-01-01 00:00:00', '2024-02-01 00:00:00', NULL)"
+        )
+
+    client.migrate().with_raise()
+    inspector = sqlalchemy.inspect(client.engine)
+    indexes = [index["name"] for index in inspector.get_indexes("documents")]
+    assert "idx_documents_collection_source" in indexes, "expected the index"
+    docs = client.list_documents(collection="docs", source="a.txt").data
+    assert len(docs) == 1, "expected the latest version of the document"
+    assert docs[0].name == "d1" and docs[0].version == "2" and docs[0].num_chunks == 4
+    assert client.migrate().data == [], "expected no pending migrations"
+
+
+def test_cached_session_store(tmp_path):
+    client = SqlClient(f"sqlite:///{tmp_path}/test.db")
+    client.create_tables(True)
+    session = client.get_db_session()
+    client.create_user(User(name="yh", full_name="Yaron", email="x@y.z"), session=session)
+    journal_path = str(tmp_path / "journal.jsonl")
+    store = CachedSessionStore(client, flush_interval=60, journal_path=journal_path)
+
+    for i in range(2):
+        event = PipelineEvent(query=f"q{i}", username="yh", session_id="123")
+        store.read_state(event)
+        event.conversation.add_message("Human", f"q{i}")
+        event.conversation.add_message("AI", f"a{i}")
+        event.state = {"turn": str(i)}
+        store.save(event)
+    assert store.stats()["hit_rate"] == 0.5, "expected the 2nd read from the cache"
+    assert client.count_messages("123", session=session) == 0, "expected queued writes"
+
+    store.flush()
+    assert client.count_messages("123", session=session) == 4, "expected 4 messages"
+
+    event = PipelineEvent(query="q2", username="yh", session_id="123")
+    store.read_state(event)
+    event.conversation.add_message("Human", "q2")
+    store.save(event)
+    store._pending = {}  # simulate a crash, the write is only in the journal
+
+    store = CachedSessionStore(client, flush_interval=60, journal_path=journal_path)
+    assert client.count_messages("123", session=session) == 5, "expected replay"
+    store.close()
+    resp = client.get_session("123", session=session)
+    assert resp.data.state == {"turn": "1"}, "expected the last state"
+    assert [m.content for m in resp.data.history][-1] == "q2"
+    session.close()
+
+
+def test_cached_session_store_failures(tmp_path):
+    client = SqlClient(f"sqlite:///{tmp_path}/test.db")
+    client.create_tables(True)
+    client.create_user(User(name="yh", full_name="Yaron", email="x@y.z"))
+    journal_path = str(tmp_path / "journal.jsonl")
+    store = CachedSessionStore(client, flush_interval=60, journal_path=journal_path)
+
+    def save(session_id, text):
+        event = PipelineEvent(query=text, username="yh", session_id=session_id)
+        store.read_state(event)
+        event.conversation.add_message("Human", text)
+        store.save(event)
+
+    # the writes of a session fail (e.g. a db error), the other sessions are flushed
+    append_messages = client.append_messages
+
+    def failing_append(session_id, *args, **kwargs):
+        if session_id == "s1":
+            raise RuntimeError("db error")
+        return append_messages(session_id, *args, **kwargs)
+
+    client.append_messages = failing_append
+    save("s1", "q1")
+    save("s2", "q1")
+    store.flush()
+    assert client.count_messages("s2") == 1, "expected the s2 write flushed"
+    assert list(store._pending) == ["s1"], "expected the failed write re-queued"
+    save("s1", "q2")
+    client.append_messages = append_messages
+    store.flush()
+    assert [m.content for m in client.get_messages("s1").data] == ["q1", "q2"]
+
+    # a conflicting write (the messages exist) is dropped to the dead letter file
+    store._enqueue({"session_id": "s2", "start_index": 0, "state": None, "memory": None, "messages": [{"role": "Human", "content": "x"}]})
+    save("s1", "q3")
+    store.flush()
+    assert store.stats()["dropped"] == 1 and not store._pending
+    assert client.count_messages("s1") == 3, "expected the other writes flushed"
+    with open(journal_path + ".failed") as fp:
+        assert "already exist" in fp.read()
+    with open(journal_path) as fp:
+        assert fp.read() == "", "expected an empty journal"
+    store.close()
+
+
+def test_cached_session_store_replay(tmp_path):
+    client = SqlClient(f"sqlite:///{tmp_path}/test.db")
+    client.create_tables(True)
+    client.create_user(User(name="yh", full_name="Yaron", email="x@y.z"))
+    journal_path = str(tmp_path / "journal.jsonl")
+    store = CachedSessionStore(client, flush_interval=60, journal_path=journal_path)
+    for i in range(3):
+        event = PipelineEvent(query=f"q{i}", username="yh", session_id="s1")
+        store.read_state(event)
+        event.conversation.add_message("Human", f"q{i}")
+        event.conversation.add_message("AI", f"a{i}")
+        store.save(event)
+        if i == 1:
+            # crash after the flush and before the journal rewrite
+            with open(journal_path) as fp:
+                journal = fp.read()
+            store.flush()
+            with open(journal_path, "a") as fp:
+                fp.write(journal)
+    store._pending = {}  # crash, the first writes were flushed but are still journaled
+
+    store = CachedSessionStore(client, flush_interval=60, journal_path=journal_path)
+    assert store.stats()["dropped"] == 0, "expected no dropped writes"
+    contents = [m.content for m in client.get_messages("s1").data]
+    assert contents == ["q0", "a0", "q1", "a1", "q2", "a2"], "expected q2/a2 replayed"
+    store.close()
+
+
+def test_cached_session_store_async(tmp_path):
+    client = SqlClient(f"sqlite:///{tmp_path}/test.db", sqlite_wal=True)
+    client.create_tables(True)
+    client.create_user(User(name="yh", full_name="Yaron", email="x@y.z"))
+    async_client = AsyncSqlClient(f"sqlite:///{tmp_path}/test.db", sqlite_wal=True)
+    store = CachedSessionStore(client, flush_interval=60, journal_path=str(tmp_path / "journal.jsonl"))
+    threads = []
+    enqueue = store._enqueue
+
+    def recording_enqueue(write):
+        threads.append(threading.current_thread())
+        return enqueue(write)
+
+    store._enqueue = recording_enqueue
+
+    async def run():
+        async with async_client.get_db_session() as db_session:
+            for i in range(2):
+                event = PipelineEvent(query="q", username="yh", session_id="s1", db_session=db_session)
+                await store.aread_state(event)
+                event.conversation.add_message("Human", f"q{i}")
+                await store.asave(event)
+        await async_client.close()
+        return threading.current_thread()
+
+    loop_thread = asyncio.run(run())
+    assert len(threads) == 2 and loop_thread not in threads, "expected saves off the loop"
+    store.close()
+    assert [m.content for m in client.get_messages("s1").data] == ["q0", "q1"]
+
+
 def testt_users_crud():
     drop_tables()
     create_tables()
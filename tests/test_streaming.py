@@ -0,0 +1,121 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from langchain.llms.fake import FakeListLLM
+from langchain.schema import Generation, LLMResult
+
+from llmapps.app.client import AsyncClient, Client
+from llmapps.app.streaming import TokenStreamHandler, sse_frame
+
+answer_text = "Milvus is a vector database.\nSOURCES: 0, 1"
+
+
+class FakeTokensLLM(FakeListLLM):
+    """Streams the response a few characters at a time (split markers)."""
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        response = super()._call(prompt, stop, run_manager, **kwargs)
+        if run_manager:
+            for i in range(0, len(response), 3):
+                run_manager.on_llm_new_token(response[i : i + 3])
+        return response
+
+
+async def _stream(feed, **kwargs):
+    handler = TokenStreamHandler(**kwargs)
+    feed(handler)
+    handler.close()
+    return [token async for token in handler.atokens()], handler
+
+
+def test_token_stream_handler():
+    def feed(handler):
+        for token in ["The answer", " is 42.", "\nSOU", "RCES", ": 1, 2"]:
+            handler.on_llm_new_token(token)
+        handler.on_llm_end(None)
+
+    tokens, handler = asyncio.run(_stream(feed))
+    assert "".join(tokens) == "The answer is 42.", f"unexpected tokens {tokens}"
+    assert not any("SOU" in token for token in tokens), "expected the marker held"
+    assert handler.time_to_first_token is not None
+
+    def feed_lower(handler):
+        for token in ["see the docs ", "sour", "ces: a"]:
+            handler.on_llm_new_token(token)
+        handler.on_llm_end(None)
+
+    tokens, _ = asyncio.run(_stream(feed_lower))
+    assert "".join(tokens) == "see the docs", "expected a case insensitive stop"
+
+    # not streamed, the whole answer (without the sources) is sent on end
+    result = LLMResult(generations=[[Generation(text="answer\nSOURCES: 0")]])
+    tokens, _ = asyncio.run(_stream(lambda handler: handler.on_llm_end(result)))
+    assert tokens == ["answer"], f"unexpected tokens {tokens}"
+
+    tokens, _ = asyncio.run(
+        _stream(lambda handler: handler.on_llm_end(result), stop_pattern=None)
+    )
+    assert "".join(tokens) == "answer\nSOURCES: 0", "expected no stop pattern"
+
+
+async def _pipeline_frames():
+    # stream the answer of the LLM (called in a thread) as the API endpoint does
+    handler = TokenStreamHandler()
+    llm = FakeTokensLLM(responses=[answer_text])
+    loop = asyncio.get_running_loop()
+    task = loop.run_in_executor(
+        None, lambda: llm.predict("what is milvus?", callbacks=[handler])
+    )
+    task.add_done_callback(lambda _: handler.close())
+    frames = [{"type": "token", "token": token} async for token in handler.atokens()]
+    answer = await task
+    frames.append({"type": "final", "answer": answer, "sources": []})
+    return frames
+
+
+class StreamHandler(BaseHTTPRequestHandler):
+    """Fake API server, streams the pipeline frames (server sent events)."""
+
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        body = json.loads(self.rfile.read(length))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        if body["question"] == "fail":
+            frames = [{"type": "error", "error": "no llm"}]
+        else:
+            frames = asyncio.run(_pipeline_frames())
+        for frame in frames:
+            self.wfile.write(sse_frame(frame).encode())
+            self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+def test_stream_pipeline_client():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StreamHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    with Client(url) as client:
+        frames = list(client.stream_pipeline(None, "what is milvus?", "default"))
+        with pytest.raises(ValueError, match="no llm"):
+            list(client.stream_pipeline(None, "fail", "default"))
+    tokens = [frame["token"] for frame in frames if frame["type"] == "token"]
+    assert len(tokens) > 1, "expected the answer streamed in tokens"
+    assert "".join(tokens) == "Milvus is a vector database."
+    assert frames[-1] == {"type": "final", "answer": answer_text, "sources": []}
+
+    async def run():
+        async with AsyncClient(url) as client:
+            return [
+                frame async for frame in client.stream_pipeline(None, "q", "default")
+            ]
+
+    assert asyncio.run(run()) == frames, "expected the same async client frames"
+    server.shutdown()
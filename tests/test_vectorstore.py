@@ -0,0 +1,132 @@
+import json
+
+import numpy as np
+
+from llmapps.app.vectorstore import LocalVectorStore
+
+
+def test_local_vector_store(tmp_path, embeddings):
+    store = LocalVectorStore(embeddings, "docs", persist_directory=str(tmp_path))
+    texts = [f"text {i}" for i in range(100)]
+    metadatas = [{"source": f"doc{i % 4}", "chunk": i} for i in range(100)]
+    ids = store.add_texts(texts, metadatas, ids=[f"id{i}" for i in range(100)])
+    assert len(ids) == 100 and len(store) == 100
+
+    results = store.similarity_search_with_score("text 7", k=3)
+    assert results[0][0].page_content == "text 7", "expected an exact match"
+    assert abs(results[0][1] - 1.0) < 1e-5, "expected cosine similarity of 1"
+    assert results[0][0].metadata == {"source": "doc3", "chunk": 7}
+
+    docs = store.similarity_search("text 7", k=5, filter={"source": "doc1"})
+    assert len(docs) == 5 and all(d.metadata["source"] == "doc1" for d in docs)
+    assert store.similarity_search("text 7", filter={"source": "none"}) == []
+
+    # replace and delete rows
+    store.add_texts(["text 7 v2"], [{"source": "doc3"}], ids=["id7"])
+    store.delete(["id8"])
+    assert len(store) == 99
+    contents = [d.page_content for d in store.similarity_search("text 7", k=100)]
+    assert "text 7" not in contents and "text 8" not in contents
+    assert "text 7 v2" in contents
+
+    # re-open from disk
+    store = LocalVectorStore(embeddings, "docs", persist_directory=str(tmp_path))
+    assert len(store) == 99
+    docs = store.similarity_search("text 7 v2", k=1)
+    assert docs[0].page_content == "text 7 v2", "expected the persisted rows"
+    docs = store.max_marginal_relevance_search("text 3", k=2, fetch_k=10)
+    assert docs[0].page_content == "text 3"
+
+    retriever = store.as_retriever(search_kwargs={"k": 2, "filter": {"chunk": 5}})
+    docs = retriever.get_relevant_documents("text 5")
+    assert [d.page_content for d in docs] == ["text 5"]
+
+
+def test_local_vector_store_recovery(tmp_path, embeddings):
+    store = LocalVectorStore(embeddings, "docs", persist_directory=str(tmp_path))
+    store.add_texts([f"text {i}" for i in range(10)])
+    rows_path = tmp_path / "docs" / "rows.jsonl"
+    log_size = rows_path.stat().st_size
+
+    # an interrupted write, the record was not committed by the meta file
+    with open(rows_path, "a") as fp:
+        fp.write(json.dumps({"id": "lost", "text": "lost", "metadata": {}}) + "\n")
+    store = LocalVectorStore(embeddings, "docs", persist_directory=str(tmp_path))
+    assert len(store) == 10 and rows_path.stat().st_size == log_size
+    store.add_texts(["text 10"])
+    other = LocalVectorStore(embeddings, "docs", persist_directory=str(tmp_path))
+    results = other.similarity_search_with_score("text 10", k=1)
+    assert results[0][0].page_content == "text 10", "expected the rows aligned"
+    assert abs(results[0][1] - 1.0) < 1e-5
+
+    # two instances of the collection load each other's writes
+    store.add_texts(["text a"])
+    assert other.similarity_search("text a", k=1)[0].page_content == "text a"
+    other.add_texts(["text b"])
+    store.add_texts(["text c"])
+    store.delete(store.add_texts(["text d"]))
+    store = LocalVectorStore(embeddings, "docs", persist_directory=str(tmp_path))
+    assert len(store) == 14
+    for text in ["text a", "text b", "text c"]:
+        results = store.similarity_search_with_score(text, k=1)
+        assert results[0][0].page_content == text and results[0][1] > 0.999
+
+
+def test_local_vector_store_ivf(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(3000, 16)).astype(np.float32)
+    flat = LocalVectorStore(None, "flat", persist_directory=str(tmp_path))
+    ivf = LocalVectorStore(
+        None, "ivf", str(tmp_path), index_type="ivf", ivf_min_rows=1000, ivf_probes=16
+    )
+    for store in (flat, ivf):
+        store.add_embeddings([(str(i), v) for i, v in enumerate(vectors)])
+
+    hits = 0
+    for query in rng.normal(size=(20, 16)):
+        expected = {d.page_content for d in flat.similarity_search_by_vector(query, 10)}
+        found = {d.page_content for d in ivf.similarity_search_by_vector(query, 10)}
+        hits += len(expected & found)
+    assert ivf._ivf.num_rows == 3000, "expected the IVF index to be built"
+    assert hits / 200 > 0.8, f"expected IVF recall@10 > 0.8, got {hits / 200}"
+
+
+def test_local_vector_store_quantization(tmp_path):
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(30, 64))
+    vectors = centers[rng.integers(0, 30, 3000)] + rng.normal(size=(3000, 64)) * 0.5
+    queries = vectors[rng.choice(3000, 20)] + rng.normal(size=(20, 64)) * 0.2
+    flat = LocalVectorStore(None, "flat", persist_directory=str(tmp_path))
+    flat.add_embeddings([(str(i), v) for i, v in enumerate(vectors)])
+    expected = [
+        {d.page_content for d in flat.similarity_search_by_vector(q, 10)}
+        for q in queries
+    ]
+
+    for quantization, code_size in [("int8", 64), ("binary", 8), ("pq", 16)]:
+        args = {
+            "quantization": quantization,
+            "quantization_min_rows": "1000",
+            "rescore_factor": 12,
+        }
+        store = LocalVectorStore(None, quantization, str(tmp_path), **args)
+        store.add_embeddings([(str(i), v) for i, v in enumerate(vectors[:2000])])
+        store.similarity_search_by_vector(queries[0], 10)  # trains the quantizer
+        store.add_embeddings([(str(i + 2000), v) for i, v in enumerate(vectors[2000:])])
+        assert store._coded_rows == 3000, "expected the new rows encoded on add"
+        assert store._codes.dim == code_size
+
+        # re-open, the quantization mode and codes are loaded from the collection
+        store = LocalVectorStore(None, quantization, str(tmp_path))
+        assert store.quantization == quantization and store._coded_rows == 3000
+        assert store.quantization_min_rows == 1000 and store.rescore_factor == 12
+        hits = 0
+        for query, expected_docs in zip(queries, expected):
+            docs = store.similarity_search_by_vector(query, 10)
+            hits += len(expected_docs & {d.page_content for d in docs})
+        assert hits / 200 > 0.9, f"expected {quantization} recall > 0.9, got {hits}"
+        results = store.similarity_search_with_score_by_vector(vectors[5], 1)
+        assert abs(results[0][1] - 1.0) < 1e-5, "expected exact re-scored scores"
+
+    store = LocalVectorStore(None, "pq", str(tmp_path), quantization="none")
+    assert store._quantizer is None, "expected the quantization disabled"